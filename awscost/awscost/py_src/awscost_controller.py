@@ -19,21 +19,61 @@ and has the following structure.
     'next_hourly_scan': (time for next)
     'next_summary': (time for next summary)
     'next_excel_file': (time for next Excel file)
+    'next_gather_ri_stats': (time for next RI stats)
+    'next_cost_explorer_reports': (time for next Cost Explorer reports)
 }
 
 As needed more will be added to this state later.
 
+Each tick, every job that is due is dispatched at the same time, see
+get_due_jobs. A summary waits for the scans of its hour, and the Excel file
+waits for the summaries. Summaries missed during an outage are replayed in
+batches of CATCH_UP_BATCH_SIZE hours per tick.
+
+Before a job is invoked, its state key is advanced past it with a conditional
+update_item, see claim_jobs. If two controllers run at once, only one claim
+succeeds and only that controller invokes the job. The hours of jobs that
+failed to invoke are handed back by write_next_state.
+
 """
 
 import boto3
 import json
+from botocore.exceptions import ClientError
 import util.awscost_helper_util as awscost_helper_util
+from util.scan_executor import ScanExecutor, TASK_DONE
 # import util.aws_util as aws_util
 # from datetime import datetime, timedelta # remove
 
 DYNAMODB = boto3.resource('dynamodb')
 AWS_COST_TABLE = DYNAMODB.Table('AWSCost')
 
+WORKER_FUNCTION_NAME = 'awscost-dev'
+
+# work_type -> state key, hours between runs, state keys that must reach the same
+# time_index first, and whether missed time_indexes are each replayed.
+# NOTE: work_type values need to be in sync with awscost_lambda_function entry point.
+# Scans always read the current hour, so they never catch up.
+JOB_TYPES = [
+    ('daily_scan', {'state_key': 'next_daily_scan', 'hours': 24, 'depends_on': [], 'catch_up': False}),
+    ('ec2_scan', {'state_key': 'next_ec2_scan', 'hours': 1, 'depends_on': [], 'catch_up': False}),
+    ('hourly_scan', {'state_key': 'next_hourly_scan', 'hours': 1, 'depends_on': [], 'catch_up': False}),
+    ('gather_ri_stats', {'state_key': 'next_gather_ri_stats', 'hours': 24, 'depends_on': [], 'catch_up': False}),
+    ('summary', {'state_key': 'next_summary', 'hours': 1,
+                 'depends_on': ['next_hourly_scan', 'next_ec2_scan'], 'catch_up': True}),
+    ('make_excel_file', {'state_key': 'next_excel_file', 'hours': 24,
+                         'depends_on': ['next_summary'], 'catch_up': False}),
+    ('cost_explorer_reports', {'state_key': 'next_cost_explorer_reports', 'hours': 24,
+                               'depends_on': [], 'catch_up': False})
+]
+
+# Maximum worker invocations per controller tick, and how many are sent at the same time.
+MAX_JOBS_PER_TICK = 32
+DISPATCH_MAX_WORKERS = 8
+
+# Maximum missed hours of a catch_up job dispatched per tick.
+CATCH_UP_BATCH_SIZE = 24
+
 
 def controller_handler(event, context):
     """
@@ -55,16 +95,19 @@ def controller_handler(event, context):
             print('Failed to read state. state = {}'.format(state))
             return 'Failed'
 
-        # Send commands.
-        result = do_commands(state, time)
+        # Send commands. The scheduled event can lower or raise the fan-out.
+        max_jobs = MAX_JOBS_PER_TICK
+        if isinstance(event, dict) and event.get('max_jobs'):
+            max_jobs = int(event['max_jobs'])
+        result = do_commands(state, time, max_jobs)
+
+        # Hand back the claimed hours that weren't dispatched, even if none were.
+        write_next_state(state, result)
 
         if result.get('Error'):
             print('Failed to do commands. result = {}'.format(result))
             return 'Failed'
 
-        # If success update keys to reflect this.
-        write_next_state(state, result)
-
     except Exception as ex:
         print('Failed: {}'.format(ex.message))
         awscost_helper_util.log_traceback_exception(ex)
@@ -87,7 +130,8 @@ def read_state():
             Key={
                 'awsResource': 'state',
                 'time': 'now'
-            }
+            },
+            ConsistentRead=True
         )
 
         item = response.get('Item')
@@ -114,39 +158,31 @@ def read_state():
 def write_next_state(state, result):
     """
     Based on the state and result write into the database information needed for the
-    next step
+    next step.
 
-    :param state:
-    :param result:
+    The state keys were already advanced by claim_jobs before the jobs were invoked.
+    If a job failed to invoke, its key is moved back to the first failed time_index,
+    so that hour is dispatched again on the next tick. For a catch-up job like
+    summary, the hours after it are dispatched again too.
+
+    :param state: from read_state.
+    :param result: from do_commands. 'jobs' is the list of claimed jobs.
     :return: None
     """
     try:
         print('write_next_state')
         print('result = {}'.format(result))
-        print('state = {}'.format(state))
 
-        event_for_worker = result.get('Success')
-        if event_for_worker:
-            print('wns - event_for_worker = {}'.format(event_for_worker))
-            work_type = event_for_worker.get('work_type')
-            if not work_type:
+        jobs_by_state_key = {}
+        for job in result.get('jobs', []):
+            if not job.get('work_type'):
                 raise ValueError("Write_Next_State: Missing work_type.")
+            jobs_by_state_key.setdefault(job['state_key'], []).append(job)
 
-            # increment time for this work_type in state.
-            if work_type == 'daily_scan':
-                increment_state_index('next_daily_scan', 24)
-            if work_type == 'ec2_scan':
-                increment_state_index('next_ec2_scan')
-            if work_type == 'hourly_scan':
-                increment_state_index('next_hourly_scan')
-            if work_type == 'summary':
-                increment_state_index('next_summary')
-            if work_type == 'make_excel_file':
-                increment_state_index('next_excel_file', 24)
-            if work_type == 'gather_ri_stats':
-                increment_state_index('next_gather_ri_stats', 24)
-            if work_type == 'cost_explorer_reports':
-                increment_state_index('next_cost_explorer_reports', 24)
+        for state_key, jobs in jobs_by_state_key.items():
+            failed_jobs = [j for j in sorted(jobs, key=lambda j: j['time_index']) if not j.get('dispatched')]
+            if failed_jobs:
+                update_state_index(state_key, jobs[0]['claimed_time_index'], failed_jobs[0]['time_index'])
 
     except Exception as ex:
         print('Failed: {}'.format(ex.message))
@@ -154,49 +190,54 @@ def write_next_state(state, result):
         raise ex
 
 
-def do_commands(dc_state, time):
+def do_commands(dc_state, time, max_jobs=MAX_JOBS_PER_TICK):
     """
-    Figure out which command to run and invoke it.
+    Find every job that is due and invoke the worker lambda for each of them
+    at the same time.
 
     :param dc_state:
     :param time: Current time to hour in YYYYMMDD-HH format.
-    :return:
+    :param max_jobs: maximum number of worker invocations for this tick.
+    :return: dict with 'jobs': list of claimed jobs, each with 'dispatched' True or False,
+    and 'Success' if a job was dispatched, or 'Error' if none could be.
     """
+    # Kept on an exception, so write_next_state can hand back the claimed jobs.
+    ret_val = {}
     try:
         print('do_commands')
         print('do_command state = {}'.format(dc_state))
-        ret_val = {}
 
         success = dc_state.get('Success')
         if success:
             state = dc_state.get('state')
             if state:
                 print('starting....')
-                # Look for the following items and run them in the following order.
-                # daily_scan, hourly_scan (non-ec2 stuff), hourly_ec2_scan, summary, excel file.
-                # try to keep ec2 and hourly scan apart in case there is some AWS API calling limit.
-                event_for_worker = get_next_event_type(dc_state, time)
-                print('do - event_for_worker = {}'.format(event_for_worker))
-
+                jobs = get_due_jobs(state, time, max_jobs)
+
+                # Only invoke jobs this controller claimed, so a controller running
+                # at the same time doesn't invoke them too.
+                jobs = claim_jobs(state, jobs)
+                ret_val['jobs'] = jobs
+                if not jobs:
+                    print('No update')
+                    ret_val['Success'] = []
+                    return ret_val
+
+                # One task per job, since jobs on the same work_type are independent time_indexes.
                 lambda_client = boto3.client('lambda')
-                result = lambda_client.invoke(
-                    FunctionName='awscost-dev',
-                    InvocationType='Event',
-                    Payload=json.dumps(event_for_worker)
-                )
-
-                print('invoke lambda result: {}'.format(result))
-                status_code = result.get('StatusCode')
-                print('Worker lambda status_code: {}'.format(status_code))
-                payload = result.get('Payload')
-
-                if payload:
-                    payload_str = result['Payload'].read()
-                    print('Payload: _{}_'.format(payload_str))
-                    if payload_str.startswith('Failed'):
-                        ret_val['Error'] = '{}'.format(payload_str)
-                    else:
-                        ret_val['Success'] = event_for_worker
+                executor = ScanExecutor(max_workers=DISPATCH_MAX_WORKERS)
+                for job in jobs:
+                    label = '{}:{}'.format(job['work_type'], job['time_index'])
+                    executor.submit('lambda', label, invoke_worker, lambda_client, job)
+                tasks = executor.run('dispatch')
+
+                for job, task in zip(jobs, tasks):
+                    job['dispatched'] = bool(task.status == TASK_DONE and task.result)
+
+                if any(job['dispatched'] for job in jobs):
+                    ret_val['Success'] = jobs
+                else:
+                    ret_val['Error'] = 'No worker invocation succeeded for: {}'.format(jobs)
 
             else:
                 msg = 'Failed: do_command No state key found'
@@ -212,118 +253,288 @@ def do_commands(dc_state, time):
     except Exception as ex:
         print('do_commands Failed: {}'.format(ex.message))
         awscost_helper_util.log_traceback_exception(ex)
-        return 'Failed: {}'.format(ex.message)
+        ret_val['Error'] = 'Failed: {}'.format(ex.message)
+        return ret_val
 
 
-def get_next_event_type(dc_state, time):
+def invoke_worker(lambda_client, job):
     """
-    determine the next item that needs to be run, and create the
-    event to pass to the worker lambda function.
-    :param dc_state:
-    :param time:
-    :return:
+    Asynchronous invoke of the worker lambda for one job.
+    :param lambda_client:
+    :param job: from get_due_jobs
+    :return: True if the worker accepted the event.
     """
-    print('get_next_event_type')
-    print('dc_state={}'.format(dc_state))
-    print('time={}'.format(time))
-
-    state = dc_state.get('state')
-    if not state:
-        raise ValueError('No state attribute found')
-
-    print('state={}'.format(state))
-    next_daily_scan_time = state.get('next_daily_scan')
-    next_ec2_scan_time = state.get('next_ec2_scan')
-    next_hourly_scan_time = state.get('next_hourly_scan')
-    next_summary_time = state.get('next_summary')
-    next_excel_file_time = state.get('next_excel_file')
-    next_gather_ri_stats_time = state.get('next_gather_ri_stats')
-    next_cost_explorer_reports = state.get('next_cost_explorer_reports')
-
-    # NOTE: These values need to be in sync with awscost_controller entry point.
-    work_type = 'no_update'
-    time_index = ''
-
-    if next_gather_ri_stats_time:
-        print('ri_stats: {}<{}?'.format(next_gather_ri_stats_time, time))
-        if next_gather_ri_stats_time < time:
-            work_type = 'gather_ri_stats'
-            time_index = next_gather_ri_stats_time
-    if next_excel_file_time:
-        print('excel: {}<{}?'.format(next_excel_file_time, time))
-        if next_excel_file_time < time:
-            work_type = 'make_excel_file'
-            time_index = next_excel_file_time
-    if next_cost_explorer_reports:
-        print('cost_explorer_reports: {}<{}?'.format(next_cost_explorer_reports, time))
-        if next_cost_explorer_reports < time:
-            work_type = 'cost_explorer_reports'
-            time_index = next_cost_explorer_reports
-    if next_summary_time:
-        print('summary: {}<{}?'.format(next_summary_time, time))
-        if next_summary_time < time:
-            work_type = 'summary'
-            time_index = next_summary_time
-    if next_hourly_scan_time:
-        print('hourly: {}<{}?'.format(next_hourly_scan_time, time))
-        if next_hourly_scan_time < time:
-            work_type = 'hourly_scan'
-            time_index = next_hourly_scan_time
-    if next_ec2_scan_time:
-        print('ec2: {}<{}?'.format(next_ec2_scan_time, time))
-        if next_ec2_scan_time < time:
-            work_type = 'ec2_scan'
-            time_index = next_ec2_scan_time
-    if next_daily_scan_time:
-        print('daily: {}<{}?'.format(next_daily_scan_time, time))
-        if next_daily_scan_time < time:
-            work_type = 'daily_scan'
-            time_index = next_daily_scan_time
-    else:
-        print('ERROR: No updates found! dc_state={}'.format(dc_state))
-
-    print('work_type={}, time_index={}'.format(work_type, time_index))
+    event_for_worker = {
+        'work_type': job['work_type'],
+        'time_index': job['time_index']
+    }
+    result = lambda_client.invoke(
+        FunctionName=WORKER_FUNCTION_NAME,
+        InvocationType='Event',
+        Payload=json.dumps(event_for_worker)
+    )
+
+    status_code = result.get('StatusCode')
+    print('Worker lambda {} status_code: {}'.format(event_for_worker, status_code))
+    payload = result.get('Payload')
+    if payload:
+        payload_str = payload.read()
+        if payload_str.startswith(b'Failed'):
+            print('Payload: _{}_'.format(payload_str))
+            return False
+    return status_code == 202
+
+
+def get_due_jobs(state, time, max_jobs=MAX_JOBS_PER_TICK):
+    """
+    Determine every (work_type, time_index) that needs to be run, in JOB_TYPES order.
+
+    A time_index is due when it is before the current hour. It is ready when each
+    state key it depends on is past it, i.e. the upstream job for that hour was
+    dispatched on an earlier tick.
+
+    Jobs with catch_up are replayed one time_index per job, up to CATCH_UP_BATCH_SIZE
+    per tick. Other jobs only make sense for the latest hour, so missed
+    time_indexes are skipped and a single job is made for the newest ready one.
+
+    :param state: 'state' attribute of the state row.
+    :param time: Current time to hour in YYYYMMDD-HH format.
+    :param max_jobs: maximum number of jobs returned.
+    :return: list of dict with 'work_type', 'time_index', 'state_key' and 'advance_hours'
+    """
+    print('get_due_jobs time={} state={}'.format(time, state))
+    ret_val = []
+
+    for work_type, job_type in JOB_TYPES:
+        state_key = job_type['state_key']
+        next_time_index = state.get(state_key)
+        if not next_time_index:
+            print('WARN: No {} in state.'.format(state_key))
+            continue
+
+        ready_time_indexes = []
+        curr_time_index = next_time_index
+        while curr_time_index < time:
+            if not is_ready(state, job_type['depends_on'], curr_time_index):
+                break
+            ready_time_indexes.append(curr_time_index)
+            curr_time_index = awscost_helper_util.increment_time_index(curr_time_index, job_type['hours'])
+
+        print('{}: {}<{}? ready={}'.format(work_type, next_time_index, time, len(ready_time_indexes)))
+        if not ready_time_indexes:
+            continue
+
+        if job_type['catch_up']:
+            for time_index in ready_time_indexes[:CATCH_UP_BATCH_SIZE]:
+                ret_val.append(make_job(work_type, time_index, state_key, job_type['hours']))
+        else:
+            advance_hours = job_type['hours'] * len(ready_time_indexes)
+            ret_val.append(make_job(work_type, ready_time_indexes[-1], state_key, advance_hours))
+
+    if len(ret_val) > max_jobs:
+        print('{} jobs due. Dispatching the first {}.'.format(len(ret_val), max_jobs))
+        ret_val = ret_val[:max_jobs]
+
+    print('jobs={}'.format([(j['work_type'], j['time_index']) for j in ret_val]))
+    return ret_val
+
+
+def is_ready(state, depends_on, time_index):
+    """
+    :param state:
+    :param depends_on: list of state keys.
+    :param time_index:
+    :return: True if each state key in depends_on is past time_index.
+    A state key holds the next hour still to run, so when it equals time_index
+    the upstream job for that hour hasn't been dispatched yet.
+    """
+    for state_key in depends_on:
+        upstream_time_index = state.get(state_key)
+        if upstream_time_index and upstream_time_index <= time_index:
+            return False
+    return True
+
 
+def make_job(work_type, time_index, state_key, advance_hours):
+    """
+    :param work_type:
+    :param time_index:
+    :param state_key:
+    :param advance_hours: hours to move state_key forward once this job is dispatched.
+    :return: dict
+    """
     return {
         'work_type': work_type,
-        'time_index': time_index
+        'time_index': time_index,
+        'state_key': state_key,
+        'advance_hours': advance_hours
     }
 
 
-def increment_state_index(state_key, add_hours=1):
+def claim_jobs(state, jobs):
     """
+    Advance each state key past its jobs before they are invoked. Jobs on the same
+    state key are claimed together with one conditional update_item. If another
+    controller already changed the key, its jobs are skipped.
 
-    :param state_key:
-    :return:
+    :param state: 'state' attribute of the state row, as read by read_state.
+    :param jobs: from get_due_jobs
+    :return: list of claimed jobs, each with 'claimed_time_index', the value the key was set to.
     """
-    response = AWS_COST_TABLE.get_item(
-        Key={
-            'awsResource': 'state',
-            'time': 'now'
-        }
-    )
+    add_hours_by_state_key = {}
+    for job in jobs:
+        add_hours = add_hours_by_state_key.get(job['state_key'], 0)
+        add_hours_by_state_key[job['state_key']] = add_hours + job['advance_hours']
+
+    claimed_time_indexes = {}
+    for state_key, add_hours in add_hours_by_state_key.items():
+        prev_time_index = state[state_key]
+        claimed_time_index = awscost_helper_util.increment_time_index(prev_time_index, add_hours)
+        if update_state_index(state_key, prev_time_index, claimed_time_index):
+            claimed_time_indexes[state_key] = claimed_time_index
+        else:
+            print('Skip {} jobs. Another controller claimed them.'.format(state_key))
 
-    item = response.get('Item')
-    if item:
-        print('Item = {}'.format(item))
-        state = item.get('state')
-        if not state:
-            raise ValueError('Could not find attribute "state"')
-
-        time_index = state.get(state_key)
-        if not time_index:
-            print('ERROR. Could not find key: {}'.format(state_key))
-            print('state={}'.format(state))
-            raise ValueError('Could not find key: {}'.format(state_key))
-
-        next_time_index = awscost_helper_util.increment_time_index(time_index, add_hours)
-        print('Setting {} to {}'.format(state_key, next_time_index))
-        state[state_key] = next_time_index
-
-    AWS_COST_TABLE.put_item(
-        Item={
-            'awsResource': 'state',
-            'time': 'now',
-            'state': state
-        }
-    )
+    ret_val = []
+    for job in jobs:
+        if job['state_key'] in claimed_time_indexes:
+            job['claimed_time_index'] = claimed_time_indexes[job['state_key']]
+            ret_val.append(job)
+    return ret_val
+
+
+def update_state_index(state_key, prev_time_index, next_time_index):
+    """
+    Set one state key with a single conditional update_item. The update only
+    happens if the key still has prev_time_index, so a controller running at the
+    same time can't move it back or claim the same jobs.
+
+    :param state_key: like: next_summary
+    :param prev_time_index: value this controller read or set.
+    :param next_time_index:
+    :return: True if updated, False if another controller already changed the key.
+    """
+    print('Setting {} from {} to {}'.format(state_key, prev_time_index, next_time_index))
+    try:
+        AWS_COST_TABLE.update_item(
+            Key={
+                'awsResource': 'state',
+                'time': 'now'
+            },
+            UpdateExpression='SET #state.#key = :next',
+            ConditionExpression='#state.#key = :prev',
+            ExpressionAttributeNames={
+                '#state': 'state',
+                '#key': state_key
+            },
+            ExpressionAttributeValues={
+                ':next': next_time_index,
+                ':prev': prev_time_index
+            }
+        )
+        return True
+    except ClientError as ce:
+        if ce.response['Error']['Code'] != 'ConditionalCheckFailedException':
+            raise
+        print('WARN: {} is no longer {}. Another controller advanced it.'.format(state_key, prev_time_index))
+        return False
+
+
+# Unit tests below here.
+def test_scans_and_summary_not_in_same_tick():
+    """
+    The summary of an hour is only due on a tick after the scans of that hour
+    were dispatched, and the Excel file waits for the summaries the same way.
+    :return: None
+    """
+    state = {
+        'next_daily_scan': '20190301-10',
+        'next_ec2_scan': '20190301-10',
+        'next_hourly_scan': '20190301-10',
+        'next_gather_ri_stats': '20190301-10',
+        'next_summary': '20190301-10',
+        'next_excel_file': '20190301-10',
+        'next_cost_explorer_reports': '20190301-10'
+    }
+
+    # Tick at 11. The scans of 10 are due, the summary and Excel file aren't.
+    jobs = get_due_jobs(state, '20190301-11')
+    work_types = [j['work_type'] for j in jobs]
+    assert 'hourly_scan' in work_types and 'ec2_scan' in work_types, work_types
+    assert 'summary' not in work_types, work_types
+    assert 'make_excel_file' not in work_types, work_types
+
+    # Tick at 12, after the scans of 10 were dispatched. The summary of 10 is due,
+    # and never in the same tick as a scan of the same hour.
+    for job in jobs:
+        state[job['state_key']] = awscost_helper_util.increment_time_index(
+            job['time_index'], job['advance_hours'])
+    jobs = get_due_jobs(state, '20190301-12')
+    summary_jobs = [j for j in jobs if j['work_type'] == 'summary']
+    assert [j['time_index'] for j in summary_jobs] == ['20190301-10'], summary_jobs
+    scan_time_indexes = [j['time_index'] for j in jobs if j['work_type'] in ('ec2_scan', 'hourly_scan')]
+    assert '20190301-10' not in scan_time_indexes, scan_time_indexes
+    assert 'make_excel_file' not in [j['work_type'] for j in jobs]
+    print('test_scans_and_summary_not_in_same_tick passed.')
+
+
+class _FakeStateTable(object):
+    """
+    Stands in for AWS_COST_TABLE in tests. Only the state map and the update_item
+    calls made by update_state_index.
+    """
+    def __init__(self, state):
+        self.state = dict(state)
+
+    def update_item(self, **kwargs):
+        state_key = kwargs['ExpressionAttributeNames']['#key']
+        values = kwargs['ExpressionAttributeValues']
+        if self.state.get(state_key) != values[':prev']:
+            raise ClientError({'Error': {'Code': 'ConditionalCheckFailedException'}}, 'UpdateItem')
+        self.state[state_key] = values[':next']
+
+
+def test_overlapping_controllers_claim_once():
+    """
+    Two controllers that read the same state each claim the jobs before invoking
+    them, so only the first one invokes them. A job that failed to invoke is handed back.
+    :return: None
+    """
+    global AWS_COST_TABLE
+    state = {
+        'next_ec2_scan': '20190301-10',
+        'next_hourly_scan': '20190301-10',
+        'next_summary': '20190301-08'
+    }
+    saved_table = AWS_COST_TABLE
+    AWS_COST_TABLE = _FakeStateTable(state)
+    try:
+        jobs = get_due_jobs(state, '20190301-11')
+        first_jobs = claim_jobs(state, [dict(j) for j in jobs])
+        second_jobs = claim_jobs(state, [dict(j) for j in jobs])
+        assert len(first_jobs) == len(jobs) == 4, first_jobs
+        assert second_jobs == [], second_jobs
+        assert AWS_COST_TABLE.state['next_summary'] == '20190301-10', AWS_COST_TABLE.state
+
+        # Summary of 08 was invoked, 09 failed. 09 is dispatched again next tick.
+        for job in first_jobs:
+            job['dispatched'] = job['time_index'] != '20190301-09'
+        write_next_state(state, {'jobs': first_jobs})
+        assert AWS_COST_TABLE.state['next_summary'] == '20190301-09', AWS_COST_TABLE.state
+        assert AWS_COST_TABLE.state['next_hourly_scan'] == '20190301-11', AWS_COST_TABLE.state
+    finally:
+        AWS_COST_TABLE = saved_table
+    print('test_overlapping_controllers_claim_once passed.')
+
+
+# Use main for quick tests.
+if __name__ == '__main__':
+    try:
+        test_scans_and_summary_not_in_same_tick()
+        test_overlapping_controllers_claim_once()
+
+    except Exception as ex:
+        # log error.
+        print('Exception: {}'.format(ex.message))
+        awscost_helper_util.log_traceback_exception(ex)
+        raise
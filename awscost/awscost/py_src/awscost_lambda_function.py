@@ -11,13 +11,41 @@ import pandas as pd
 import numpy as np
 import util.awscost_helper_util as awscost_helper_util
 import util.aws_util as aws_util
-from boto3.dynamodb.conditions import Key, Attr
+import util.scan_executor as scan_executor
+import util.ami_cache as ami_cache
+import util.series_cache as series_cache
+import util.price_catalog as price_catalog
+import util.write_buffer as write_buffer
+import util.rollups as rollups
+import util.report_writer as report_writer
+import util.cost_explorer_reports as cost_explorer_reports
+from boto3.dynamodb.conditions import Attr
 from dateutil.tz import tzutc
 
 DYNAMODB = boto3.resource('dynamodb')
 AWS_COST_TABLE = DYNAMODB.Table('AWSCost')
 AWS_COST_MAP_TABLE = DYNAMODB.Table('AWSCostMap')
 
+# boto3 clients are thread-safe, so one is shared by all scan threads. Resources
+# like DYNAMODB and its Tables aren't, so scan threads only use this client.
+DYNAMODB_CLIENT = boto3.client('dynamodb')
+
+# AWSCost rows from a scan are written with batch_write_item when a scan finishes.
+AWS_COST_WRITE_BUFFER = write_buffer.BatchWriteBuffer(DYNAMODB_CLIENT, 'AWSCost', ['awsResource', 'time'])
+
+# Scans fan out across account/region pairs on a thread pool.
+SCAN_MAX_WORKERS = 16
+SCAN_TASK_TIMEOUT_SEC = 300
+# Task starts per second for each AWS service, to stay under API throttling limits.
+SCAN_API_RATE_LIMITS = {
+    'ec2': 5,
+    'rds': 10,
+    'dynamodb': 10,
+    'elasticache': 10,
+    'redshift': 10,
+    'es': 5
+}
+
 
 def lambda_handler(event, context):
     """
@@ -58,14 +86,21 @@ def lambda_handler(event, context):
             do_cost_explorer_reports(time_index)
         elif work_type == 'make_team_ec2_cost_report':
             do_make_team_ec2_cost_report(event)
+        elif work_type == 'rebuild_rollups':
+            do_rebuild_rollups(event)
         elif work_type == 'repair_summaries':
             print("Nothing to repair")
             # repair_redshift_and_es_daily_summaries_dec_03_2018_to_dec_20_2018(event, context)
         else:
             raise ValueError('Unrecognized work_type.  work_type={}'.format(work_type))
 
+        # Anything not flushed by the work_type above.
+        flush_aws_cost_writes(work_type)
+
         print("Time remaining: {} ms".format(context.get_remaining_time_in_millis()))
         print('Memory Limit: {}'.format(context.memory_limit_in_mb))
+        print('Session cache: {}'.format(awscost_helper_util.get_session_cache_stats()))
+        print('Client cache: {}'.format(aws_util.get_client_cache_stats()))
 
         # Check aws resource utilization.
 
@@ -76,6 +111,10 @@ def lambda_handler(event, context):
     except Exception as ex:
         print('Failed: {}'.format(ex.message))
         awscost_helper_util.log_traceback_exception(ex)
+        try:
+            flush_aws_cost_writes('failed {}'.format(event.get('work_type')))
+        except Exception as flush_ex:
+            print('Failed to flush AWSCost writes: {}'.format(flush_ex))
         return 'Failed: {}'.format(ex.message)
 
 
@@ -100,9 +139,17 @@ def do_make_team_ec2_cost_report(event):
         aws_region_list = ['us-east-1', 'us-west-2']
         prefix = 'ec2os'
 
-        # Get the data_frames per account
-        data_frames = {}
+        date_str = awscost_helper_util.get_awscost_daily_time_format()
+
+        #  Written straight into the S3 bucket.
+        bucket_name = 'awscost-data'
+        folder_name = awscost_helper_util.get_awscost_daily_time_format()
+        file_name = '{}-AwsEC2TeamReport.xlsx'.format(date_str)
+        report = report_writer.ReportWriter('s3://{}/{}/{}'.format(bucket_name, folder_name, file_name))
+
+        # Each data_frame is added to the report as soon as it is made, then dropped.
         price_data = {}
+        num_data_frames = 0
         for curr_account in awscost_helper_util.AWS_ACCOUNTS:
             for curr_region in aws_region_list:
                 key = '{}:{}:{}'.format(prefix, curr_account, curr_region)
@@ -112,117 +159,137 @@ def do_make_team_ec2_cost_report(event):
 
                 if curr_df is not None:
                     print('Adding: {}'.format(key))
-                    data_frames[key] = curr_df
+                    num_data_frames += add_team_report_sheet(report, key, curr_df)
                     # Convert hours into prices.
                     curr_price_df = make_price_df_from_hourly_df(curr_df, curr_region,price_data)
+                    del curr_df
                     if curr_price_df is not None:
                         price_key = 'price:{}'.format(key)
-                        data_frames[price_key] = curr_price_df
+                        num_data_frames += add_team_report_sheet(report, price_key, curr_price_df)
+                        del curr_price_df
                     else:
                         print("WARN: No Price DataFrame for: {}".format(key))
                 else:
                     print('WARN: No data_frame for key: {}'.format(key))
 
-        # write out data-frames into an report.
-        date_str = awscost_helper_util.get_awscost_daily_time_format()
-
-        path = '/tmp/AwsCostEC2TeamReport.xlsx'
-        excel_file = open(path, "w+")
-        excel_file.close()
-        writer = pd.ExcelWriter(path, engine='openpyxl')
-
-        num_data_frames = len(data_frames)
-        print('Adding: {} pages to Excel report'.format(num_data_frames))
+        print('Added: {} pages to Excel report'.format(num_data_frames))
         if num_data_frames == 0:
             print('WARN: No dataframes to add to Excel file.')
 
-        for curr_key in data_frames:
-            try:
-                print('Add {} to Excel file.'.format(curr_key))
-                curr_df = data_frames.get(curr_key)
-                sheet_name = curr_key.replace(':', ' ')
-                sheet_name = sheet_name.replace('ec2os',' ')
-                sheet_name = sheet_name.strip()
+        report.close()
 
-                curr_df.to_excel(writer, sheet_name)
-            except Exception as ex:
-                print('Failed: {}'.format(ex.message))
-                awscost_helper_util.log_traceback_exception(ex)
-                print('Continue making excel file')
-                # don't return just continue
-
-        writer.save()
+        print('S3 upload: {} / {} / {}'.format(bucket_name, folder_name, file_name))
 
-        #  S3 copy this file into a bucket, or attach it to an e-mail.
-        bucket_name = 'awscost-data'
-        folder_name = awscost_helper_util.get_awscost_daily_time_format()
-        file_name = '{}-AwsEC2TeamReport.xlsx'.format(date_str)
+    except Exception as ex:
+        print('Failed: {}'.format(ex.message))
+        awscost_helper_util.log_traceback_exception(ex)
+        return 'Failed: {}'.format(ex.message)
 
-        s3 = boto3.resource('s3')
-        s3.meta.client.upload_file(
-            path, bucket_name,
-            '{}/{}'.format(folder_name, file_name),
-        )
 
-        print('S3 upload: {} / {} / {}'.format(bucket_name, folder_name, file_name))
+def add_team_report_sheet(report, key, data_frame):
+    """
+    Add a page to the team EC2 cost report.
+    :param report: ReportWriter
+    :param key: like: ec2os:cti:us-east-1 or price:ec2os:cti:us-east-1
+    :param data_frame:
+    :return: 1 if the page was added, 0 if it failed.
+    """
+    try:
+        print('Add {} to Excel file.'.format(key))
+        sheet_name = key.replace(':', ' ')
+        sheet_name = sheet_name.replace('ec2os',' ')
+        sheet_name = sheet_name.strip()
 
+        report.write_sheet(sheet_name, data_frame)
+        return 1
     except Exception as ex:
         print('Failed: {}'.format(ex.message))
         awscost_helper_util.log_traceback_exception(ex)
-        return 'Failed: {}'.format(ex.message)
+        print('Continue making excel file')
+        # don't return just continue
+        return 0
 
 
 def make_price_df_from_hourly_df(hourly_df, region, price_data):
     """
     Take the EC2 Hourly data and convert it into hourly cost data.
     The data will come in as columns with the EC2 type and OS.  Look up the hourly
-    cost of that type and and then create the hourly cost.
+    cost of that type in the EC2 price catalog and multiply the whole data_frame by it at once.
+
+    Spot instances are priced at the OnDemand price, so are an upper bound.
+    Unknown os_type '?' is priced as linux.
 
     :param hourly_df: Panda data_frame per account with hourly data.
     :param region: AWS region.   us-east-1 or us-west-2
     :param price_data: dictionary with cache of prices. Example key:  "linux:c3.2xlarge:us-west-2"
-    :return: Panda DataFrame the converts hours into cost.
+    :return: Panda DataFrame the converts hours into cost. None if prices aren't available.
     """
-    print('Error make_price_df_from_hourly_df() Not Implemented yet!!')
+    try:
+        price_series = None
+        num_found = 0
+        num_not_found = 0
+
+        column_prices = {}
+        for curr_column in hourly_df.columns:
+            os_type, instance_type = get_os_and_instance_type_from_column(curr_column)
+
+            # look for price in cache first.
+            price_key = '{}:{}:{}'.format(os_type, instance_type, region)
+            if price_key in price_data:
+                num_found += 1
+            else:
+                num_not_found += 1
+                if price_series is None:
+                    price_series = price_catalog.get_price_series(region)
+                os_name = price_catalog.normalize_os_type(os_type)
+                price_data[price_key] = price_series.get((instance_type, os_name), np.nan)
 
-    num_found = 0
-    num_not_found = 0
+            column_prices[curr_column] = price_data[price_key]
 
-    for curr_column in hourly_df:
-        print('TEMP: curr_column = {}'.format(curr_column))
-        part = curr_column.split('-')
-        os_type = part[0]
-        instance_type = part[1]
+        print('Price cache:  found: {}, not found: {}'.format(num_found, num_not_found))
+        num_prices_cached = len(price_data)
+        print('Price cache: size = {}'.format(num_prices_cached))
 
-        if os_type == '?':
-            os_type = 'linux'
+        prices = pd.Series(column_prices, dtype=float)
+        no_price_columns = list(prices[prices.isnull()].index)
+        if no_price_columns:
+            print('WARN: No price for columns: {}'.format(no_price_columns))
 
-        # look for price in cache first.
-        price_key = '{}:{}:{}'.format(os_type, instance_type, region)
-        cached_price = price_data.get(price_key)
+        return hourly_df.astype(float).mul(prices, axis='columns')
+
+    except Exception as ex:
+        # log error.
+        print('Exception: {}'.format(ex.message))
+        awscost_helper_util.log_traceback_exception(ex)
+        return None
 
-        if cached_price is None:
-            num_not_found += 1
-            price = awscost_helper_util.get_price(region, instance_type, os_type)
-            print('{} costs {} / hr'.format(price_key, price))
-            price_data[price_key] = price
-        else:
-            # found price in cache.
-            num_found += 1
 
-    print('Price cache:  found: {}, not found: {}'.format(num_found, num_not_found))
-    num_prices_cached = len(price_data)
-    print('Price cache: size = {}'.format(num_prices_cached))
+def get_os_and_instance_type_from_column(column_name):
+    """
+    Split an ec2os column name into os_type and instance type.
+    :param column_name: like: linux-c5.large | spot-rhel-m5.xlarge | ?-t2.micro
+    :return: tuple (os_type, instance_type) like: ('linux', 'c5.large')
+    """
+    if column_name.startswith('spot-'):
+        column_name = column_name[len('spot-'):]
 
+    part = column_name.split('-', 1)
+    if len(part) != 2:
+        return '?', column_name
 
-    # raise ValueError("Warning 'make_price_df_from_hourly_df()' not implemented. Still need to create data_frame. STOP UNTIL IMPLEMENTED.")
+    os_type = part[0]
+    instance_type = part[1]
+    if os_type == '?':
+        os_type = 'linux'
+
+    return os_type, instance_type
 
 
 def do_cost_explorer_reports(time_index):
     """
-    Call the Cost Explorer reports, and put them into an S3 bucket for the current day in a
-    CSV text format that can be imported into a Jupyter Notebook. The Cost Explorer reports
-    are in the NetEng account.
+    Call the Cost Explorer reports, and put them into an S3 bucket for the current day as
+    one gzipped JSON file that can be imported into a Jupyter Notebook. The Cost Explorer reports
+    are in the NetEng account. See util/cost_explorer_reports.py
 
     :param time_index: Not sure this will be useful, since the report is just for that time.
     :return:
@@ -246,25 +313,13 @@ def do_cost_explorer_reports(time_index):
         start_date = awscost_helper_util.get_cost_explorer_format_yyyy_mm_dd(-8)
         end_date = awscost_helper_util.get_cost_explorer_format_yyyy_mm_dd(-1)
 
-        write_reservation_coverage_report(ce_client, 'ec2', start_date, end_date)
-        write_reservation_utilization_report(ce_client, 'ec2', start_date, end_date)
-        write_reservation_purchase_recommendation_report(ce_client, 'ec2', start_date, end_date)
-
-        write_reservation_coverage_report(ce_client, 'rds', start_date, end_date)
-        write_reservation_utilization_report(ce_client, 'rds', start_date, end_date)
-        write_reservation_purchase_recommendation_report(ce_client, 'rds', start_date, end_date)
+        # Coverage, utilization and recommendations for each service, fetched at the same time.
+        # Responses are cached in S3, so running again the same day doesn't call Cost Explorer.
+        s3_client = boto3.client('s3')
+        reports = cost_explorer_reports.fetch_all_reports(ce_client, start_date, end_date, s3_client=s3_client)
 
-        write_reservation_coverage_report(ce_client, 'elasticache', start_date, end_date)
-        write_reservation_utilization_report(ce_client, 'elasticache', start_date, end_date)
-        write_reservation_purchase_recommendation_report(ce_client, 'elasticache', start_date, end_date)
-
-        write_reservation_coverage_report(ce_client, 'es', start_date, end_date)
-        write_reservation_utilization_report(ce_client, 'es', start_date, end_date)
-        write_reservation_purchase_recommendation_report(ce_client, 'es', start_date, end_date)
-
-        write_reservation_coverage_report(ce_client, 'redshift', start_date, end_date)
-        write_reservation_utilization_report(ce_client, 'redshift', start_date, end_date)
-        write_reservation_purchase_recommendation_report(ce_client, 'redshift', start_date, end_date)
+        date_for_s3_dir = awscost_helper_util.get_awscost_daily_time_format()
+        cost_explorer_reports.write_daily_reports(date_for_s3_dir, start_date, end_date, reports, s3_client=s3_client)
 
     except Exception as ex:
         print('Failed: {}'.format(ex.message))
@@ -286,92 +341,54 @@ def do_make_excel_file(time_index):
     print('do_make_excel_file')
     print('time_index = {}'.format(time_index))
 
-    df_test_page = create_test_page_data_frame()
-
-    # Get each of the excel files here
-    df_rds_east_hourly = create_hourly_data_frame('rds', 'us-east-1', time_index)
-    df_rds_west_hourly = create_hourly_data_frame('rds', 'us-west-2', time_index)
-    df_dynamodb_east_hourly = create_hourly_data_frame('dynamodb', 'us-east-1', time_index)
-    df_dynamodb_west_hourly = create_hourly_data_frame('dynamodb', 'us-west-2', time_index)
-    df_elasticache_east_hourly = create_hourly_data_frame('elasticache', 'us-east-1', time_index)
-    df_elasticache_west_hourly = create_hourly_data_frame('elasticache', 'us-west-2', time_index)
-    df_ec2_east_hourly = create_hourly_data_frame('ec2', 'us-east-1', time_index)
-    df_ec2_west_hourly = create_hourly_data_frame('ec2', 'us-west-2', time_index)
-    df_ec2os_east_hourly = create_hourly_data_frame('ec2os', 'us-east-1', time_index)
-    df_ec2os_west_hourly = create_hourly_data_frame('ec2os', 'us-west-2', time_index)
-    df_ri_ec2_east_hourly = create_hourly_data_frame('ri-ec2', 'us-east-1', time_index) #create_daily
-    df_ri_ec2_west_hourly = create_hourly_data_frame('ri-ec2', 'us-west-2', time_index) #create_daily
-    df_ri_rds_east_hourly = create_hourly_data_frame('ri-rds', 'us-east-1', time_index) #create_daily
-    df_ri_rds_west_hourly = create_hourly_data_frame('ri-rds', 'us-west-2', time_index) #create_daily
+    # (prefix, region, hourly tab, P95 tab). Each data frame is loaded, written and dropped
+    # before the next one, so only one is in memory at a time.
+    report_sheets = [
+        ('dynamodb', 'us-east-1', 'dynamo-us-east-1', 'P95 Dynamo East'),
+        ('dynamodb', 'us-west-2', 'dynamo-us-west-2', 'P95 Dynamo West'),
+        ('rds', 'us-east-1', 'rds-us-east-1', 'P95 RDS East'),
+        ('rds', 'us-west-2', 'rds-us-west-2', 'P95 RDS West'),
+        ('elasticache', 'us-east-1', 'elasticache-us-east-1', 'P95 Elasticach East'),
+        ('elasticache', 'us-west-2', 'elasticache-us-west-2', 'P95 Elasticach West'),
+        ('ec2', 'us-east-1', 'ec2-us-east-1', 'P95 EC2 East'),
+        ('ec2', 'us-west-2', 'ec2-us-west-2', 'P95 EC2 West'),
+        ('ec2os', 'us-east-1', 'ec2os-us-east-1', 'P95 EC2OS East'),
+        ('ec2os', 'us-west-2', 'ec2os-us-west-2', 'P95 EC2OS West'),
+        ('ri-ec2', 'us-east-1', 'ri-ec2-us-east-1', 'P95 RI-EC2 East'),
+        ('ri-ec2', 'us-west-2', 'ri-ec2-us-west-2', 'P95 RI-EC2 West'),
+        ('ri-rds', 'us-east-1', 'ri-rds-us-east-1', 'P95 RI-RDS East'),
+        ('ri-rds', 'us-west-2', 'ri-rds-us-west-2', 'P95 RI-RDS West')
+    ]
     # es_daily_data_frame = create_daily_data_frame('es')
     # redshift_daily_data_frame = create_daily_data_frame('redshift')
     # summary_data_frame
 
-    # Test creating the Excel file.
-    # date_str = datetime.datetime.today().strftime('%m-%d')
     date_str = awscost_helper_util.get_awscost_daily_time_format()
 
-    path = '/tmp/AwsCostRIReport.xlsx'
-    excel_file = open(path, "w+")
-    excel_file.close()
-
-    writer = pd.ExcelWriter(path, engine='openpyxl')
-
-    try:
-        df_test_page.to_excel(writer, 'TestPage')
-        df_dynamodb_east_hourly.to_excel(writer, 'dynamo-us-east-1')
-        df_dynamodb_west_hourly.to_excel(writer, 'dynamo-us-west-2')
-        df_rds_east_hourly.to_excel(writer, 'rds-us-east-1')
-        df_rds_west_hourly.to_excel(writer, 'rds-us-west-2')
-        df_elasticache_east_hourly.to_excel(writer, 'elasticache-us-east-1')
-        df_elasticache_west_hourly.to_excel(writer, 'elasticache-us-west-2')
-        df_ec2_east_hourly.to_excel(writer, 'ec2-us-east-1')
-        df_ec2_west_hourly.to_excel(writer, 'ec2-us-west-2')
-        df_ec2os_east_hourly.to_excel(writer, 'ec2os-us-east-1')
-        df_ec2os_west_hourly.to_excel(writer, 'ec2os-us-west-2')
-        df_ri_ec2_east_hourly.to_excel(writer, 'ri-ec2-us-east-1')
-        df_ri_ec2_west_hourly.to_excel(writer, 'ri-ec2-us-west-2')
-        df_ri_rds_east_hourly.to_excel(writer, 'ri-rds-us-east-1')
-        df_ri_rds_west_hourly.to_excel(writer, 'ri-rds-us-west-2')
-    except Exception as ex:
-        print('Failed: {}'.format(ex.message))
-        awscost_helper_util.log_traceback_exception(ex)
-        print('Continue making excel file')
-        # don't return just continue
-
-    try:
-        create_stats_from_data_frame(df_dynamodb_east_hourly, writer, 'P95 Dynamo East')
-        create_stats_from_data_frame(df_dynamodb_west_hourly, writer, 'P95 Dynamo West')
-        create_stats_from_data_frame(df_rds_east_hourly, writer, 'P95 RDS East')
-        create_stats_from_data_frame(df_rds_west_hourly, writer, 'P95 RDS West')
-        create_stats_from_data_frame(df_elasticache_east_hourly, writer, 'P95 Elasticach East')
-        create_stats_from_data_frame(df_elasticache_west_hourly, writer, 'P95 Elasticach West')
-        create_stats_from_data_frame(df_ec2_east_hourly, writer, 'P95 EC2 East')
-        create_stats_from_data_frame(df_ec2_west_hourly, writer, 'P95 EC2 West')
-        create_stats_from_data_frame(df_ec2os_east_hourly, writer, 'P95 EC2OS East')
-        create_stats_from_data_frame(df_ec2os_west_hourly, writer, 'P95 EC2OS West')
-        create_stats_from_data_frame(df_ri_ec2_east_hourly, writer, 'P95 RI-EC2 East')
-        create_stats_from_data_frame(df_ri_rds_east_hourly, writer, 'P95 RI-RDS East')
-        create_stats_from_data_frame(df_ri_rds_west_hourly, writer, 'P95 RI-RDS West')
-        create_stats_from_data_frame(df_ri_ec2_west_hourly, writer, 'P95 RI-EC2 West')
-    except Exception as ex:
-        print('Failed: {}'.format(ex.message))
-        awscost_helper_util.log_traceback_exception(ex)
-        print('Continue making excel file')
-        # don't return just continue.
-
-    writer.save()
-
-    #  S3 copy this file into a bucket, or attach it to an e-mail.
+    #  Written straight into the S3 bucket.
     bucket_name = 'awscost-data'
     folder_name = awscost_helper_util.get_awscost_daily_time_format()
     file_name = '{}-AwsRIUsageReport.xlsx'.format(date_str)
+    report = report_writer.ReportWriter('s3://{}/{}/{}'.format(bucket_name, folder_name, file_name))
 
-    s3 = boto3.resource('s3')
-    s3.meta.client.upload_file(
-        path, bucket_name,
-        '{}/{}'.format(folder_name, file_name),
-    )
+    report.write_sheet('TestPage', create_test_page_data_frame())
+
+    # Hourly tabs go before the P95 tabs.
+    num_hourly_sheets = 1
+    for prefix, region, tab_name, p95_tab_name in report_sheets:
+        try:
+            df_hourly = create_hourly_data_frame(prefix, region, time_index)
+            report.write_sheet(tab_name, df_hourly, index=num_hourly_sheets)
+            num_hourly_sheets += 1
+            create_stats_from_rollups('{}:roku:{}'.format(prefix, region), time_index, df_hourly, report, p95_tab_name)
+            del df_hourly
+        except Exception as ex:
+            print('Failed: {}'.format(ex.message))
+            awscost_helper_util.log_traceback_exception(ex)
+            print('Continue making excel file')
+            # don't return just continue
+
+    report.close()
 
 
 def do_daily_scan(time_index):
@@ -383,12 +400,17 @@ def do_daily_scan(time_index):
     print('do_daily_scan')
     print('time = {}'.format(time_index))
 
+    executor = create_scan_executor()
     active_regions = ['us-east-1', 'us-west-2']
     aws_account = awscost_helper_util.AWS_ACCOUNTS
     for name, account_num in aws_account.iteritems():
         for region in active_regions:
-            check_red_shift_node_types(name, account_num, region, time_index)
-            check_elastic_search_service(name, account_num, region, time_index)
+            label = '{}:{}'.format(name, region)
+            executor.submit('redshift', label, check_red_shift_node_types, name, account_num, region, time_index)
+            executor.submit('es', label, check_elastic_search_service, name, account_num, region, time_index)
+
+    executor.run('daily_scan')
+    flush_aws_cost_writes('daily_scan')
 
 
 def do_ec2_scan(time_index):
@@ -400,11 +422,19 @@ def do_ec2_scan(time_index):
     print('do_ec2_scan')
     print('time = {}'.format(time_index))
 
+    executor = create_scan_executor()
     active_regions = ['us-east-1', 'us-west-2']
     aws_account = awscost_helper_util.AWS_ACCOUNTS
     for name, account_num in aws_account.iteritems():
         for region in active_regions:
-            check_ec2_usage(name, account_num, region, time_index)
+            label = '{}:{}'.format(name, region)
+            executor.submit('ec2', label, check_ec2_usage, name, account_num, region, time_index)
+
+    executor.run('ec2_scan')
+    flush_aws_cost_writes('ec2_scan')
+
+    ami_cache.save_cache_to_disk()
+    print('AMI cache: {}'.format(ami_cache.get_cache_stats()))
 
 
 def do_hourly_scan(time_index):
@@ -416,13 +446,18 @@ def do_hourly_scan(time_index):
     print('do_hourly_scan')
     print('time = {}'.format(time_index))
 
+    executor = create_scan_executor()
     active_regions = ['us-east-1', 'us-west-2']
     aws_account = awscost_helper_util.AWS_ACCOUNTS
     for name, account_num in aws_account.iteritems():
         for region in active_regions:
-            check_dynamo_usage(name, account_num, region, time_index)
-            check_rds_usage(name, account_num, region, time_index)
-            check_elasticache_usage(name, account_num, region, time_index)
+            label = '{}:{}'.format(name, region)
+            executor.submit('dynamodb', label, check_dynamo_usage, name, account_num, region, time_index)
+            executor.submit('rds', label, check_rds_usage, name, account_num, region, time_index)
+            executor.submit('elasticache', label, check_elasticache_usage, name, account_num, region, time_index)
+
+    executor.run('hourly_scan')
+    flush_aws_cost_writes('hourly_scan')
 
 
 def do_summary(time_index):
@@ -437,21 +472,56 @@ def do_summary(time_index):
     # We summarizing results. Event specifies the time-stamp.
     print('Summarizing data.')
     print('Summarizing result for time = {}'.format(time_index))
-    summarize_results('rds', time_index)
-    summarize_results('dynamodb', time_index)
-    summarize_results('ec2', time_index)
-    summarize_results('ec2os', time_index)
-    summarize_results('elasticache', time_index)
+    aws_resource_types = ['rds', 'dynamodb', 'ec2', 'ec2os', 'elasticache']
 
     if time_index.endswith('-01'):
         # summarize daily_results at end of day time_index = *-01
-        summarize_results('redshift', time_index)
-        summarize_results('es', time_index)
+        aws_resource_types.extend(['redshift', 'es'])
+
+    summarize_results_for_types(aws_resource_types, time_index)
+
+    # Keep the daily and monthly rollups of the new summary rows up to date.
+    summary_keys = []
+    for aws_resource_type in aws_resource_types:
+        for region in ['us-east-1', 'us-west-2']:
+            summary_keys.append('{}:roku:{}'.format(aws_resource_type, region))
+    rollups.update_rollups_for_keys(AWS_COST_TABLE, summary_keys, time_index)
+
+    # A late hour, like from the controller's catch-up, is already behind the series cache.
+    series_cache.invalidate_hour(summary_keys, time_index)
 
     # print("Time remaining: {} ms".format(context.get_remaining_time_in_millis()))
     print('Finished summarizing results for time = {}'.format(time_index))
 
 
+def do_rebuild_rollups(event):
+    """
+    Back-fill the daily and monthly rollups.
+    The event has 'start_time' and 'end_time' like: 20181201-00, and optional
+    'keys' like: ['ec2os:roku:us-east-1']. Default is every hourly summary key.
+    :param event:
+    :return: None
+    """
+    start_time = event.get('start_time')
+    end_time = event.get('end_time')
+    if not start_time or not end_time:
+        raise ValueError('rebuild_rollups needs start_time and end_time. event={}'.format(event))
+
+    keys = event.get('keys')
+    if not keys:
+        keys = []
+        for aws_resource_type in ['rds', 'dynamodb', 'ec2', 'ec2os', 'elasticache', 'redshift', 'es']:
+            for region in ['us-east-1', 'us-west-2']:
+                keys.append('{}:roku:{}'.format(aws_resource_type, region))
+
+    for key in keys:
+        try:
+            rollups.rebuild_rollups(AWS_COST_TABLE, key, start_time, end_time)
+        except Exception as ex:
+            print('Failed to rebuild rollups for {}'.format(key))
+            awscost_helper_util.log_traceback_exception(ex)
+
+
 def do_gather_ri_stats(time_index):
     """
     Gather and summarize the status of Reserved Instances, to compare
@@ -482,160 +552,22 @@ def do_gather_ri_stats(time_index):
         check_redshift_reserved_capacity_in_all_accounts(region, time_index)
 
     print('Done RI testing')
+    flush_aws_cost_writes('gather_ri_stats')
 
 
 # Helper methods below #############################
 
-def write_reservation_coverage_report(ce_client, service_key, start_date, end_date):
-    """
-    Call AWS Cost Explorer reservation_coverage report
-    :param ce_client:
-    :param service_key: valid values: ec2 | rds | redshift | elasticache | es
-    :param start_date:
-    :param end_date:
-    :return: None
-    """
-    try:
-        print('write_reservation_coverage_report')
-        print('service: {}, start: {}, end: {}'.format(service_key, start_date, end_date))
-
-        service_name = awscost_helper_util.get_verbose_cost_explorer_service_names_from_key(service_key)
-
-        # Note boto3 document say only daily Granularity covered, test if hourly is possible.
-        response = ce_client.get_reservation_coverage(
-            TimePeriod={
-                'Start': start_date,
-                'End': end_date
-            },
-            Granularity='DAILY',
-            Filter={
-                'Dimensions': {
-                    'Key': 'SERVICE',
-                    'Values': [service_name]
-                }
-            }
-        )
-
-        date_for_s3_dir = awscost_helper_util.get_awscost_daily_time_format()
-
-        # Get details here.
-        # https://boto3.amazonaws.com/v1/documentation/api/latest/reference/services/ce.html#CostExplorer.Client.get_reservation_coverage
-        if response:
-            file_name = '{}_{}_reservation_coverage.json'.format(date_for_s3_dir, service_key)
-            awscost_helper_util.upload_json_to_awscost_data_s3_bucket(
-                date_for_s3_dir, file_name, response)
-
-            # ToDo: Convert JSON into CSV formation and save to S3, and the put into dynamo for trend plots.
-            # convert_keys = awscost_helper_util.get_conversion_for_report(
-            # coverage_report_panda = awscost_helper_util.json_to_panda(convert_keys, response)
-
-    except Exception as ex:
-        print('Failed: {}'.format(ex.message))
-        print('service: {}, start: {}, end: {}'.format(service_key, start_date, end_date))
-        awscost_helper_util.log_traceback_exception(ex)
-
-
-def write_reservation_utilization_report(ce_client, service_key, start_date, end_date):
-    """
-    Call AWS Cost Explorer reservation_utilization report
-    :param ce_client:
-    :param service_key: valid values: ec2 | rds | redshift | elasticache | es
-    :param start_date:
-    :param end_date:
-    :return: None
-    """
-    try:
-        print('write_reservation_utilization_report')
-        print('service: {}, start: {}, end: {}'.format(service_key, start_date, end_date))
-
-        # Note boto3 document say only daily Granularity covered, test if hourly is possible.
-        service_name = awscost_helper_util.get_verbose_cost_explorer_service_names_from_key(service_key)
-
-        response = ce_client.get_reservation_utilization(
-            TimePeriod={
-                'Start': start_date,
-                'End': end_date
-            },
-            Granularity='DAILY',
-            Filter={
-                'Dimensions': {
-                    'Key': 'SERVICE',
-                    'Values': [service_name]
-                }
-            }
-        )
-
-        date_for_s3_dir = awscost_helper_util.get_awscost_daily_time_format()
-
-        # https://boto3.amazonaws.com/v1/documentation/api/latest/reference/services/ce.html#CostExplorer.Client.get_reservation_coverage
-        if response:
-            file_name = '{}_{}_utilization_report.json'.format(date_for_s3_dir, service_key)
-            awscost_helper_util.upload_json_to_awscost_data_s3_bucket(
-                date_for_s3_dir, file_name, response)
-
-    except Exception as ex:
-        print('Failed: {}'.format(ex.message))
-        print('service: {}, start: {}, end: {}'.format(service_key, start_date, end_date))
-        awscost_helper_util.log_traceback_exception(ex)
-
-
-def write_reservation_purchase_recommendation_report(ce_client, service_key, start_date, end_date):
+def create_scan_executor():
     """
-    Call AWS Cost Explorer reservation_purchase_recommendation report
-    :param ce_client:
-    :param service_key: valid values: ec2 | rds | redshift | elasticache | es
-    :param start_date:
-    :param end_date:
-    :return: None
+    Create the executor used by the account/region scans with the standard
+    thread count, API rate limits and task timeout.
+    :return: ScanExecutor
     """
-    try:
-        print('write_reservation_purchase_recommendation_report')
-        print('service: {}, start: {}, end: {}'.format(service_key, start_date, end_date))
-
-        # https://boto3.amazonaws.com/v1/documentation/api/latest/reference/services/ce.html#CostExplorer.Client.get_reservation_coverage
-        service_name = awscost_helper_util.get_verbose_cost_explorer_service_names_from_key(service_key)
-
-        if service_key == 'ec2':
-            response = ce_client.get_reservation_purchase_recommendation(
-                Service=service_name,
-                AccountScope='PAYER',
-                LookbackPeriodInDays='SEVEN_DAYS',
-                TermInYears='ONE_YEAR',
-                PaymentOption='ALL_UPFRONT',
-                ServiceSpecification={
-                    'EC2Specification': {
-                        'OfferingClass': 'CONVERTIBLE'
-                    }
-                }
-            )
-        elif service_key == 'elasticache':
-            response = ce_client.get_reservation_purchase_recommendation(
-                Service=service_name,
-                AccountScope='PAYER',
-                LookbackPeriodInDays='SEVEN_DAYS',
-                TermInYears='ONE_YEAR',
-                PaymentOption='HEAVY_UTILIZATION'
-            )
-        else:
-            response = ce_client.get_reservation_purchase_recommendation(
-                Service=service_name,
-                AccountScope='PAYER',
-                LookbackPeriodInDays='SEVEN_DAYS',
-                TermInYears='ONE_YEAR',
-                PaymentOption='ALL_UPFRONT'
-            )
-
-        date_for_s3_dir = awscost_helper_util.get_awscost_daily_time_format()
-
-        if response:
-            file_name = '{}_{}_recommendations.json'.format(date_for_s3_dir, service_key)
-            awscost_helper_util.upload_json_to_awscost_data_s3_bucket(
-                date_for_s3_dir, file_name, response)
-
-    except Exception as ex:
-        print('Failed: {}'.format(ex.message))
-        print('service: {}, start: {}, end: {}'.format(service_key, start_date, end_date))
-        awscost_helper_util.log_traceback_exception(ex)
+    return scan_executor.ScanExecutor(
+        max_workers=SCAN_MAX_WORKERS,
+        rate_limits=SCAN_API_RATE_LIMITS,
+        task_timeout_sec=SCAN_TASK_TIMEOUT_SEC
+    )
 
 
 def normalize_rds_families(node_types):
@@ -750,12 +682,12 @@ def get_rds_db_engine_from_key(key):
         return '?'
 
 
-def create_stats_from_data_frame(data_frame, excel_writer, tab_name):
+def create_stats_from_data_frame(data_frame, report, tab_name):
     """
     Try to create stats from a data from, but if frame is empty catch the
     exception record all relevant info and then create a placeholder page.
     :param data_frame: panda DataFrame data structure
-    :param excel_writer: panda writer to Excel file
+    :param report: ReportWriter for the Excel file
     :param tab_name: name of tab in Excel file
     :return: None
     """
@@ -763,7 +695,7 @@ def create_stats_from_data_frame(data_frame, excel_writer, tab_name):
         if not data_frame.empty:
             print('Creating stats page: {}'.format(tab_name))
             stats_df = data_frame.quantile([0.0, 0.05, 0.5, 0.95, 1.0])
-            stats_df.to_excel(excel_writer, tab_name)
+            report.write_sheet(tab_name, stats_df)
         else:
             print('No data to create stats page: {}'.format(tab_name))
 
@@ -772,6 +704,31 @@ def create_stats_from_data_frame(data_frame, excel_writer, tab_name):
         awscost_helper_util.log_traceback_exception(ex)
 
 
+def create_stats_from_rollups(key, time_index, data_frame, report, tab_name):
+    """
+    Create the stats page from the daily rollups for the 28 days up to time_index.
+    If a day has no rollup yet, compute it from the hourly data frame instead.
+    :param key: summary key like: ec2:roku:us-east-1
+    :param time_index: last hour of the report, like: 20190301-00
+    :param data_frame: hourly DataFrame for the same key.
+    :param report: ReportWriter for the Excel file
+    :param tab_name: name of tab in Excel file
+    :return: None
+    """
+    try:
+        start_day = awscost_helper_util.increment_time_index(time_index, -27 * 24)[0:8]
+        stats_df = rollups.get_stats_for_days(AWS_COST_TABLE, key, start_day, time_index[0:8])
+        if stats_df is not None and not stats_df.empty:
+            print('Creating stats page from rollups: {}'.format(tab_name))
+            report.write_sheet(tab_name, stats_df)
+            return
+    except Exception as ex:
+        print('Failed to read rollups for {}. Reason: {}'.format(key, ex))
+        awscost_helper_util.log_traceback_exception(ex)
+
+    create_stats_from_data_frame(data_frame, report, tab_name)
+
+
 def convert_ec2_prod_desc_to_ri_type(prod_desc):
     """
     Calling boto3 gives verbose "product descriptions" which need to be converted into a simpler type.
@@ -1140,14 +1097,7 @@ def check_dynamo_usage(name, account_num, region, time_index):
             'write_capacity': total_write_capacity
         }
 
-        # Local dynamodb client for writing.
-        AWS_COST_TABLE.put_item(
-            Item={
-                'awsResource': aws_resource_key,
-                'time': time_index,
-                'node_types': dynamodb_stats_map
-            }
-        )
+        store_map_to_aws_cost_table(aws_resource_key, time_index, dynamodb_stats_map)
 
     except Exception as ex:
         # log error.
@@ -1288,6 +1238,9 @@ def check_ec2_usage(aws_account_name, account_num, region, time_index):
     """
     Summarize all of the running EC2 Instances.
 
+    The instance listing is read first, then all the AMI ids are resolved together
+    with batched describe_images and AWSCostMap calls through the ami_cache.
+
     :param aws_account_name: string - short account name
     :param account_num: string - aws account number
     :param region: string - aws region. like: 'us-east-1'
@@ -1299,6 +1252,7 @@ def check_ec2_usage(aws_account_name, account_num, region, time_index):
         session = awscost_helper_util.create_cti_poke_session(aws_account_name)
 
         ec2_resource = aws_util.get_ec2_resource(session, region)
+        ec2_client = aws_util.get_boto3_client_by_name('ec2', session, region)
 
         # ec2 has AZ, but not OS-type.
         ec2_az_type_counter = {}
@@ -1314,20 +1268,20 @@ def check_ec2_usage(aws_account_name, account_num, region, time_index):
         ec2_instance_counter = 0
         unknown_os_type_counter = 0  # likely most will be linux, but keep tabs.
 
-        image_id_to_os_map = {}
-        uncategorized_image_descriptions = {}
+        # (ec2_type, is_spot_instance, platform, image_id) for each instance.
+        instance_list = []
         for instance in instances:
             try:
                 ec2_type = instance.instance_type
                 ec2_placement_map = instance.placement
-                
+
                 # determine if spot instance.
                 is_spot_instance = False
                 if instance.spot_instance_request_id:
                     is_spot_instance = True
                     print('Spot instance: {}-{} id={}'.format(
                         aws_account_name, region, instance.spot_instance_request_id))
-                
+
                 ec2_az = ec2_placement_map.get('AvailabilityZone')
 
                 key_ec2_az = '{}:{}'.format(ec2_type, ec2_az)
@@ -1336,24 +1290,52 @@ def check_ec2_usage(aws_account_name, account_num, region, time_index):
                 increment_count_in_dictionary(ec2_az_type_counter, key_ec2_az)
                 ec2_instance_counter += 1
 
-                # Get OS type for ec2v2. count
-                os_type = convert_ec2_image_id_to_os_type(session, region, instance,
-                                                          image_id_to_os_map,
-                                                          uncategorized_image_descriptions,
-                                                          unknown_os_type_counter)
-
-                # add to ec2_os map here.
-                key_ec2_os = '{}-{}'.format(os_type, ec2_type)
-                if is_spot_instance:
-                    key_ec2_os = 'spot-'+key_ec2_os
-                
-                increment_count_in_dictionary(ec2_os_type_counter, key_ec2_os)
+                instance_list.append((ec2_type, is_spot_instance, instance.platform, instance.image_id))
 
             except Exception as ex:
                 # log error.
                 print('Exception: {}'.format(ex.message))
                 awscost_helper_util.log_traceback_exception(ex)
 
+        # Get OS type for ec2v2 count. Look-up all the AMI ids at once.
+        image_ids = set(curr_instance[3] for curr_instance in instance_list if curr_instance[3])
+        image_id_to_os_map = ami_cache.get_image_descriptions(ec2_client, image_ids)
+
+        uncategorized_image_descriptions = {}
+        os_type_list = []
+        ambiguous_image_ids = set()
+        for ec2_type, is_spot_instance, platform, image_id in instance_list:
+            image_desc = image_id_to_os_map.get(image_id)
+            os_type = convert_ec2_image_desc_to_os_type(platform, image_desc)
+            if not image_desc and os_type != 'windows':
+                print('WARN: No os_type info for: image_id = {}'.format(image_id))
+                increment_count_in_dictionary(uncategorized_image_descriptions, str(image_id))
+            if os_type == '?':
+                ambiguous_image_ids.add(image_id)
+            os_type_list.append(os_type)
+
+        # Check database if AMI Id and Description are ambiguous about OS type.
+        database_os_types = {}
+        if ambiguous_image_ids:
+            database_os_types = check_database_for_types(
+                ambiguous_image_ids, image_id_to_os_map, region, account_num)
+
+        for curr_instance, os_type in zip(instance_list, os_type_list):
+            ec2_type, is_spot_instance, platform, image_id = curr_instance
+            if os_type == '?':
+                os_type = database_os_types.get(image_id, '?')
+
+            if os_type == '?':
+                print('WARN: EC2 os_type: {}, ami desc: {}'.format(os_type, image_id_to_os_map.get(image_id)))
+                unknown_os_type_counter += 1
+
+            # add to ec2_os map here.
+            key_ec2_os = '{}-{}'.format(os_type, ec2_type)
+            if is_spot_instance:
+                key_ec2_os = 'spot-'+key_ec2_os
+
+            increment_count_in_dictionary(ec2_os_type_counter, key_ec2_os)
+
         print('Debug: {}:{} Found total EC2 Instances: {}'.format(aws_account_name, region, ec2_instance_counter))
         print('Debug: {}:{} Number EC2 Instances with unverified os_type: {}'.format(aws_account_name, region, unknown_os_type_counter))
         print('WARN: Some images not categorized (linux|rhel|sles): {}'.format(uncategorized_image_descriptions))
@@ -1377,6 +1359,9 @@ def store_map_to_aws_cost_table(aws_resource_key, time_index, type_counter):
         awsResource -- key
         time -- range key
         node_types -- map of type to count.
+
+    The row is buffered. It is written by flush_aws_cost_writes at the end of the scan,
+    or sooner if enough rows are buffered.
     :param aws_resource_key:
     :param time_index:
     :param type_counter:
@@ -1389,10 +1374,8 @@ def store_map_to_aws_cost_table(aws_resource_key, time_index, type_counter):
         }
         type_map.update(this_item)
 
-    dynamodb_write_client = boto3.client('dynamodb')
-    dynamodb_write_client.put_item(
-        TableName='AWSCost',
-        Item={
+    AWS_COST_WRITE_BUFFER.put_item(
+        {
             'awsResource': {'S': aws_resource_key},
             'time': {'S': time_index},
             'node_types': {'M': type_map}
@@ -1400,165 +1383,124 @@ def store_map_to_aws_cost_table(aws_resource_key, time_index, type_counter):
     )
 
 
-def convert_ec2_image_id_to_os_type(session, region, instance,
-                                    image_id_to_os_map,
-                                    uncategorized_image_descriptions,
-                                    unknown_os_type_counter):
+def flush_aws_cost_writes(stage):
     """
-    AMI ids are used to estimate the os_type of an ec2_instance for reserved instance reports.
-    :param session:
-    :param region:
-    :param instance:
-    :param image_id_to_os_map:
-    :param uncategorized_image_descriptions:
-    :param unknown_os_type_counter:
-    :return: OS-type as string like: linux | rhel | windows | windows
+    Write the AWSCost rows buffered by store_map_to_aws_cost_table.
+    :param stage: name for the log. Ex: 'hourly_scan'
+    :return: None
     """
-    # OS-type is a combination of "platform" Windows and image_id (ami-...) info.
-    try:
-        os_type = instance.platform
-        # print('platform = {}'.format(instance.platform))
-        if not os_type:
-            os_type = '?'
-
-        image_id = instance.image_id
-        print('Debug: image_id = {}'.format(image_id))
-        if not image_id_to_os_map.get(image_id):
-            # look up image_id info and cache it.
-            ec2_client = aws_util.get_boto3_client_by_name('ec2', session, region)
-
-            response = ec2_client.describe_images(
-                ImageIds=[image_id]
-            )
-            if response:
-                resp_images = response.get('Images')
-                print('Debug: resp_image = {}'.format(resp_images))
-                for curr_image in resp_images:
-                    cid = curr_image.get('Description')
-                    cin = curr_image.get('Name')
-                    # cil = curr_image.get('ImageLocation')
-                    print('DEBUG: ImageId - desc: {}  name: {}'.format(cid, cin))
-                    if cid:
-                        image_id_to_os_map[image_id] = cid
-                    elif cin:
-                        image_id_to_os_map[image_id] = cin
-
-        image_desc = image_id_to_os_map.get(image_id)
-        if image_desc:
-            if image_desc.startswith('Amazon Linux'):
-                os_type = 'linux'
-            elif image_desc.startswith('Cent'):
-                os_type = 'rhel'
-            elif image_desc.startswith('SLES'):
-                os_type = 'sles'
-            elif 'elasticbeanstalk-amzn' in image_desc:
-                os_type = 'linux'
-            elif 'Elastic MapReduce ebs|Amazon' in image_desc:
-                os_type = 'linux'
-            elif 'Amazon Linux' in image_desc:
-                os_type = 'linux'
-            elif 'buntu' in image_desc:
-                # Ubuntu can be reserved as linux RIs
-                os_type = 'linux'
-            elif 'roku-build-teamcity' in image_desc:
-                # player services accounts use frequently update teamcity AMIs. @cyeh for questions
-                os_type = 'linux'
-            else:
-                if not os_type == 'windows':
-                    print('WARN: unknown image_desc = _{}_'.format(image_desc))
-        else:
-            if 'windows' == os_type:
-                image_id_to_os_map[image_id] = 'windows - {}'.format(image_id)
-            else:
-                print('WARN: No os_type info for: image_id = {}'.format(image_id))
-                # Add to list of un-categorized image descriptions.
-                count = uncategorized_image_descriptions.get(image_id)
-                if not count:
-                    uncategorized_image_descriptions[image_id] = 1
-                else:
-                    count += 1
-                    uncategorized_image_descriptions[image_id] = count
+    start = awscost_helper_util.start_timer()
+    num_items = AWS_COST_WRITE_BUFFER.flush()
+    awscost_helper_util.print_delta_time(start, 'flush {} AWSCost rows for {}'.format(num_items, stage))
+    print('AWSCost writes: {}'.format(AWS_COST_WRITE_BUFFER.get_stats()))
 
-        # Check database if AMI Id and Description are ambiguous about OS type.
-        if os_type == '?':
-            os_type = check_database_for_type(image_id, image_desc, region, session)
 
-        if os_type == '?':
-            print('WARN: EC2 os_type: {}, ami desc: {}'.format(os_type, image_desc))
-            unknown_os_type_counter += 1
+def convert_ec2_image_desc_to_os_type(platform, image_desc):
+    """
+    AMI descriptions are used to estimate the os_type of an ec2_instance for reserved instance reports.
+    :param platform: instance.platform, which is 'windows' for Windows instances, otherwise None.
+    :param image_desc: AMI description or name, or None if the AMI couldn't be found.
+    :return: OS-type as string like: linux | rhel | sles | windows | ?
+    """
+    # OS-type is a combination of "platform" Windows and image_id (ami-...) info.
+    os_type = platform
+    if not os_type:
+        os_type = '?'
 
-        return os_type
-    except Exception as ex:
-        print('ERROR: getting EC2 Instance data')
-        print('Exception: {}'.format(ex.message))
-        awscost_helper_util.log_traceback_exception(ex)
+    if image_desc:
+        if image_desc.startswith('Amazon Linux'):
+            os_type = 'linux'
+        elif image_desc.startswith('Cent'):
+            os_type = 'rhel'
+        elif image_desc.startswith('SLES'):
+            os_type = 'sles'
+        elif 'elasticbeanstalk-amzn' in image_desc:
+            os_type = 'linux'
+        elif 'Elastic MapReduce ebs|Amazon' in image_desc:
+            os_type = 'linux'
+        elif 'Amazon Linux' in image_desc:
+            os_type = 'linux'
+        elif 'buntu' in image_desc:
+            # Ubuntu can be reserved as linux RIs
+            os_type = 'linux'
+        elif 'roku-build-teamcity' in image_desc:
+            # player services accounts use frequently update teamcity AMIs. @cyeh for questions
+            os_type = 'linux'
+        else:
+            if not os_type == 'windows':
+                print('WARN: unknown image_desc = _{}_'.format(image_desc))
 
-        return '?'
+    return os_type
 
 
-def check_database_for_type(image_id, image_desc, region, session):
+def check_database_for_types(image_ids, image_id_to_os_map, region, account_id):
     """
     If we are calling this method it is because the OS of an AMI is ambiguous.
     In those cases we store the AMI-ID in a database and manually annotate which OS (likely linux)
     it is.
 
+    All the ambiguous AMI-IDs from a scan are read from the AwsCostMap table at once with
+    batch_get_item, and results are cached across invocations by ami_cache.
+
     The the AMI-ID isn't in the database then add it with a '?' to indicated it needs to be filled in.
     In practice (assuming we don't find a better method to determine OS) This should only happen
     when a new AMI is created. Such an event could trigger a notification.
-    :param image_id: AMI Id - this is key into database
-    :param image_desc: - Image description helps determine type.
+    :param image_ids: AMI Ids - these are keys into database
+    :param image_id_to_os_map: AMI Id to description, which helps determine type.
     :param region: - Region just for record keeping.
-    :param session: - To get account id.
-    :return: os_type -   linux | rhel | sles |  (maybe) windows
+    :param account_id: - AWS account id just for record keeping.
+    :return: dict of AMI Id to os_type -   linux | rhel | sles |  (maybe) windows | ?
     """
     try:
+        os_types, not_in_table = ami_cache.get_os_types_from_cost_map(DYNAMODB_CLIENT, image_ids)
 
-        # ToDo: we need to cache this dynamo response in a map from parent subroutine.
-
-        # Look up in database.
-        response = AWS_COST_MAP_TABLE.get_item(
-            Key={
-                'id': image_id
-            }
-        )
-
-        if response.get('Item'):
-            item = response.get('Item')
-            os_type = item.get('os_type')
-
+        for image_id, os_type in os_types.items():
             if os_type == '?':
-                print('WARN: Unknown AMI-ID in AwsCostMap table: {} - {}'.format(image_id, image_desc))
-
-            return os_type
+                print('WARN: Unknown AMI-ID in AwsCostMap table: {} - {}'.format(
+                    image_id, image_id_to_os_map.get(image_id)))
 
-        else:
-            account_id = awscost_helper_util.get_account_id_from_session(session)
-            added_date = awscost_helper_util.get_awscost_hourly_time_format()
+        added_date = awscost_helper_util.get_awscost_hourly_time_format()
+        for image_id in not_in_table:
+            image_desc = image_id_to_os_map.get(image_id)
 
             # We didn't find this id, so write it. Put a '?' in the os_type column.
-            AWS_COST_MAP_TABLE.put_item(
+            DYNAMODB_CLIENT.put_item(
+                TableName='AWSCostMap',
                 Item={
-                    'id': image_id,
-                    'image_desc': image_desc,
-                    'region': region,
-                    'os_type': '?',
-                    'account_id': account_id,
-                    'added_date': added_date
+                    'id': {'S': image_id},
+                    'image_desc': {'S': image_desc} if image_desc else {'NULL': True},
+                    'region': {'S': region},
+                    'os_type': {'S': '?'},
+                    'account_id': {'S': account_id},
+                    'added_date': {'S': added_date}
                 }
             )
+            ami_cache.set_cost_map_os_type(image_id, '?')
             print('Add {} to AwsCostMap table. image_desc={}'.format(image_id, image_desc))
 
-            return '?'
+        return os_types
 
     except Exception as ex:
         print('ERROR: getting EC2 Instance data')
         print('Exception: {}'.format(ex.message))
         awscost_helper_util.log_traceback_exception(ex)
 
-        return '?'
+        return {}
 
 
 def summarize_results(aws_resource_type, time_index):
+    """
+    Summarize the results for one resource type for a time slice.
+    See summarize_results_for_types.
+
+    :param aws_resource_type: type of resource to summarize. 'dynamodb' | 'rds' | 'redshift' | 'ec2' | 'es'
+    :param time_index: string. the time-slice to summarize. like '20181115-14'
+    :return: None
+    """
+    summarize_results_for_types([aws_resource_type], time_index)
+
+
+def summarize_results_for_types(aws_resource_types, time_index):
     """
     Summarize the results for a time slice.
     Read entries for that time-slice which will look like
@@ -1571,64 +1513,66 @@ def summarize_results(aws_resource_type, time_index):
 
     That row can then be queried for display.
 
-    :param aws_resource_type: type of resource to summarize. 'dynamodb' | 'rds' | 'redshift' | 'ec2' | 'es'
+    All the account rows for every type and region are read with batch_get_item,
+    and the summary rows are written with a batch writer.
+
+    :param aws_resource_types: list of types to summarize. 'dynamodb' | 'rds' | 'redshift' | 'ec2' | 'es'
     :param time_index: string. the time-slice to summarize. like '20181115-14'
     :return: None
     """
     try:
-        print('Summarize type: {}  time: {}'.format(aws_resource_type, time_index))
-        # dynamodb_client = boto3.client('dynamodb')
+        print('Summarize types: {}  time: {}'.format(aws_resource_types, time_index))
 
         # For each aws account
         active_regions = ['us-east-1', 'us-west-2']
-
         aws_account = awscost_helper_util.AWS_ACCOUNTS
-        for region in active_regions:
-            roku_wide_node_types = {}
-            for name, account_num in aws_account.iteritems():
-                key = '{}:{}:{}'.format(aws_resource_type, account_num, region)
 
-                response = AWS_COST_TABLE.get_item(
-                    Key={
-                        'awsResource': key,
+        keys = []
+        for aws_resource_type in aws_resource_types:
+            for region in active_regions:
+                for name, account_num in aws_account.iteritems():
+                    keys.append({
+                        'awsResource': '{}:{}:{}'.format(aws_resource_type, account_num, region),
                         'time': time_index
-                    }
-                )
-
-                item = response.get('Item')
-                if item:
-                    node_types = item.get('node_types')
-                    if not node_types and aws_resource_type == 'dynamodb':
-                        # Note before Nov. 16th. dynamodb would have separate columns.
-                        # It was eventually made same as other, so this "if not" clause can go away eventually.
-                        try:
-                            rc = item.get('read_capacity')
-                            wc = item.get('write_capacity')
-                            tt = item.get('table_count')
-                            node_types = {
-                                'table_count': tt,
-                                'read_capacity': rc,
-                                'write_capacity': wc
+                    })
+
+        items = awscost_helper_util.batch_get_items(DYNAMODB_CLIENT, 'AWSCost', keys)
+        items_by_key = {}
+        for item in items:
+            items_by_key[item.get('awsResource')] = item
+
+        with AWS_COST_TABLE.batch_writer() as batch:
+            for aws_resource_type in aws_resource_types:
+                for region in active_regions:
+                    try:
+                        roku_wide_node_types = {}
+                        for name, account_num in aws_account.iteritems():
+                            key = '{}:{}:{}'.format(aws_resource_type, account_num, region)
+
+                            item = items_by_key.get(key)
+                            if item:
+                                node_types = get_node_types_from_item(aws_resource_type, key, item)
+
+                                # Add this result to the node types.
+                                accumulate_node_types(roku_wide_node_types, node_types)
+                            else:
+                                print('No item for {}: {}  {}'.format(name, key, time_index))
+
+                        # write result into database.
+                        summary_key = '{}:roku:{}'.format(aws_resource_type, region)
+                        batch.put_item(
+                            Item={
+                                'awsResource': summary_key,
+                                'time': time_index,
+                                'node_types': roku_wide_node_types
                             }
-                        except Exception as ex:
-                            print('Failed to create node for key={}'.format(key))
-                            print('Exception: {}'.format(ex.message))
-                            awscost_helper_util.log_traceback_exception(ex)
+                        )
 
-                    # Add this result to the node types.
-                    accumulate_node_types(roku_wide_node_types, node_types)
-                else:
-                    print('No item for {}: {}  {}'.format(name, key, time_index))
-
-            # write result into database.
-            summary_key = '{}:roku:{}'.format(aws_resource_type, region)
-            AWS_COST_TABLE.put_item(
-                Item={
-                    'awsResource': summary_key,
-                    'time': time_index,
-                    'node_types': roku_wide_node_types
-                }
-            )
+                    except Exception as ex:
+                        # log error, and continue with next type.
+                        print('Failed to summarize {} {}'.format(aws_resource_type, region))
+                        print('Exception: {}'.format(ex.message))
+                        awscost_helper_util.log_traceback_exception(ex)
 
     except Exception as ex:
         # log error.
@@ -1636,6 +1580,35 @@ def summarize_results(aws_resource_type, time_index):
         awscost_helper_util.log_traceback_exception(ex)
 
 
+def get_node_types_from_item(aws_resource_type, key, item):
+    """
+    Get the node_types map from an AWSCost item.
+    :param aws_resource_type: 'dynamodb' | 'rds' | 'redshift' | 'ec2' | 'es'
+    :param key: awsResource key, for logging.
+    :param item: AWSCost item.
+    :return: dict of node type to count.
+    """
+    node_types = item.get('node_types')
+    if not node_types and aws_resource_type == 'dynamodb':
+        # Note before Nov. 16th. dynamodb would have separate columns.
+        # It was eventually made same as other, so this "if not" clause can go away eventually.
+        try:
+            rc = item.get('read_capacity')
+            wc = item.get('write_capacity')
+            tt = item.get('table_count')
+            node_types = {
+                'table_count': tt,
+                'read_capacity': rc,
+                'write_capacity': wc
+            }
+        except Exception as ex:
+            print('Failed to create node for key={}'.format(key))
+            print('Exception: {}'.format(ex.message))
+            awscost_helper_util.log_traceback_exception(ex)
+
+    return node_types
+
+
 def increment_count_in_dictionary(python_dict_as_counter, key, inc_by=1):
     """
     Expect a python dictionary in format.
@@ -1715,12 +1688,8 @@ def create_hourly_data_frame_for_aws_account(prefix, aws_account_name, aws_regio
         hours_in_week = 24 * 7
         hours_in_4_weeks = 4 * hours_in_week
 
-        # Go back 3 weeks.
+        # Go back 4 weeks.
         row_0 = create_time_column_values(time_index, -1, hours_in_4_weeks)
-        time_dict = {'time': row_0}
-
-        ret_val_data_frame = pd.DataFrame(index=time_dict.get('time'))
-        ret_val_data_frame.index.name = 'time'
 
         # Turn account_name into an account_id
         aws_account_id = awscost_helper_util.get_aws_account_id_from_name(aws_account_name)
@@ -1728,36 +1697,9 @@ def create_hourly_data_frame_for_aws_account(prefix, aws_account_name, aws_regio
         # Make the following query:  {prefix}.roku.{region} for time_index > 28 days ago... expect about
         start_time = awscost_helper_util.increment_time_index(time_index, -672)
         aws_resource_key = '{}:{}:{}'.format(prefix, aws_account_id, aws_region)
-        response = AWS_COST_TABLE.query(
-            KeyConditionExpression=Key('awsResource').eq(aws_resource_key) & Key('time').gte(start_time)
-        )
-
-        column_names_set = set()
-
-        # Create a panda to hold the cells.
-        items = response.get('Items')
-        if items:
-            for curr_item in items:
-                print('item: {}'.format(curr_item))
-                node_types = curr_item.get('node_types')
-                time_index = curr_item.get('time')
-
-                key_list = node_types.keys()
-                key_list.sort()
+        items = awscost_helper_util.query_time_series(AWS_COST_TABLE, aws_resource_key, start_time)
+        ret_val_data_frame = awscost_helper_util.create_data_frame_from_items(items, row_0)
 
-                for curr_key in key_list:
-                    if curr_key not in column_names_set:
-                        col_num = len(ret_val_data_frame.columns)
-                        print('adding column: {} @ {}'.format(curr_key, col_num))
-
-                        ret_val_data_frame.insert(col_num, curr_key, np.nan)
-                        column_names_set.add(curr_key)
-
-                    curr_value = node_types.get(curr_key)
-                    # print('{}: {}'.format(curr_key, curr_value)) # to verbose
-                    ret_val_data_frame.at[time_index, curr_key] = curr_value
-
-        # sort the column names.
         return ret_val_data_frame
 
     except Exception as ex:
@@ -1782,46 +1724,15 @@ def create_hourly_data_frame(prefix, aws_region, time_index):
     hours_in_week = 24 * 7
     hours_in_4_weeks = 4 * hours_in_week
 
-    # Go back 3 weeks.
+    # Go back 4 weeks.
     row_0 = create_time_column_values(time_index, -1, hours_in_4_weeks)
-    time_dict = {'time': row_0}
-
-    ret_val_data_frame = pd.DataFrame(index=time_dict.get('time'))
-    ret_val_data_frame.index.name = 'time'
 
     # Make the following query:  {prefix}.roku.{region} for time_index > 28 days ago... expect about
     start_time = awscost_helper_util.increment_time_index(time_index, -672)
     aws_resource_key = '{}:roku:{}'.format(prefix, aws_region)
-    response = AWS_COST_TABLE.query(
-        KeyConditionExpression=Key('awsResource').eq(aws_resource_key) & Key('time').gte(start_time)
-    )
-
-    column_names_set = set()
-
-    # Create a panda to hold the cells.
-    items = response.get('Items')
-    if items:
-        for curr_item in items:
-            print('item: {}'.format(curr_item))
-            node_types = curr_item.get('node_types')
-            time_index = curr_item.get('time')
-
-            key_list = node_types.keys()
-            key_list.sort()
-
-            for curr_key in key_list:
-                if curr_key not in column_names_set:
-                    col_num = len(ret_val_data_frame.columns)
-                    print('adding column: {} @ {}'.format(curr_key, col_num))
-
-                    ret_val_data_frame.insert(col_num, curr_key, np.nan)
-                    column_names_set.add(curr_key)
-
-                curr_value = node_types.get(curr_key)
-                print('{}: {}'.format(curr_key, curr_value))
-                ret_val_data_frame.at[time_index, curr_key] = curr_value
+    series_data_frame = series_cache.get_series(AWS_COST_TABLE, aws_resource_key, time_index, start_time)
+    ret_val_data_frame = awscost_helper_util.reindex_time_rows(series_data_frame, row_0)
 
-    # sort the column names.
     return ret_val_data_frame
 
 
@@ -2061,11 +1972,11 @@ if __name__ == '__main__':
         excel_file.close()
         print('Created {}'.format(path))
 
-        excel_writer = pd.ExcelWriter(path, engine='openpyxl')
+        report = report_writer.ReportWriter(path)
 
-        create_stats_from_data_frame(test_df, excel_writer, "TestFirstColumn")
+        create_stats_from_data_frame(test_df, report, "TestFirstColumn")
 
-        excel_writer.save()
+        report.close()
 
         # time_list = create_time_column_values('20181204-18')
         # print('time_list')
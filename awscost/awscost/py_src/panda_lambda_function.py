@@ -6,22 +6,27 @@ This function will also be where on-the-fly graphs can be created.
 """
 
 import os.path
-import zipfile
 import datetime
 
 import boto3
 import util.aws_util as aws_util
 import util.awscost_helper_util as awscost_helper_util
+import util.series_cache as series_cache
+import util.rollups as rollups
+import util.billing_ingest as billing_ingest
+import util.report_writer as report_writer
 
 import matplotlib
 matplotlib.use('agg')
 import matplotlib.pyplot as plt
 import numpy as np
-import pandas as pd
 
 DYNAMODB = boto3.resource('dynamodb')
 AWS_COST_TABLE = DYNAMODB.Table('AWSCost')
 
+BILLING_BUCKET = 'roku-billing'
+BILLING_FILE_NAME_FORMAT = '088414020449-aws-billing-detailed-line-items-with-resources-and-tags-{}.csv.zip'
+
 
 def lambda_handler(event, context):
     """
@@ -87,89 +92,77 @@ def do_read_billing_file(event):
     """
     Read the cost file.
 
-    NOTE: The /tmp directory on a lambda function is limited to 512 MB, but the downloaded billing file
-    is larger than that zipped and unzipped could be as much as 4 GB.
-    It seems this function will need to move to a EC2 Instance, or Docker image.
+    The billing file is larger than the 512 MB /tmp directory zipped, and unzipped could be as
+    much as 4 GB, so it is streamed from S3 and summarized in chunks by util/billing_ingest.py.
+    Only the summaries are written to /tmp and then the awscost-data S3 bucket under billing/<month>/.
+
+    The event can have "billing_month" like "2019-01". Default is the current month.
 
     ToDo: Initially we need to measure how long it takes and what size lambda function is required.
     ToDo: Estimate cost of doing this in lambda vs. docker(FarGate).
-    ToDo: Read the timestamp on the Cost File before downloading it, if not updated, store file
-    ToDo: in lambda's /tmp directory and read it from there to save download cost/time.
 
     :param event:
     :return:
     """
     print('do_read_billing_file')
     session = awscost_helper_util.create_cost_explorer_session()
-    s3_resource = aws_util.get_boto3_resource_by_name('s3', session, 'us-east-1')
+    s3_client = aws_util.get_boto3_client_by_name('s3', session, 'us-east-1')
+
+    billing_month = event.get('billing_month')
+    if not billing_month:
+        billing_month = datetime.datetime.now().strftime('%Y-%m')
 
-    # ToDo: fill in month date.
     # s3://roku-billing/088414020449-aws-billing-detailed-line-items-with-resources-and-tags-2019-01.csv.zip
-    billing_file_name = '088414020449-aws-billing-detailed-line-items-with-resources-and-tags-2019-01.csv.zip'
-    bill_file_summary = s3_resource.ObjectSummary('roku-billing', billing_file_name)
+    billing_file_name = BILLING_FILE_NAME_FORMAT.format(billing_month)
+    bill_file_head = s3_client.head_object(Bucket=BILLING_BUCKET, Key=billing_file_name)
 
-    bill_file_last_modified = bill_file_summary.last_modified
-    bill_file_size = bill_file_summary.size
+    bill_file_last_modified = str(bill_file_head.get('LastModified'))
+    bill_file_size = bill_file_head.get('ContentLength')
 
     update_billing_file = True
     billing_file_metadata = {}
 
     # store info in /tmp/billing_file_metadata.txt
-    if not os.path.exists('/tmp/billing_file_metadata.txt'):
-        print('/tmp/billing_file_metadata.txt does not exist')
-        update_billing_file = True
+    metadata_path = '/tmp/billing_file_metadata_{}.txt'.format(billing_month)
+    if not os.path.exists(metadata_path):
+        print('{} does not exist'.format(metadata_path))
     else:
         # read the file.
-        print('reading /tmp/billing_file_metadata.txt')
-        with open('/tmp/billing_file_metadata.txt') as bill_metafile:
+        print('reading {}'.format(metadata_path))
+        with open(metadata_path) as bill_metafile:
             for line in bill_metafile:
-                (key, value) = line.split(': ')
+                (key, value) = line.strip().split(': ')
                 billing_file_metadata[key] = value
         curr_last_modified = billing_file_metadata.get('last_modified')
         if bill_file_last_modified == curr_last_modified:
             update_billing_file = False
 
-    # Look at last modified for the files we will want to load into pandas.
-    # ... detailed-line-items-with-resources-and-tags-2019-01.csv.zip   (zipped it ends up being...  1012.4 MB)
-    download_successful = False
-    if update_billing_file:
-        try:
-            # download latest.
-            billing_file_obj = s3_resource.Object('roku-billing', billing_file_name)
-            bill_file_local_path = '/tmp/{}'.format(billing_file_name)
-            billing_file_obj.download_file(bill_file_local_path)
-
-            download_successful = True
+    if not update_billing_file:
+        print('Billing file not modified since last summary. last_modified: {}'.format(bill_file_last_modified))
+        return
 
-            # write the meta-data file
-            print('updating /tmp/billing_file_metadata.txt')
-            with open('/tmp/billing_file_metadata.txt', "w") as bill_metafile:
-                bill_metafile.write('last_modified: {}\nsize: {}'.format(bill_file_last_modified, bill_file_size))
-
-        except Exception as ex:
-            # log error.
-            print('Exception: {}'.format(ex.message))
-            awscost_helper_util.log_traceback_exception(ex)
+    # ... detailed-line-items-with-resources-and-tags-2019-01.csv.zip   (zipped it ends up being...  1012.4 MB)
+    print('Summarizing billing file: {}\nlast_updated: {}\nsize: {}'
+          .format(billing_file_name, bill_file_last_modified, bill_file_size))
+    start = awscost_helper_util.start_timer()
+    summary = billing_ingest.ingest_billing_file_from_s3(s3_client, BILLING_BUCKET, billing_file_name)
+    awscost_helper_util.print_delta_time(start, 'ingest_billing_file_from_s3')
 
-    unzip_successful = False
-    if download_successful:
-        # if new billing file downloaded, unzip it, otherwise use existing unzipped file.
-        try:
-            print('unzipping new file: {}\nlast_updated: {}\nsize: {}'
-                  .format(bill_file_local_path, bill_file_last_modified, bill_file_size))
+    uploaded = True
+    for local_path in billing_ingest.write_billing_summaries(summary, '/tmp', billing_month):
+        if not awscost_helper_util.upload_file_to_awscost_s3_bucket(
+                'billing/{}'.format(billing_month), os.path.basename(local_path), local_path, delete_local_file=True):
+            uploaded = False
 
-            with zipfile.ZipFile(bill_file_local_path, 'r') as zip_ref:
-                zip_ref.extractall('/tmp')
+    # Without the meta-data file the next run summarizes the month again.
+    if not uploaded:
+        print('ERROR: Billing summary upload failed for {}. Will retry next run.'.format(billing_month))
+        return
 
-            unzip_successful = True
-        except Exception as ex:
-            # log error.
-            print('Exception: {}'.format(ex.message))
-            awscost_helper_util.log_traceback_exception(ex)
-
-    # ToDo: load this into panda to measure memory needed.
-    if unzip_successful:
-        print('Unzip finished.')
+    # write the meta-data file
+    print('updating {}'.format(metadata_path))
+    with open(metadata_path, "w") as bill_metafile:
+        bill_metafile.write('last_modified: {}\nsize: {}'.format(bill_file_last_modified, bill_file_size))
 
 
 def do_export_excel_for_account(event):
@@ -183,6 +176,7 @@ def do_export_excel_for_account(event):
     "aws_region":  value either:   us-east-1 | us-west-2
     "start_time": first time to the hour in "YYYYMMDD-HH" format.
     "end_time": last time to the hour in "YYYYMMDD-HH" format.
+    "sidecar_formats": optional list with "csv" and/or "parquet" to also export those files.
 
     This will get exported into an Excel file and put in the awscost-data S3 bucket with the following
     name format:
@@ -219,23 +213,19 @@ def do_export_excel_for_account(event):
 
     df_for_excel = awscost_helper_util.get_panda_for_resource(AWS_COST_TABLE, key, start_time, end_time)
 
-    # Write this locally then upload to S3.
+    # Written straight into the awscost-data S3 bucket.
     region_under_score = aws_region.replace('-','_')
     file_key = '{}-{}-{}'.format(resource_key, account_id, region_under_score)
     start_under_score = start_time.replace('-', '_')
     end_under_score = end_time.replace('-', '_')
 
     file_name = '{}-{}-{}.xlsx'.format(file_key, start_under_score, end_under_score )
-    local_path = '/tmp/{}.xlsx'.format(file_name)
-    excel_file = open(local_path, "w+")
-    excel_file.close()
-
-    writer = pd.ExcelWriter(local_path, engine='openpyxl')
-    df_for_excel.to_excel(writer, file_key)
-    writer.save()
-
     s3_dir = awscost_helper_util.get_awscost_daily_time_format()
-    awscost_helper_util.upload_file_to_awscost_s3_bucket(s3_dir, file_name, local_path)
+
+    report = report_writer.ReportWriter('s3://awscost-data/{}/{}'.format(s3_dir, file_name),
+                                         sidecar_formats=event.get('sidecar_formats'))
+    report.write_sheet(file_key, df_for_excel)
+    report.close()
 
 
 def do_make_ec2_plots(event):
@@ -259,24 +249,21 @@ def do_make_ec2_plots(event):
     end_date = '{}-00'.format(timestamp)
 
     # EC2 data us-west-1
-    df_ec2os_west = awscost_helper_util.get_panda_for_resource(AWS_COST_TABLE, 'ec2os:roku:us-west-2',
-                                                               end_date, '20181221-00')
+    df_ec2os_west = get_daily_panda_for_resource('ec2os:roku:us-west-2', end_date, '20181221-00')
     print('ec2 west head(): \n{}'.format(df_ec2os_west.head()))
     # ec2_westfamily_list = ['linux-c5', 'linux-m5', 'linux-r4', 'linux-t2']
     ec2_westfamily_list = ['linux-c', 'linux-m', 'linux-r', 'linux-t']
     plot_node_families_from_awscost_data_frame(df_ec2os_west, ec2_westfamily_list, 'EC2_us-west-2')
 
     # EC2 data us-east-1
-    df_ec2os_east = awscost_helper_util.get_panda_for_resource(AWS_COST_TABLE, 'ec2os:roku:us-east-1',
-                                                               end_date, '20181221-00')
+    df_ec2os_east = get_daily_panda_for_resource('ec2os:roku:us-east-1', end_date, '20181221-00')
     print('ec2 east head(): \n{}'.format(df_ec2os_east.head()))
     # ec2_east_family_list = ['linux-c5', 'linux-m4', 'linux-m5', 'linux-r4', 'linux-r5', 'linux-t2']
     ec2_east_family_list = ['linux-c', 'linux-m', 'linux-r', 'linux-t']
     plot_node_families_from_awscost_data_frame(df_ec2os_east, ec2_east_family_list, 'EC2_us-east-1')
 
     # RDS data us-west-2
-    df_rds_west = awscost_helper_util.get_panda_for_resource(AWS_COST_TABLE, 'rds:roku:us-west-2',
-                                                             end_date, '20181221-00')
+    df_rds_west = get_daily_panda_for_resource('rds:roku:us-west-2', end_date, '20181221-00')
     rds_west_family_list = ['r4.aurora-postgresql',
                             't2.postgres', 't2.mysql', 't2.aurora-mysql',
                             'm4.mysql']
@@ -284,8 +271,7 @@ def do_make_ec2_plots(event):
                                                'RDS_us-west-2', lambda_filter_func=rds_lambda_filter_func)
 
     # RDS data us-east-1
-    df_rds_west = awscost_helper_util.get_panda_for_resource(AWS_COST_TABLE, 'rds:roku:us-east-1',
-                                                             end_date, '20181221-00')
+    df_rds_west = get_daily_panda_for_resource('rds:roku:us-east-1', end_date, '20181221-00')
     rds_west_family_list = ['t2.postgres', 't2.mysql', 't2.aurora-mysql', 't2.aurora', 't2.mariadb',
                             'r3.mysql',
                             'r4.aurora-postgresql', 'r4.aurora', 'r4.aurora-mysql', 'r4.postgres',
@@ -299,34 +285,69 @@ def do_make_ec2_plots(event):
     print('Done.')
 
     # Elasticache us-west-2
-    df_elasticache_west = awscost_helper_util.get_panda_for_resource(AWS_COST_TABLE, 'elasticache:roku:us-west-2',
-                                                               end_date, '20181221-00')
+    df_elasticache_west = get_daily_panda_for_resource('elasticache:roku:us-west-2', end_date, '20181221-00')
     print('elasticache west head(): \n{}'.format(df_elasticache_west.head()))
     elasticache_westfamily_list = ['cache.r',  'cache.t']
     plot_node_families_from_awscost_data_frame(df_elasticache_west, elasticache_westfamily_list, 'Elasticache_us-west-2')
 
     # Elasticache us-east-1
-    df_elasticache_east = awscost_helper_util.get_panda_for_resource(AWS_COST_TABLE, 'elasticache:roku:us-east-1',
-                                                               end_date, '20181221-00')
+    df_elasticache_east = get_daily_panda_for_resource('elasticache:roku:us-east-1', end_date, '20181221-00')
     print('elasticache east head(): \n{}'.format(df_elasticache_east.head()))
     elasticache_eastfamily_list = ['cache.m', 'cache.r',  'cache.t']
     plot_node_families_from_awscost_data_frame(df_elasticache_east, elasticache_eastfamily_list, 'Elasticache_us-east-1')
 
     # Elasticsearch Service us-west-2
-    df_elasticsearch_west = awscost_helper_util.get_panda_for_resource(AWS_COST_TABLE, 'es:roku:us-west-2',
-                                                               end_date, '20181221-00')
+    df_elasticsearch_west = get_daily_panda_for_resource('es:roku:us-west-2', end_date, '20181221-00')
     print('elasticsearch west head(): \n{}'.format(df_elasticsearch_west.head()))
     elastsearch_westfamily_list = ['i', 'm',  'r', 't']
     plot_node_families_from_awscost_data_frame(df_elasticsearch_west, elastsearch_westfamily_list, 'Elasticsearch_us-west-2')
 
     # Elasticsearch Service us-east-1
-    df_elastisearch_east = awscost_helper_util.get_panda_for_resource(AWS_COST_TABLE, 'es:roku:us-east-1',
-                                                               end_date, '20181221-00')
+    df_elastisearch_east = get_daily_panda_for_resource('es:roku:us-east-1', end_date, '20181221-00')
     print('elasticsearch east head(): \n{}'.format(df_elastisearch_east.head()))
     elasticsearch_eastfamily_list = ['i', 'm',  'r', 't']
     plot_node_families_from_awscost_data_frame(df_elastisearch_east, elasticsearch_eastfamily_list, 'Elasticsearch_us-east-1')
 
 
+def get_cached_panda_for_resource(key, start_time, end_time):
+    """
+    Same DataFrame as awscost_helper_util.get_panda_for_resource, but read from the
+    Parquet series cache, which only queries DynamoDB for hours it doesn't have yet.
+    :param key: AWSCost key value like: ec2os:roku:us-east-1
+    :param start_time: Time index like: 20190301-00
+    :param end_time: Time index like: 20181221-00
+    :return: DataFrame indexed by 'time'
+    """
+    series_data_frame = series_cache.get_series(AWS_COST_TABLE, key, start_time, end_time)
+    row_0 = awscost_helper_util.create_time_column_values(start_time, end_time)
+    return awscost_helper_util.reindex_time_rows(series_data_frame, row_0)
+
+
+def get_daily_panda_for_resource(key, start_time, end_time):
+    """
+    One row per day, with the mean of each node type, from the daily rollups. Plots
+    going back months read one row per day instead of 24.
+    If a day has no rollup yet, the hourly data from the series cache is used instead.
+    :param key: AWSCost key value like: ec2os:roku:us-east-1
+    :param start_time: Time index like: 20190301-00
+    :param end_time: Time index like: 20181221-00
+    :return: DataFrame indexed by 'time'
+    """
+    start_day = min(start_time, end_time)[0:8]
+    end_day = max(start_time, end_time)[0:8]
+    try:
+        daily_data_frame = rollups.get_daily_data_frame(AWS_COST_TABLE, key, start_day, end_day)
+        expected_days = len(rollups.get_days(start_day, end_day))
+        if len(daily_data_frame) >= expected_days:
+            return daily_data_frame
+        print('{} has rollups for {} of {} days. Using hourly data.'.format(key, len(daily_data_frame), expected_days))
+    except Exception as ex:
+        print('Failed to read rollups for {}. Reason: {}'.format(key, ex))
+        awscost_helper_util.log_traceback_exception(ex)
+
+    return get_cached_panda_for_resource(key, start_time, end_time)
+
+
 def plot_node_families_from_awscost_data_frame(df_source, family_list, region_title, lambda_filter_func=None):
     """
     Given an EC2 DataFrame with the AWS Cost data in it, plot the family if it is found in the data-frame.
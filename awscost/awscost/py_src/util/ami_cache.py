@@ -0,0 +1,244 @@
+"""
+Cache for resolving EC2 AMI ids to OS types during EC2 scans.
+
+Two things are cached:
+  AMI descriptions from ec2 describe_images, looked up in batches.
+  os_type values from the AWSCostMap table, looked up with batch_get_item.
+
+AMIs that describe_images doesn't return aren't cached. An AMI that isn't
+shared with one account can still be visible from the account that owns it.
+
+Entries are kept in memory, which survives warm lambda invocations, and in a
+JSON file in /tmp, which survives as long as the lambda container does. Each
+entry has a time-stamp so it expires after a TTL.
+"""
+from __future__ import print_function
+
+import json
+import os
+import threading
+import time
+from botocore.exceptions import ClientError
+
+import util.awscost_helper_util as awscost_helper_util
+
+CACHE_FILE_PATH = '/tmp/awscost_ami_cache.json'
+
+# AMI descriptions don't change, but an AMI can be deregistered or un-shared.
+IMAGE_DESC_TTL_SEC = 24 * 60 * 60
+# AWSCostMap os_type values are filled in by hand, so pick up changes within an hour.
+COST_MAP_TTL_SEC = 60 * 60
+
+# Max ImageIds per describe_images call.
+DESCRIBE_IMAGES_BATCH_SIZE = 100
+
+# image_id -> [description, time-stamp]
+IMAGE_DESCRIPTIONS = {}
+# image_id -> [os_type, time-stamp]
+COST_MAP_OS_TYPES = {}
+CACHE_LOCK = threading.Lock()
+CACHE_STATE = {'loaded_from_disk': False}
+CACHE_STATS = {
+    'desc_hits': 0,
+    'desc_misses': 0,
+    'describe_images_calls': 0,
+    'cost_map_hits': 0,
+    'cost_map_misses': 0,
+    'batch_get_item_calls': 0
+}
+
+
+def load_cache_from_disk():
+    """
+    Load the cache file from /tmp the first time the cache is used in this container.
+    :return: None
+    """
+    with CACHE_LOCK:
+        if CACHE_STATE['loaded_from_disk']:
+            return
+        CACHE_STATE['loaded_from_disk'] = True
+        if not os.path.exists(CACHE_FILE_PATH):
+            return
+        try:
+            with open(CACHE_FILE_PATH) as cache_file:
+                data = json.load(cache_file)
+            IMAGE_DESCRIPTIONS.update(
+                (k, v) for k, v in data.get('image_descriptions', {}).items() if v[0] is not None)
+            COST_MAP_OS_TYPES.update(data.get('cost_map_os_types', {}))
+            print('Loaded AMI cache: {} descriptions, {} os_types'.format(
+                len(IMAGE_DESCRIPTIONS), len(COST_MAP_OS_TYPES)))
+        except Exception as ex:
+            print('WARN: Could not read AMI cache file {}. Reason: {}'.format(CACHE_FILE_PATH, ex))
+
+
+def save_cache_to_disk():
+    """
+    Write the un-expired cache entries to /tmp for the next invocation.
+    :return: None
+    """
+    now = time.time()
+    with CACHE_LOCK:
+        data = {
+            'image_descriptions': dict(
+                (k, v) for k, v in IMAGE_DESCRIPTIONS.items() if now - v[1] < IMAGE_DESC_TTL_SEC),
+            'cost_map_os_types': dict(
+                (k, v) for k, v in COST_MAP_OS_TYPES.items() if now - v[1] < COST_MAP_TTL_SEC)
+        }
+    try:
+        temp_path = CACHE_FILE_PATH + '.tmp'
+        with open(temp_path, 'w') as cache_file:
+            json.dump(data, cache_file)
+        os.rename(temp_path, CACHE_FILE_PATH)
+    except Exception as ex:
+        print('WARN: Could not write AMI cache file {}. Reason: {}'.format(CACHE_FILE_PATH, ex))
+
+
+def get_cache_stats():
+    """
+    Cache hit/miss counts and number of API calls since the lambda container started.
+    :return: dict
+    """
+    with CACHE_LOCK:
+        return dict(CACHE_STATS)
+
+
+def get_cached_values(cache, image_ids, ttl_sec, hit_key, miss_key):
+    """
+    Split image_ids into values found in a cache and ids that still need a look-up.
+    :param cache: IMAGE_DESCRIPTIONS or COST_MAP_OS_TYPES
+    :param image_ids: iterable of AMI ids.
+    :param ttl_sec: entries older than this are treated as missing.
+    :param hit_key: CACHE_STATS key to increment for hits.
+    :param miss_key: CACHE_STATS key to increment for misses.
+    :return: tuple (dict of image_id to value, list of missing image_ids)
+    """
+    found = {}
+    missing = []
+    now = time.time()
+    with CACHE_LOCK:
+        for image_id in set(image_ids):
+            entry = cache.get(image_id)
+            if entry and now - entry[1] < ttl_sec:
+                found[image_id] = entry[0]
+            else:
+                missing.append(image_id)
+        CACHE_STATS[hit_key] += len(found)
+        CACHE_STATS[miss_key] += len(missing)
+    return found, missing
+
+
+def get_image_descriptions(ec2_client, image_ids):
+    """
+    Get the description (or name if no description) for each AMI id.
+    Ids not in the cache are looked up with batched describe_images calls.
+    :param ec2_client: boto3 ec2 client for the account and region the instances are in.
+    :param image_ids: iterable of AMI ids.
+    :return: dict of image_id to description. Value is None if the AMI isn't visible.
+    """
+    load_cache_from_disk()
+    descriptions, missing = get_cached_values(
+        IMAGE_DESCRIPTIONS, image_ids, IMAGE_DESC_TTL_SEC, 'desc_hits', 'desc_misses')
+
+    for i in range(0, len(missing), DESCRIBE_IMAGES_BATCH_SIZE):
+        batch = missing[i:i + DESCRIBE_IMAGES_BATCH_SIZE]
+        try:
+            batch_descriptions = describe_images_batch(ec2_client, batch)
+        except Exception as ex:
+            # Throttling or access errors. Don't cache, so these are looked up next time.
+            print('WARN: describe_images failed for batch of {}. Reason: {}'.format(len(batch), ex))
+            for image_id in batch:
+                descriptions[image_id] = None
+            continue
+        now = time.time()
+        with CACHE_LOCK:
+            for image_id in batch:
+                desc = batch_descriptions.get(image_id)
+                if desc is not None:
+                    IMAGE_DESCRIPTIONS[image_id] = [desc, now]
+                descriptions[image_id] = desc
+
+    return descriptions
+
+
+def describe_images_batch(ec2_client, image_ids):
+    """
+    One describe_images call for a batch of AMI ids. If the batch fails because
+    an id is invalid, fall back to one call per id. Other errors are raised.
+    :param ec2_client:
+    :param image_ids: list of up to DESCRIBE_IMAGES_BATCH_SIZE AMI ids.
+    :return: dict of image_id to description for the AMIs found.
+    """
+    ret_val = {}
+    try:
+        with CACHE_LOCK:
+            CACHE_STATS['describe_images_calls'] += 1
+        response = ec2_client.describe_images(ImageIds=image_ids)
+        for curr_image in response.get('Images', []):
+            desc = curr_image.get('Description') or curr_image.get('Name')
+            if desc:
+                ret_val[curr_image.get('ImageId')] = desc
+    except ClientError as ce:
+        if not ce.response['Error']['Code'].startswith('InvalidAMIID'):
+            raise
+        if len(image_ids) == 1:
+            print('WARN: describe_images invalid AMI id {}. Reason: {}'.format(image_ids[0], ce))
+            return ret_val
+        print('WARN: describe_images batch of {} has an invalid AMI id. Retry one at a time.'
+              .format(len(image_ids)))
+        for image_id in image_ids:
+            ret_val.update(describe_images_batch(ec2_client, [image_id]))
+    return ret_val
+
+
+def get_os_types_from_cost_map(dynamodb_client, image_ids):
+    """
+    Look up manually annotated os_type values in the AWSCostMap table.
+    Ids not in the cache are read with awscost_helper_util.batch_get_items.
+    :param dynamodb_client: boto3 dynamodb client. Called from scan threads, so not a resource.
+    :param image_ids: iterable of AMI ids.
+    :return: tuple (dict of image_id to os_type for ids in the table, list of ids not in the table)
+    """
+    load_cache_from_disk()
+    cached, missing = get_cached_values(
+        COST_MAP_OS_TYPES, image_ids, COST_MAP_TTL_SEC, 'cost_map_hits', 'cost_map_misses')
+
+    # A cached None means the id wasn't in the table.
+    os_types = dict((k, v) for k, v in cached.items() if v is not None)
+    not_in_table = [k for k, v in cached.items() if v is None]
+
+    batch_size = awscost_helper_util.BATCH_GET_ITEM_SIZE
+    for i in range(0, len(missing), batch_size):
+        batch = missing[i:i + batch_size]
+        with CACHE_LOCK:
+            CACHE_STATS['batch_get_item_calls'] += 1
+        try:
+            items = awscost_helper_util.batch_get_items(
+                dynamodb_client, 'AWSCostMap', [{'id': image_id} for image_id in batch], projection_expression='id, os_type')
+        except awscost_helper_util.AwsCostHelperError as ex:
+            # Unknown if they are in the table, so don't cache them or report them missing.
+            print('WARN: AWSCostMap look-up failed for batch of {}. Reason: {}'.format(len(batch), ex))
+            continue
+
+        batch_os_types = dict((item['id'], item.get('os_type') or '?') for item in items)
+        now = time.time()
+        with CACHE_LOCK:
+            for image_id in batch:
+                os_type = batch_os_types.get(image_id)
+                COST_MAP_OS_TYPES[image_id] = [os_type, now]
+                if os_type is None:
+                    not_in_table.append(image_id)
+                else:
+                    os_types[image_id] = os_type
+
+    return os_types, not_in_table
+
+
+def set_cost_map_os_type(image_id, os_type):
+    """
+    Record an os_type written to AWSCostMap, so the next look-up doesn't read it back.
+    :param image_id:
+    :param os_type:
+    :return: None
+    """
+    with CACHE_LOCK:
+        COST_MAP_OS_TYPES[image_id] = [os_type, time.time()]
@@ -2,6 +2,7 @@
 from __future__ import print_function
 
 import json
+import threading
 import boto3
 import pendulum
 
@@ -27,6 +28,12 @@ ENVIRONMENTS = {
     "sr-qa": '223456789012',
     "sr-prod": '323456789012'}
 
+# boto3 clients by (account, region, service name). Module level so they survive
+# warm lambda invocations. boto3 clients are thread-safe so they can be shared.
+BOTO3_CLIENTS = {}
+BOTO3_CLIENTS_LOCK = threading.Lock()
+BOTO3_CLIENT_STATS = {'hits': 0, 'misses': 0}
+
 
 class CodePipelineStageError(Exception):
     """Raise this exception when you want to fail a stage in code-pipeline"""
@@ -51,22 +58,55 @@ def env_is_valid(env):
 def get_boto3_client_by_name(name, session, region):
     """
     Get a boto3 client by the name string.
+
+    Clients are cached by account, region and name. A cached client is reused
+    as long as it was built from the same credentials as the session passed in,
+    so a refreshed session gets a new client.
     :param name: string like:  ec2, dynamodb, cloudformation, ...
     :param session: session has temp credentials from AWS.
     :param region: AWS region like: us-east-1, us-west-2, etc...
     :return:
     """
+    # The account id is in the AssumedRoleUser Arn. arn:aws:sts::123456789012:assumed-role/ctipoke/ctipoke
+    access_key_id = session['Credentials']['AccessKeyId']
+    account_id = access_key_id
+    arn = session.get('AssumedRoleUser', {}).get('Arn')
+    if arn:
+        account_id = arn.split(':')[4]
+    cache_key = (account_id, region, name)
+    with BOTO3_CLIENTS_LOCK:
+        cached = BOTO3_CLIENTS.get(cache_key)
+        if cached and cached[0] == access_key_id:
+            BOTO3_CLIENT_STATS['hits'] += 1
+            return cached[1]
+        BOTO3_CLIENT_STATS['misses'] += 1
+
     print('Getting boto3 client: {}'.format(name))
-    some_aws_client = boto3.client(
-        name,
+    # A new boto3 Session per call, since the default session isn't thread-safe for scans.
+    boto3_session = boto3.session.Session(
         aws_access_key_id=session['Credentials']['AccessKeyId'],
         aws_secret_access_key=session['Credentials']['SecretAccessKey'],
         aws_session_token=session['Credentials']['SessionToken'],
         region_name=region
     )
+    some_aws_client = boto3_session.client(name)
+
+    with BOTO3_CLIENTS_LOCK:
+        BOTO3_CLIENTS[cache_key] = (access_key_id, some_aws_client)
     return some_aws_client
 
 
+def get_client_cache_stats():
+    """
+    Hit and miss counts for the boto3 client cache since the lambda container started.
+    :return: dict like {'hits': 300, 'misses': 150, 'size': 150}
+    """
+    with BOTO3_CLIENTS_LOCK:
+        stats = dict(BOTO3_CLIENT_STATS)
+        stats['size'] = len(BOTO3_CLIENTS)
+    return stats
+
+
 def get_boto3_resource_by_name(name, session, region):
     """
 
@@ -76,13 +116,13 @@ def get_boto3_resource_by_name(name, session, region):
     :return:
     """
     print('Getting boto3 resource: {}'.format(name))
-    some_aws_resource = boto3.resource(
-        name,
+    boto3_session = boto3.session.Session(
         aws_access_key_id=session['Credentials']['AccessKeyId'],
         aws_secret_access_key=session['Credentials']['SecretAccessKey'],
         aws_session_token=session['Credentials']['SessionToken'],
         region_name=region
     )
+    some_aws_resource = boto3_session.resource(name)
     return some_aws_resource
 
 
@@ -11,9 +11,19 @@ import pendulum
 import boto3
 import json
 import re
+import threading
+import time
 import pandas as pd
 import numpy as np
+import util.price_catalog as price_catalog
 from boto3.dynamodb.conditions import Key, Attr
+from boto3.dynamodb.types import TypeSerializer, TypeDeserializer
+from dateutil.tz import tzutc
+
+try:
+    import Queue as queue
+except ImportError:
+    import queue
 
 # This is a mapping of account names to account IDs. This is used to create the ctipoke role and below is 
 # are a few accounts as an example. Replace with actual account IDs and names. The size of list is unlimited.
@@ -29,14 +39,26 @@ AWS_ACCOUNTS = {
 # first call.
 AWS_NAMES = {}
 
+# Assumed-role sessions by account name. Module level so they survive warm lambda invocations.
+CTI_POKE_SESSIONS = {}
+CTI_POKE_SESSION_LOCKS = {}
+CTI_POKE_SESSION_LOCK = threading.Lock()
+CTI_POKE_SESSION_STATS = {'hits': 0, 'misses': 0}
+
+# Get new credentials when the cached ones are this close to 'Expiration'.
+SESSION_EXPIRE_MARGIN_SEC = 300
+
+# DynamoDB allows up to 100 keys per batch_get_item call.
+BATCH_GET_ITEM_SIZE = 100
+BATCH_GET_ITEM_MAX_RETRIES = 8
+
+# Time-series reads only need these attributes. 'time' is a DynamoDB reserved word.
+TIME_SERIES_PROJECTION = '#t, node_types'
+TIME_SERIES_ATTRIBUTE_NAMES = {'#t': 'time'}
+# Split time-series queries longer than this into parallel segments.
+TIME_SERIES_HOURS_PER_SEGMENT = 24 * 14
+TIME_SERIES_MAX_SEGMENTS = 8
 
-# Filter for get_price
-# Search product filter
-FLT = '[{{"Field": "tenancy", "Value": "shared", "Type": "TERM_MATCH"}},'\
-      '{{"Field": "operatingSystem", "Value": "{o}", "Type": "TERM_MATCH"}},'\
-      '{{"Field": "preInstalledSw", "Value": "NA", "Type": "TERM_MATCH"}},'\
-      '{{"Field": "instanceType", "Value": "{t}", "Type": "TERM_MATCH"}},'\
-      '{{"Field": "location", "Value": "{r}", "Type": "TERM_MATCH"}}]'
 
 # Contains likely regions, but not all. Add more if needed.
 REGIONS = {
@@ -116,14 +138,58 @@ class AwsCostHelperError(Exception):
 def create_cti_poke_session(aws_account_name):
     """
     Create a session with read access to AWS accounts.
+
+    Sessions are cached per account and reused until shortly before the
+    credentials 'Expiration', so a scan does one STS call per account
+    instead of one per account, region and check.
     :param aws_account_name: Same as ENVIRONMENT above.
     :return: session.
     """
-    sts = boto3.client('sts')
-    session = sts.assume_role(
-        RoleArn='arn:aws:iam::{}:role/ctipoke'.format(AWS_ACCOUNTS[aws_account_name]),
-        RoleSessionName='ctipoke')
-    return session
+    with CTI_POKE_SESSION_LOCK:
+        account_lock = CTI_POKE_SESSION_LOCKS.get(aws_account_name)
+        if not account_lock:
+            account_lock = threading.Lock()
+            CTI_POKE_SESSION_LOCKS[aws_account_name] = account_lock
+
+    # Lock per account, so threads for the same account wait for one STS call.
+    with account_lock:
+        session = CTI_POKE_SESSIONS.get(aws_account_name)
+        if session and not is_session_expiring(session):
+            CTI_POKE_SESSION_STATS['hits'] += 1
+            return session
+
+        CTI_POKE_SESSION_STATS['misses'] += 1
+        # Own boto3 Session so this is safe to call from scan threads.
+        sts = boto3.session.Session().client('sts')
+        session = sts.assume_role(
+            RoleArn='arn:aws:iam::{}:role/ctipoke'.format(AWS_ACCOUNTS[aws_account_name]),
+            RoleSessionName='ctipoke')
+        CTI_POKE_SESSIONS[aws_account_name] = session
+        return session
+
+
+def is_session_expiring(session):
+    """
+    True if the session credentials expire within SESSION_EXPIRE_MARGIN_SEC.
+    :param session: response from sts.assume_role
+    :return: True if new credentials are needed.
+    """
+    expiration = session.get('Credentials', {}).get('Expiration')
+    if not expiration:
+        return True
+    now = datetime.datetime.now(tzutc())
+    return expiration - now < datetime.timedelta(seconds=SESSION_EXPIRE_MARGIN_SEC)
+
+
+def get_session_cache_stats():
+    """
+    Hit and miss counts for the cti-poke session cache since the lambda container started.
+    :return: dict like {'hits': 120, 'misses': 25, 'size': 25}
+    """
+    with CTI_POKE_SESSION_LOCK:
+        stats = dict(CTI_POKE_SESSION_STATS)
+        stats['size'] = len(CTI_POKE_SESSIONS)
+    return stats
 
 
 def create_cost_explorer_session():
@@ -453,6 +519,237 @@ def create_time_column_values(start_time, end_time):
     return ret_val
 
 
+def query_time_series(awscost_table, key, from_time, to_time=None, projected=True, num_segments=None,
+                      consistent_read=False):
+    """
+    Generator over the AWSCost items for one awsResource key between two time indexes.
+    Follows LastEvaluatedKey, so windows larger than 1 MB of data are not cut off.
+
+    Long time ranges are split into segments that are queried on separate threads.
+    Items are still yielded in time order, and the first segment is yielded while
+    the later ones are being read.
+
+    :param awscost_table: boto3 Table for AWSCost
+    :param key: AWSCost key value like: ec2os:roku:us-east-1
+    :param from_time: oldest time index like: 20190101-00
+    :param to_time: newest time index like: 20190401-00. None for everything after from_time.
+    :param projected: True to only read 'time' and 'node_types'.
+    :param num_segments: number of parallel queries. None to pick based on the length of the range.
+    :param consistent_read: True to see rows written just before, like the hour do_summary just wrote.
+    :return: generator of items.
+    """
+    if to_time and from_time > to_time:
+        swap = to_time
+        to_time = from_time
+        from_time = swap
+
+    segments = split_time_range(from_time, to_time, num_segments)
+    if len(segments) == 1:
+        for item in query_time_series_segment(awscost_table, key, segments[0][0], segments[0][1], projected,
+                                              consistent_read):
+            yield item
+        return
+
+    # One queue per segment, so items can be yielded in order as they arrive.
+    segment_queues = [queue.Queue() for x in segments]
+    done = object()
+
+    def read_segment(segment, segment_queue):
+        try:
+            for item in query_time_series_segment(awscost_table, key, segment[0], segment[1], projected,
+                                                  consistent_read):
+                segment_queue.put(item)
+        except Exception as ex:
+            segment_queue.put(ex)
+        segment_queue.put(done)
+
+    for segment, segment_queue in zip(segments, segment_queues):
+        reader = threading.Thread(target=read_segment, args=(segment, segment_queue))
+        reader.daemon = True
+        reader.start()
+
+    for segment_queue in segment_queues:
+        while True:
+            item = segment_queue.get()
+            if item is done:
+                break
+            if isinstance(item, Exception):
+                raise item
+            yield item
+
+
+def query_time_series_segment(awscost_table, key, from_time, to_time, projected, consistent_read=False):
+    """
+    Generator for one paginated AWSCost query. See query_time_series.
+    :param awscost_table:
+    :param key:
+    :param from_time: oldest time index. Inclusive.
+    :param to_time: newest time index. Inclusive. None for no upper limit.
+    :param projected:
+    :param consistent_read:
+    :return: generator of items.
+    """
+    if to_time:
+        key_condition = Key('awsResource').eq(key) & Key('time').between(from_time, to_time)
+    else:
+        key_condition = Key('awsResource').eq(key) & Key('time').gte(from_time)
+
+    query_args = {'KeyConditionExpression': key_condition}
+    if projected:
+        query_args['ProjectionExpression'] = TIME_SERIES_PROJECTION
+        query_args['ExpressionAttributeNames'] = TIME_SERIES_ATTRIBUTE_NAMES
+    if consistent_read:
+        query_args['ConsistentRead'] = True
+
+    while True:
+        response = awscost_table.query(**query_args)
+        for item in response.get('Items', []):
+            yield item
+
+        last_key = response.get('LastEvaluatedKey')
+        if not last_key:
+            break
+        query_args['ExclusiveStartKey'] = last_key
+
+
+def split_time_range(from_time, to_time, num_segments=None):
+    """
+    Split a time range into contiguous, non-overlapping segments.
+    :param from_time: oldest time index like: 20190101-00
+    :param to_time: newest time index like: 20190401-00, or None for no upper limit.
+    :param num_segments: number of segments. None to use TIME_SERIES_HOURS_PER_SEGMENT.
+    :return: list of (from_time, to_time) tuples, oldest first. Both ends are inclusive.
+    """
+    if not to_time:
+        return [(from_time, to_time)]
+
+    start = datetime.datetime.strptime(from_time, '%Y%m%d-%H')
+    end = datetime.datetime.strptime(to_time, '%Y%m%d-%H')
+    total_hours = int((end - start).total_seconds() // 3600) + 1
+
+    if num_segments is None:
+        num_segments = min(TIME_SERIES_MAX_SEGMENTS, total_hours // TIME_SERIES_HOURS_PER_SEGMENT + 1)
+    num_segments = max(1, min(num_segments, total_hours))
+
+    hours_per_segment = total_hours // num_segments
+    ret_val = []
+    segment_start = from_time
+    for x in range(num_segments):
+        if x == num_segments - 1:
+            segment_end = to_time
+        else:
+            segment_end = increment_time_index(segment_start, hours_per_segment - 1)
+        ret_val.append((segment_start, segment_end))
+        segment_start = increment_time_index(segment_end, 1)
+
+    return ret_val
+
+
+def create_data_frame_from_items(items, time_values):
+    """
+    Build a DataFrame from AWSCost items with one row per time index and one
+    column per node type. The frame is made in one step from the records
+    instead of adding columns and cells one at a time.
+    :param items: iterable of AWSCost items with 'time' and 'node_types' attributes.
+    :param time_values: list of time indexes for the rows, like: ['20181204-15', '20181204-14', ...]
+    :return: DataFrame indexed by 'time'. Missing cells are NaN.
+    """
+    column_names = []
+    column_names_set = set()
+    record_times = []
+    records = []
+    for curr_item in items or []:
+        node_types = curr_item.get('node_types')
+        if not node_types:
+            continue
+        for curr_key in sorted(node_types.keys()):
+            if curr_key not in column_names_set:
+                column_names_set.add(curr_key)
+                column_names.append(curr_key)
+        record_times.append(curr_item.get('time'))
+        records.append(node_types)
+
+    print('create_data_frame_from_items: {} items, {} columns'.format(len(records), len(column_names)))
+
+    if records:
+        ret_val_data_frame = pd.DataFrame.from_records(records, index=record_times, columns=column_names)
+        try:
+            # DynamoDB numbers come back as Decimal.
+            ret_val_data_frame = ret_val_data_frame.astype(float)
+        except (TypeError, ValueError) as ex:
+            print('WARN: Non-numeric node_types values. Reason: {}'.format(ex))
+    else:
+        ret_val_data_frame = pd.DataFrame(index=record_times)
+
+    return reindex_time_rows(ret_val_data_frame, time_values)
+
+
+def reindex_time_rows(data_frame, time_values):
+    """
+    Reindex a DataFrame so it has a row for each of time_values, in that order.
+    Rows for times not in time_values are kept at the end, like the old cell by
+    cell version of create_data_frame_from_items did.
+    :param data_frame: DataFrame indexed by time index.
+    :param time_values: list of time indexes for the rows.
+    :return: DataFrame indexed by 'time'.
+    """
+    time_values_set = set(time_values)
+    row_index = list(time_values) + [t for t in data_frame.index if t not in time_values_set]
+
+    ret_val_data_frame = data_frame.reindex(row_index)
+    ret_val_data_frame.index.name = 'time'
+
+    return ret_val_data_frame
+
+
+def batch_get_items(dynamodb_client, table_name, keys, projection_expression=None):
+    """
+    Read many items from a DynamoDB table with batch_get_item, 100 keys per call.
+    UnprocessedKeys are retried with exponential back-off.
+    Uses the low-level client, since it is called from scan threads and boto3
+    resources aren't thread-safe. Keys and items are plain python values, like a Table.
+    :param dynamodb_client: boto3 dynamodb client.
+    :param table_name: like: 'AWSCost'
+    :param keys: list of key dictionaries like: [{'awsResource': 'rds:123456789012:us-east-1', 'time': '20181115-14'}]
+    :param projection_expression: attributes to read, like: 'id, os_type'. Default is all.
+    :return: list of items found. Keys not in the table are left out.
+    """
+    # batch_get_item rejects duplicate keys in one request.
+    serializer = TypeSerializer()
+    deserializer = TypeDeserializer()
+    unique_keys = []
+    seen = set()
+    for key in keys:
+        key_tuple = tuple(sorted(key.items()))
+        if key_tuple not in seen:
+            seen.add(key_tuple)
+            unique_keys.append(dict((name, serializer.serialize(value)) for name, value in key.items()))
+
+    items = []
+    num_calls = 0
+    for i in range(0, len(unique_keys), BATCH_GET_ITEM_SIZE):
+        request_items = {table_name: {'Keys': unique_keys[i:i + BATCH_GET_ITEM_SIZE]}}
+        if projection_expression:
+            request_items[table_name]['ProjectionExpression'] = projection_expression
+        retries = 0
+        while request_items:
+            num_calls += 1
+            response = dynamodb_client.batch_get_item(RequestItems=request_items)
+            for item in response.get('Responses', {}).get(table_name, []):
+                items.append(dict((name, deserializer.deserialize(value)) for name, value in item.items()))
+
+            request_items = response.get('UnprocessedKeys')
+            if request_items:
+                retries += 1
+                if retries > BATCH_GET_ITEM_MAX_RETRIES:
+                    raise AwsCostHelperError('batch_get_item on {} still had unprocessed keys after {} retries'
+                                             .format(table_name, BATCH_GET_ITEM_MAX_RETRIES))
+                time.sleep(min(0.05 * (2 ** retries), 5.0))
+
+    print('batch_get_items {}: {} keys, {} items, {} calls'.format(table_name, len(unique_keys), len(items), num_calls))
+    return items
+
+
 def upload_json_to_awscost_data_s3_bucket(s3_dir, s3_filename, json_text):
     """
     Upload a json text to an s3 bucket with a given key. Which in the context of
@@ -485,7 +782,7 @@ def upload_file_to_awscost_s3_bucket(s3_dir, s3_filename, local_path, delete_loc
     :param s3_filename: name of file in S3. ex: "reservation_coverage_total.json"
     :param local_path: local path to file. ex: "/tmp/reservation_coverage_total.json"
     :param delete_local_file: True if you want to delete file after upload. Default it False.
-    :return:
+    :return: True if the file was uploaded.
     """
     try:
         bucket_name = 'awscost-data'
@@ -497,10 +794,12 @@ def upload_file_to_awscost_s3_bucket(s3_dir, s3_filename, local_path, delete_loc
 
         if delete_local_file:
             os.remove(local_path)
+        return True
 
     except Exception as ex:
         print('Failed to upload to awscost-data S3 bucket: {}'.format(ex.message))
         log_traceback_exception(ex)
+        return False
 
 
 def get_panda_for_resource(awscost_table, key, start_time, end_time):
@@ -515,47 +814,11 @@ def get_panda_for_resource(awscost_table, key, start_time, end_time):
     try:
         print('get_panda_for_resource: key={}, start_time={}, end_time={}'.format(key, start_time, end_time))
 
-        # Go back 3 weeks.
-        # row_0 = create_time_column_values(time_index, -1, hours_in_3_weeks)
         row_0 = create_time_column_values(start_time, end_time)
-        time_dict = {'time': row_0}
-
-        ret_val_data_frame = pd.DataFrame(index=time_dict.get('time'))
-        ret_val_data_frame.index.name = 'time'
-
-        # swap start and end time if one is larger than other. DynamoDB "between" is picky.
-        if start_time < end_time:
-            swap = end_time
-            end_time = start_time
-            start_time = swap
-            print('Swapped start and end times. start_time={}, end_time={}'.format(start_time, end_time))
-
-        response = awscost_table.query(
-            KeyConditionExpression=Key('awsResource').eq(key) & Key('time').between(end_time, start_time)
-        )
-
-        column_names_set = set()
-
-        items = response.get('Items')
-        if items:
-            for curr_item in items:
-                node_types = curr_item.get('node_types')
-                time_index = curr_item.get('time')
-
-                key_list = node_types.keys()
-                key_list.sort()
-
-                for curr_key in key_list:
-                    if curr_key not in column_names_set:
-                        col_num = len(ret_val_data_frame.columns)
-                        print('adding column: {} @ {}'.format(curr_key, col_num))
 
-                        ret_val_data_frame.insert(col_num, curr_key, np.nan)
-                        column_names_set.add(curr_key)
-
-                    curr_value = node_types.get(curr_key)
-                    # print('{}: {}'.format(curr_key, curr_value))
-                    ret_val_data_frame.at[time_index, curr_key] = curr_value
+        # query_time_series swaps start and end time if needed. DynamoDB "between" is picky.
+        items = query_time_series(awscost_table, key, end_time, start_time)
+        ret_val_data_frame = create_data_frame_from_items(items, row_0)
 
         return ret_val_data_frame
 
@@ -702,37 +965,24 @@ def is_int(str):
 
 def get_price(region, instance, os_type):
     """
-    Get the OnDemand price for a specific EC2 Instance type.
-    :param region: String - Short name for region. us-east-1 | us-west-2
+    Get the OnDemand price for a specific EC2 Instance type from the EC2 price catalog.
+    :param region: String - Short name for region. us-east-1 | us-west-2, or long name like 'EU (Ireland)'
     :param instance: String - like m5.4xlarge
     :param os_type: String - values: Windows | Linux | RHEL | SUSE
-    :return:
+    :return: float USD per hour, or None if not found.
     """
     try:
-        pricing_client = boto3.client('pricing', region_name='us-east-1')
-
-        # Convert short name, to long name expected by this API.
-        long_region_name = REGIONS.get(region)
-        if long_region_name:
-            region = long_region_name
-
-        f = FLT.format(r=region, t=instance, o=os_type)
-        data = pricing_client.get_products(ServiceCode='AmazonEC2', Filters=json.loads(f))
-
-        # print('Debug: data={}'.format(data))
-
-        price_list = data.get('PriceList')
-        if price_list:
-            # print('PriceList size={}'.format(len(price_list)))
-
-            od = json.loads(data['PriceList'][0])['terms']['OnDemand']
-            id1 = list(od)[0]
-            id2 = list(od[id1]['priceDimensions'])[0]
-            return od[id1]['priceDimensions'][id2]['pricePerUnit']['USD']
-        else:
-            raise KeyError('Missing "PriceList" key')
+        # Convert long name to the short name used by the catalog.
+        for short_name, long_name in REGIONS.items():
+            if region == long_name:
+                region = short_name
+
+        price = price_catalog.get_price(region, instance, os_type)
+        if price is None:
+            raise KeyError('Not in EC2 price catalog')
+        return price
     except Exception as e:
-        print('Error: {} get_price api. region={}, instance_type={}, os_type={}'
+        print('Error: {} get_price. region={}, instance_type={}, os_type={}'
               .format(e, region, instance, os_type))
 
 
@@ -780,12 +1030,76 @@ def test_sort_nodes():
     print('rds_sorted_list = {}'.format(rds_mixed_sorted_list))
 
 
+def create_data_frame_cell_by_cell(items, time_values):
+    """
+    The original way DataFrames were built from AWSCost items, one column
+    insert and one .at[] cell at a time. Kept to benchmark create_data_frame_from_items.
+    :param items: AWSCost items with 'time' and 'node_types' attributes.
+    :param time_values: list of time indexes for the rows.
+    :return: DataFrame indexed by 'time'.
+    """
+    ret_val_data_frame = pd.DataFrame(index=time_values)
+    ret_val_data_frame.index.name = 'time'
+
+    column_names_set = set()
+    for curr_item in items:
+        node_types = curr_item.get('node_types')
+        time_index = curr_item.get('time')
+
+        for curr_key in sorted(node_types.keys()):
+            if curr_key not in column_names_set:
+                ret_val_data_frame.insert(len(ret_val_data_frame.columns), curr_key, np.nan)
+                column_names_set.add(curr_key)
+            ret_val_data_frame.at[time_index, curr_key] = node_types.get(curr_key)
+
+    return ret_val_data_frame
+
+
+def test_data_frame_builder_benchmark(num_columns=500, hours=672):
+    """
+    Compare create_data_frame_from_items with the cell by cell version on a
+    synthetic 4 week, 500 node type data set.
+    :param num_columns: number of node types.
+    :param hours: number of hourly rows.
+    :return: None
+    """
+    print('\nBenchmark DataFrame builders. columns={}, hours={}'.format(num_columns, hours))
+    time_values = []
+    curr_time = '20190301-00'
+    for x in range(hours):
+        time_values.append(curr_time)
+        curr_time = increment_time_index(curr_time, -1)
+
+    column_names = ['linux-c5.{}xlarge'.format(x) for x in range(num_columns)]
+    items = []
+    for row, time_index in enumerate(time_values):
+        # Each hour has most, but not all, of the node types.
+        node_types = dict((name, (row + col) % 50) for col, name in enumerate(column_names) if (row + col) % 7)
+        items.append({'time': time_index, 'node_types': node_types})
+
+    start = start_timer()
+    df_new = create_data_frame_from_items(items, time_values)
+    new_time = delta_time(start)
+    print('create_data_frame_from_items: {} sec. shape={}'.format(new_time, df_new.shape))
+
+    start = start_timer()
+    df_old = create_data_frame_cell_by_cell(items, time_values)
+    old_time = delta_time(start)
+    print('create_data_frame_cell_by_cell: {} sec. shape={}'.format(old_time, df_old.shape))
+
+    same = df_new.astype(float).equals(df_old.astype(float))
+    print('Same result: {}'.format(same))
+    assert same, 'create_data_frame_from_items differs from create_data_frame_cell_by_cell'
+
+
 # Use main for quick tests.
 if __name__ == '__main__':
     try:
         test_sort_nodes()
+        test_data_frame_builder_benchmark()
 
     except Exception as ex:
         # log error.
         print('Exception: {}'.format(ex.message))
-        log_traceback_exception(ex)
\ No newline at end of file
+        log_traceback_exception(ex)
+        raise
\ No newline at end of file
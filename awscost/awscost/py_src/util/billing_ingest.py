@@ -0,0 +1,320 @@
+"""
+Streaming ingest of the AWS detailed billing file:
+    <payer-account>-aws-billing-detailed-line-items-with-resources-and-tags-YYYY-MM.csv.zip
+
+The zipped file is over 1 GB and the CSV inside is several GB, so it is never
+downloaded or unzipped to /tmp. Instead:
+
+  1) The zip is read from S3 with ranged GETs through S3RangeReader, a
+     seekable file object with a bounded read buffer.
+  2) The CSV member is decompressed as a stream and parsed in chunks of
+     CSV_CHUNK_ROWS rows, only for the columns we need, with fixed dtypes.
+  3) Each chunk is grouped by account / service / tag and added to a running
+     total, which is only as large as the number of groups.
+  4) The totals are written as small Parquet files.
+
+The same functions work with a local zip file, see test_ingest_synthetic_billing_file.
+"""
+from __future__ import print_function
+
+import os
+import zipfile
+import pandas as pd
+import numpy as np
+
+import util.awscost_helper_util as awscost_helper_util
+
+# Rows per CSV chunk. About 100 MB of memory for the columns below.
+CSV_CHUNK_ROWS = 250000
+
+# Bytes per ranged GET from S3.
+S3_READ_BLOCK_SIZE = 8 * 1024 * 1024
+
+# Cost allocation tag to group by.
+DEFAULT_TAG_COLUMN = 'user:Spend_Category'
+
+# Value used when a line item doesn't have the tag.
+UNTAGGED = '(untagged)'
+
+GROUP_BY_COLUMNS = ['LinkedAccountId', 'ProductName', 'tag']
+
+# Only read these columns, with these types.
+BILLING_FILE_DTYPES = {
+    'RecordType': 'category',
+    'LinkedAccountId': 'category',
+    'ProductName': 'category',
+    'UsageQuantity': np.float64,
+    'Cost': np.float64
+}
+
+
+class BillingIngestError(Exception):
+    """
+    Raised when the billing file can't be read.
+    """
+    pass
+
+
+class S3RangeReader(object):
+    """
+    Read-only, seekable file object over an S3 object, so zipfile can read the
+    central directory at the end of the file and then stream one member.
+    Only one block of S3_READ_BLOCK_SIZE bytes is held in memory.
+    """
+    def __init__(self, s3_client, bucket, key, block_size=S3_READ_BLOCK_SIZE):
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.key = key
+        self.block_size = block_size
+        self.size = s3_client.head_object(Bucket=bucket, Key=key)['ContentLength']
+        self.position = 0
+        self.block_start = 0
+        self.block = b''
+        self.num_requests = 0
+
+    def seekable(self):
+        return True
+
+    def readable(self):
+        return True
+
+    def tell(self):
+        return self.position
+
+    def seek(self, offset, whence=0):
+        if whence == 0:
+            self.position = offset
+        elif whence == 1:
+            self.position += offset
+        elif whence == 2:
+            self.position = self.size + offset
+        else:
+            raise ValueError('Invalid whence: {}'.format(whence))
+        return self.position
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = self.size - self.position
+        ret_val = []
+        while size > 0 and self.position < self.size:
+            offset = self.position - self.block_start
+            if offset < 0 or offset >= len(self.block):
+                self._fetch_block(max(size, self.block_size))
+                offset = 0
+            data = self.block[offset:offset + size]
+            ret_val.append(data)
+            self.position += len(data)
+            size -= len(data)
+        return b''.join(ret_val)
+
+    def close(self):
+        self.block = b''
+
+    def _fetch_block(self, length):
+        """
+        Ranged GET starting at the current position.
+        :param length: number of bytes, capped at the end of the object.
+        :return: None
+        """
+        end = min(self.position + length, self.size) - 1
+        response = self.s3_client.get_object(
+            Bucket=self.bucket, Key=self.key, Range='bytes={}-{}'.format(self.position, end))
+        self.num_requests += 1
+        self.block = response['Body'].read()
+        self.block_start = self.position
+
+
+def ingest_billing_file_from_s3(s3_client, bucket, key, tag_column=DEFAULT_TAG_COLUMN):
+    """
+    Stream a zipped billing file from S3 and total the cost by account, service and tag.
+    :param s3_client: boto3 s3 client with read access to the billing bucket.
+    :param bucket: like: 'roku-billing'
+    :param key: like: '123456789012-aws-billing-detailed-line-items-with-resources-and-tags-2019-01.csv.zip'
+    :param tag_column: cost allocation tag column to group by.
+    :return: DataFrame with GROUP_BY_COLUMNS, 'UsageQuantity', 'Cost' and 'line_items' columns.
+    """
+    reader = S3RangeReader(s3_client, bucket, key)
+    print('Streaming s3://{}/{} size: {} bytes'.format(bucket, key, reader.size))
+    try:
+        summary = ingest_billing_zip(reader, tag_column)
+    finally:
+        reader.close()
+    print('S3 ranged GET requests: {}'.format(reader.num_requests))
+    return summary
+
+
+def ingest_billing_zip(zip_file_obj, tag_column=DEFAULT_TAG_COLUMN):
+    """
+    Read the CSV in a zipped billing file without extracting it.
+    :param zip_file_obj: path or seekable file object for the zip.
+    :param tag_column: cost allocation tag column to group by.
+    :return: DataFrame, see ingest_billing_csv.
+    """
+    with zipfile.ZipFile(zip_file_obj, 'r') as zip_ref:
+        csv_members = [info for info in zip_ref.infolist() if info.filename.endswith('.csv')]
+        if len(csv_members) != 1:
+            raise BillingIngestError('Expected one .csv in billing zip. Found: {}'
+                                     .format([info.filename for info in csv_members]))
+        member = csv_members[0]
+        print('Reading {} uncompressed size: {} bytes'.format(member.filename, member.file_size))
+
+        with zip_ref.open(member) as header_file:
+            columns = pd.read_csv(header_file, nrows=0).columns
+        with zip_ref.open(member) as csv_file:
+            return ingest_billing_csv(csv_file, columns, tag_column)
+
+
+def ingest_billing_csv(csv_file, columns, tag_column=DEFAULT_TAG_COLUMN):
+    """
+    Parse the billing CSV in chunks, keeping a running total per group.
+    :param csv_file: file object positioned at the header row.
+    :param columns: column names in the header.
+    :param tag_column: cost allocation tag column to group by. Missing column means all untagged.
+    :return: DataFrame with GROUP_BY_COLUMNS, 'UsageQuantity', 'Cost' and 'line_items' columns.
+    """
+    missing = [name for name in BILLING_FILE_DTYPES if name not in columns]
+    if missing:
+        raise BillingIngestError('Billing file is missing columns: {}'.format(missing))
+
+    dtypes = dict(BILLING_FILE_DTYPES)
+    use_columns = list(dtypes.keys())
+    has_tag = tag_column in columns
+    if has_tag:
+        dtypes[tag_column] = 'category'
+        use_columns.append(tag_column)
+    else:
+        print('WARN: No {} column in billing file. Everything is {}'.format(tag_column, UNTAGGED))
+
+    start = awscost_helper_util.start_timer()
+    totals = None
+    num_rows = 0
+    num_chunks = 0
+    for chunk in pd.read_csv(csv_file, usecols=use_columns, dtype=dtypes, chunksize=CSV_CHUNK_ROWS):
+        num_chunks += 1
+        num_rows += len(chunk)
+
+        # Skip the AccountTotal, InvoiceTotal, StatementTotal and Rounding rows.
+        chunk = chunk[chunk['RecordType'] == 'LineItem']
+        if has_tag:
+            tag_values = chunk[tag_column].astype(object).fillna(UNTAGGED)
+        else:
+            tag_values = UNTAGGED
+        chunk = chunk.assign(tag=tag_values, line_items=1)
+
+        chunk_totals = sum_by_group(chunk)
+        if totals is None:
+            totals = chunk_totals
+        else:
+            totals = totals.add(chunk_totals, fill_value=0)
+
+        if num_chunks % 10 == 0:
+            awscost_helper_util.print_delta_time(start, 'billing file {} rows {} groups'.format(num_rows, len(totals)))
+
+    awscost_helper_util.print_delta_time(start, 'billing file done. {} rows in {} chunks'.format(num_rows, num_chunks))
+
+    if totals is None:
+        return pd.DataFrame(columns=GROUP_BY_COLUMNS + ['UsageQuantity', 'Cost', 'line_items'])
+
+    totals['line_items'] = totals['line_items'].astype(np.int64)
+    return totals.reset_index()
+
+
+def sum_by_group(chunk):
+    """
+    Sum one chunk of line items by GROUP_BY_COLUMNS.
+    :param chunk: DataFrame of line items.
+    :return: DataFrame indexed by GROUP_BY_COLUMNS.
+    """
+    # Group on plain strings so categories from different chunks line up.
+    group_keys = [chunk[name].astype(object).fillna('') for name in GROUP_BY_COLUMNS]
+    return chunk[['UsageQuantity', 'Cost', 'line_items']].groupby(group_keys).sum()
+
+
+def write_billing_summaries(summary, out_dir, month):
+    """
+    Write the Parquet summaries for a month.
+    :param summary: DataFrame from ingest_billing_file_from_s3
+    :param out_dir: local directory, like: /tmp
+    :param month: like: 2019-01
+    :return: list of local file paths written.
+    """
+    ret_val = []
+
+    by_tag_path = os.path.join(out_dir, 'cost_by_account_service_tag_{}.parquet'.format(month))
+    summary.to_parquet(by_tag_path, index=False)
+    ret_val.append(by_tag_path)
+
+    by_service = summary.groupby(['LinkedAccountId', 'ProductName'])[['UsageQuantity', 'Cost', 'line_items']].sum()
+    by_service_path = os.path.join(out_dir, 'cost_by_account_service_{}.parquet'.format(month))
+    by_service.reset_index().to_parquet(by_service_path, index=False)
+    ret_val.append(by_service_path)
+
+    print('Billing summary {}: {} groups, total cost: {}'.format(month, len(summary), summary['Cost'].sum()))
+    return ret_val
+
+
+# Unit tests below here.
+def make_synthetic_billing_file(zip_path, num_rows=100000, tag_column=DEFAULT_TAG_COLUMN):
+    """
+    Write a zipped billing file with the same columns as the real one, for testing.
+    :param zip_path: local path for the zip.
+    :param num_rows: number of LineItem rows.
+    :param tag_column:
+    :return: DataFrame of the expected totals by GROUP_BY_COLUMNS.
+    """
+    rand = np.random.RandomState(0)
+    accounts = ['123456789012', '223456789012', '323456789012']
+    services = ['Amazon Elastic Compute Cloud', 'Amazon Simple Storage Service', 'Amazon DynamoDB']
+    tags = ['team-a', 'team-b', '']
+
+    data = pd.DataFrame({
+        'InvoiceID': 'Estimated',
+        'PayerAccountId': '088414020449',
+        'LinkedAccountId': rand.choice(accounts, num_rows),
+        'RecordType': 'LineItem',
+        'RecordId': np.arange(num_rows),
+        'ProductName': rand.choice(services, num_rows),
+        'UsageType': 'BoxUsage:m5.large',
+        'UsageStartDate': '2019-01-01 00:00:00',
+        'UsageQuantity': rand.randint(1, 10, num_rows).astype(np.float64),
+        'Cost': np.round(rand.rand(num_rows), 6),
+        'ResourceId': 'i-0123456789',
+        tag_column: rand.choice(tags, num_rows)
+    })
+    totals_row = data.iloc[[0]].copy()
+    totals_row['RecordType'] = 'AccountTotal'
+    totals_row['Cost'] = 1000000.0
+
+    csv_name = os.path.basename(zip_path)[:-len('.zip')]
+    with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as zip_ref:
+        zip_ref.writestr(csv_name, pd.concat([data, totals_row]).to_csv(index=False))
+
+    data['tag'] = data[tag_column].replace('', UNTAGGED)
+    return data.groupby(GROUP_BY_COLUMNS)[['Cost']].sum()
+
+
+def test_ingest_synthetic_billing_file():
+    """
+    Ingest a local synthetic billing file and compare with totals computed in memory.
+    :return: None
+    """
+    zip_path = '/tmp/test-aws-billing-detailed-line-items-with-resources-and-tags-2019-01.csv.zip'
+    expected = make_synthetic_billing_file(zip_path)
+
+    summary = ingest_billing_zip(zip_path)
+    actual = summary.set_index(GROUP_BY_COLUMNS)[['Cost']]
+    joined = expected.join(actual, rsuffix='_actual')
+    max_diff = (joined['Cost'] - joined['Cost_actual']).abs().max()
+    print('groups: {} expected: {}  max cost difference: {}'.format(len(actual), len(expected), max_diff))
+    assert len(actual) == len(expected), 'groups: {} expected: {}'.format(len(actual), len(expected))
+    assert joined['Cost_actual'].notnull().all(), 'missing groups in summary'
+    assert max_diff < 1e-6, 'max cost difference: {}'.format(max_diff)
+
+    paths = write_billing_summaries(summary, '/tmp', '2019-01')
+    print('wrote: {}'.format(paths))
+    os.remove(zip_path)
+
+
+# Use main for quick tests.
+if __name__ == '__main__':
+    test_ingest_synthetic_billing_file()
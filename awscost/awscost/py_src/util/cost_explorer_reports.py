@@ -0,0 +1,267 @@
+"""
+Fetch the daily Cost Explorer reservation reports.
+
+For each service (ec2, rds, elasticache, es, redshift) there are three reports:
+reservation coverage, reservation utilization and purchase recommendations.
+They are fetched on a small thread pool, with one rate limit shared by every
+Cost Explorer call, since the API is throttled per account. Each report
+follows NextPageToken, and the pages are merged into one response.
+
+Cost Explorer charges per request, so each merged response is cached in S3,
+keyed by (report, service, date range):
+
+    s3://awscost-data/cost_explorer_cache/<start>_<end>/<report>_<service>.json.gz
+
+Running the reports again for the same date range reads the cache instead.
+One S3 client is made on the calling thread and shared by the fetch threads,
+since boto3 clients are thread-safe but the default session isn't.
+
+All the reports for a day are written as one gzipped JSON file:
+
+    s3://awscost-data/<YYYYMMDD>/<YYYYMMDD>_cost_explorer_reports.json.gz
+"""
+from __future__ import print_function
+
+import gzip
+import io
+import json
+import boto3
+from botocore.exceptions import ClientError
+
+import util.awscost_helper_util as awscost_helper_util
+from util.scan_executor import ScanExecutor, RateLimiter, TASK_DONE
+
+S3_BUCKET = 'awscost-data'
+CACHE_S3_DIR = 'cost_explorer_cache'
+
+SERVICE_KEYS = ['ec2', 'rds', 'elasticache', 'es', 'redshift']
+
+# report name -> (ce client method, list attributes to merge across pages)
+REPORTS = {
+    'reservation_coverage': ('get_reservation_coverage', ['CoveragesByTime']),
+    'utilization_report': ('get_reservation_utilization', ['UtilizationsByTime']),
+    'recommendations': ('get_reservation_purchase_recommendation', ['Recommendations'])
+}
+
+# Cost Explorer calls per second, for all threads together.
+CE_CALLS_PER_SEC = 2
+FETCH_MAX_WORKERS = 5
+FETCH_TASK_TIMEOUT_SEC = 120
+
+
+def fetch_all_reports(ce_client, start_date, end_date, service_keys=None, use_cache=True, s3_client=None):
+    """
+    Fetch every report for every service at the same time.
+    :param ce_client: boto3 ce client.
+    :param start_date: like: 2019-02-21
+    :param end_date: like: 2019-02-28
+    :param service_keys: default SERVICE_KEYS
+    :param use_cache: False to call Cost Explorer even if a cached response exists.
+    :param s3_client: boto3 s3 client for the cache. Default is one made here, before the threads start.
+    :return: dict of '<service>_<report>' to merged response. Reports that failed are left out.
+    """
+    if service_keys is None:
+        service_keys = SERVICE_KEYS
+    if s3_client is None:
+        s3_client = boto3.client('s3')
+
+    rate_limiter = RateLimiter(CE_CALLS_PER_SEC)
+    executor = ScanExecutor(max_workers=FETCH_MAX_WORKERS, task_timeout_sec=FETCH_TASK_TIMEOUT_SEC)
+    for service_key in service_keys:
+        for report_name in sorted(REPORTS.keys()):
+            label = '{}_{}'.format(service_key, report_name)
+            executor.submit('ce', label, get_report, ce_client, s3_client, rate_limiter,
+                            report_name, service_key, start_date, end_date, use_cache)
+    tasks = executor.run('cost_explorer_reports')
+
+    ret_val = {}
+    for task in tasks:
+        if task.status == TASK_DONE and task.result:
+            ret_val[task.label] = task.result
+        else:
+            print('WARN: No Cost Explorer report for {}. status={} error={}'.format(task.label, task.status, task.error))
+    return ret_val
+
+
+def get_report(ce_client, s3_client, rate_limiter, report_name, service_key, start_date, end_date, use_cache=True):
+    """
+    One report, from the cache or from Cost Explorer.
+    :param ce_client:
+    :param s3_client: boto3 s3 client for the cache.
+    :param rate_limiter: RateLimiter shared by all Cost Explorer calls.
+    :param report_name: key of REPORTS.
+    :param service_key: ec2 | rds | redshift | elasticache | es
+    :param start_date:
+    :param end_date:
+    :param use_cache:
+    :return: merged response dict.
+    """
+    cache_key = get_cache_key(report_name, service_key, start_date, end_date)
+    if use_cache:
+        try:
+            response = read_gzip_json(s3_client, S3_BUCKET, cache_key)
+            if response is not None:
+                print('Cost Explorer cache hit: {}'.format(cache_key))
+                return response
+        except Exception as ex:
+            print('WARN: Could not read Cost Explorer cache {}. Reason: {}'.format(cache_key, ex))
+
+    response = fetch_report(ce_client, rate_limiter, report_name, service_key, start_date, end_date)
+    try:
+        write_gzip_json(s3_client, S3_BUCKET, cache_key, response)
+    except Exception as ex:
+        print('WARN: Could not cache Cost Explorer report {}. Reason: {}'.format(cache_key, ex))
+    return response
+
+
+def fetch_report(ce_client, rate_limiter, report_name, service_key, start_date, end_date):
+    """
+    Call Cost Explorer for all pages of one report.
+    :param ce_client:
+    :param rate_limiter:
+    :param report_name: key of REPORTS.
+    :param service_key:
+    :param start_date:
+    :param end_date:
+    :return: first page, with the list attributes of the later pages appended.
+    """
+    method_name, list_keys = REPORTS[report_name]
+    request_args = get_request_args(report_name, service_key, start_date, end_date)
+
+    ret_val = None
+    num_pages = 0
+    while True:
+        rate_limiter.acquire()
+        response = getattr(ce_client, method_name)(**request_args)
+        response.pop('ResponseMetadata', None)
+        num_pages += 1
+
+        next_page_token = response.pop('NextPageToken', None)
+        if ret_val is None:
+            ret_val = response
+        else:
+            for list_key in list_keys:
+                ret_val.setdefault(list_key, []).extend(response.get(list_key, []))
+
+        if not next_page_token:
+            break
+        request_args['NextPageToken'] = next_page_token
+
+    print('{} {}: {} pages'.format(method_name, service_key, num_pages))
+    return ret_val
+
+
+def get_request_args(report_name, service_key, start_date, end_date):
+    """
+    :param report_name: key of REPORTS.
+    :param service_key: ec2 | rds | redshift | elasticache | es
+    :param start_date:
+    :param end_date:
+    :return: dict of arguments for the ce client method.
+    """
+    service_name = awscost_helper_util.get_verbose_cost_explorer_service_names_from_key(service_key)
+
+    if report_name in ('reservation_coverage', 'utilization_report'):
+        # Note boto3 document say only daily Granularity covered, test if hourly is possible.
+        return {
+            'TimePeriod': {
+                'Start': start_date,
+                'End': end_date
+            },
+            'Granularity': 'DAILY',
+            'Filter': {
+                'Dimensions': {
+                    'Key': 'SERVICE',
+                    'Values': [service_name]
+                }
+            }
+        }
+
+    ret_val = {
+        'Service': service_name,
+        'AccountScope': 'PAYER',
+        'LookbackPeriodInDays': 'SEVEN_DAYS',
+        'TermInYears': 'ONE_YEAR',
+        'PaymentOption': 'ALL_UPFRONT'
+    }
+    if service_key == 'ec2':
+        ret_val['ServiceSpecification'] = {
+            'EC2Specification': {
+                'OfferingClass': 'CONVERTIBLE'
+            }
+        }
+    elif service_key == 'elasticache':
+        ret_val['PaymentOption'] = 'HEAVY_UTILIZATION'
+    return ret_val
+
+
+def write_daily_reports(date_for_s3_dir, start_date, end_date, reports, s3_client=None):
+    """
+    Write all reports for a day as one gzipped JSON file.
+    :param date_for_s3_dir: like: 20190301
+    :param start_date:
+    :param end_date:
+    :param reports: from fetch_all_reports
+    :param s3_client: boto3 s3 client. Default is a new one.
+    :return: S3 key written.
+    """
+    if s3_client is None:
+        s3_client = boto3.client('s3')
+    s3_key = '{}/{}_cost_explorer_reports.json.gz'.format(date_for_s3_dir, date_for_s3_dir)
+    write_gzip_json(s3_client, S3_BUCKET, s3_key, {
+        'start_date': start_date,
+        'end_date': end_date,
+        'reports': reports
+    })
+    print('Wrote {} Cost Explorer reports to s3://{}/{}'.format(len(reports), S3_BUCKET, s3_key))
+    return s3_key
+
+
+def get_cache_key(report_name, service_key, start_date, end_date):
+    """
+    :return: like: cost_explorer_cache/2019-02-21_2019-02-28/recommendations_ec2.json.gz
+    """
+    return '{}/{}_{}/{}_{}.json.gz'.format(CACHE_S3_DIR, start_date, end_date, report_name, service_key)
+
+
+def write_gzip_json(s3_client, bucket, s3_key, data):
+    """
+    :param s3_client: boto3 s3 client.
+    :param bucket:
+    :param s3_key:
+    :param data: JSON serializable. Other values, like datetime, are written as strings.
+    :return: None
+    """
+    buffer = io.BytesIO()
+    gzip_file = gzip.GzipFile(fileobj=buffer, mode='wb')
+    try:
+        gzip_file.write(json.dumps(data, default=str).encode('utf-8'))
+    finally:
+        gzip_file.close()
+    s3_client.put_object(
+        Bucket=bucket,
+        Key=s3_key,
+        Body=buffer.getvalue(),
+        ContentType='application/json',
+        ContentEncoding='gzip'
+    )
+
+
+def read_gzip_json(s3_client, bucket, s3_key):
+    """
+    :param s3_client: boto3 s3 client.
+    :param bucket:
+    :param s3_key:
+    :return: the data, or None if the object doesn't exist.
+    """
+    try:
+        response = s3_client.get_object(Bucket=bucket, Key=s3_key)
+    except ClientError as ce:
+        if ce.response['Error']['Code'] in ('404', 'NoSuchKey'):
+            return None
+        raise
+    gzip_file = gzip.GzipFile(fileobj=io.BytesIO(response['Body'].read()), mode='rb')
+    try:
+        return json.loads(gzip_file.read().decode('utf-8'))
+    finally:
+        gzip_file.close()
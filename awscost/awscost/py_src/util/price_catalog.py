@@ -0,0 +1,306 @@
+"""
+Offline catalog of EC2 OnDemand prices.
+
+Instead of one pricing get_products call per region / instance type / OS, the
+EC2 offer file for a region is read once into a small table indexed by
+(instance_type, os_type, tenancy), about 10k rows per region.
+
+Tables are kept in memory, in /tmp and in the awscost-data S3 bucket, together
+with the offer version they were built from. The region_index.json file from
+the AWS price list service lists the current version of each region's offer,
+so a region is only re-built when AWS publishes a new version.
+
+The offer file can also be a local snapshot, see load_offer_file.
+"""
+from __future__ import print_function
+
+import json
+import os
+import tempfile
+import threading
+import time
+import boto3
+import requests
+import pandas as pd
+from botocore.exceptions import ClientError
+
+PRICE_LIST_HOST = 'https://pricing.us-east-1.amazonaws.com'
+REGION_INDEX_URL = PRICE_LIST_HOST + '/offers/v1.0/aws/AmazonEC2/current/region_index.json'
+
+CATALOG_BUCKET = 'awscost-data'
+CATALOG_S3_DIR = 'price_catalog'
+CATALOG_LOCAL_DIR = '/tmp'
+
+# How long to use a table before checking region_index.json for a new version.
+VERSION_CHECK_SEC = 6 * 60 * 60
+
+# Rows per chunk when reading the offer CSV, which is hundreds of MB.
+OFFER_CSV_CHUNK_ROWS = 100000
+
+# The offer CSV has this many lines of metadata before the header.
+OFFER_CSV_METADATA_LINES = 5
+
+# AWSCost os_type to offer file 'Operating System'.
+OS_TYPE_NAMES = {
+    'linux': 'Linux',
+    'rhel': 'RHEL',
+    'sles': 'SUSE',
+    'suse': 'SUSE',
+    'windows': 'Windows'
+}
+
+OFFER_COLUMNS = {
+    'TermType': 'term_type',
+    'Unit': 'unit',
+    'PricePerUnit': 'price',
+    'Product Family': 'product_family',
+    'Instance Type': 'instance_type',
+    'Operating System': 'os_type',
+    'Tenancy': 'tenancy',
+    'License Model': 'license_model',
+    'Pre Installed S/W': 'pre_installed_sw',
+    'CapacityStatus': 'capacity_status'
+}
+
+INDEX_COLUMNS = ['instance_type', 'os_type', 'tenancy']
+
+# region -> {'version': offer version, 'table': DataFrame, 'checked': time-stamp}
+# PRICE_TABLES_LOCK is only held to read or install an entry. A region's table is
+# loaded under its own lock in REGION_LOCKS, so regions load at the same time.
+PRICE_TABLES = {}
+PRICE_TABLES_LOCK = threading.Lock()
+REGION_LOCKS = {}
+
+
+class PriceCatalogError(Exception):
+    """
+    Raised when no price table can be found or built for a region.
+    """
+    pass
+
+
+def get_price(region, instance_type, os_type, tenancy='Shared'):
+    """
+    OnDemand price per hour.
+    :param region: like: us-east-1
+    :param instance_type: like: m5.4xlarge
+    :param os_type: linux | rhel | sles | windows, or the offer file names Linux | RHEL | SUSE | Windows
+    :param tenancy: Shared | Dedicated | Host
+    :return: float USD per hour, or None if not in the catalog.
+    """
+    table = get_price_table(region)
+    key = (instance_type, normalize_os_type(os_type), tenancy)
+    if key not in table.index:
+        return None
+    return float(table.at[key, 'price'])
+
+
+def get_price_series(region, tenancy='Shared'):
+    """
+    All prices for a region and tenancy, for vectorized look-ups.
+    :param region: like: us-east-1
+    :param tenancy: Shared | Dedicated | Host
+    :return: Series of float USD per hour indexed by (instance_type, os_type).
+    """
+    table = get_price_table(region)
+    if tenancy not in table.index.get_level_values('tenancy'):
+        return pd.Series([], dtype=float)
+    return table.xs(tenancy, level='tenancy')['price']
+
+
+def normalize_os_type(os_type):
+    """
+    :param os_type: linux | rhel | sles | windows | Linux | RHEL | SUSE | Windows
+    :return: offer file name, like: Linux
+    """
+    return OS_TYPE_NAMES.get(os_type.lower(), os_type)
+
+
+def get_price_table(region):
+    """
+    Price table for a region, from memory, /tmp, S3 or the offer file, whichever is
+    the first one up to date with the current offer version.
+    :param region: like: us-east-1
+    :return: DataFrame with a 'price' column indexed by INDEX_COLUMNS.
+    """
+    with PRICE_TABLES_LOCK:
+        entry = get_fresh_entry(region)
+        if entry:
+            return entry['table']
+        region_lock = REGION_LOCKS.setdefault(region, threading.Lock())
+
+    with region_lock:
+        # Another thread might have loaded it while this one waited.
+        with PRICE_TABLES_LOCK:
+            entry = get_fresh_entry(region)
+            if entry:
+                return entry['table']
+            entry = PRICE_TABLES.get(region)
+
+        try:
+            region_index = get_region_index()
+            current_version = region_index[region]['currentVersionUrl']
+        except Exception as ex:
+            print('WARN: Could not read EC2 offer region_index.json. Reason: {}'.format(ex))
+            current_version = None
+
+        table, version = None, None
+        if entry and (current_version is None or entry['version'] == current_version):
+            table, version = entry['table'], entry['version']
+        if table is None:
+            table, version = read_saved_table(region, current_version)
+        if table is None and current_version:
+            table = load_offer_file(PRICE_LIST_HOST + current_version.replace('.json', '.csv'))
+            version = current_version
+            save_table(region, table, version)
+        if table is None:
+            raise PriceCatalogError('No EC2 price table for region: {}'.format(region))
+
+        with PRICE_TABLES_LOCK:
+            PRICE_TABLES[region] = {'version': version, 'table': table, 'checked': time.time()}
+        return table
+
+
+def get_fresh_entry(region):
+    """
+    Call with PRICE_TABLES_LOCK held.
+    :param region:
+    :return: PRICE_TABLES entry checked within VERSION_CHECK_SEC, or None.
+    """
+    entry = PRICE_TABLES.get(region)
+    if entry and time.time() - entry['checked'] < VERSION_CHECK_SEC:
+        return entry
+    return None
+
+
+def get_region_index():
+    """
+    :return: dict of region code to {'currentVersionUrl': ...}
+    """
+    response = requests.get(REGION_INDEX_URL, timeout=30)
+    response.raise_for_status()
+    return response.json()['regions']
+
+
+def load_offer_file(path_or_url):
+    """
+    Read an EC2 offer CSV in chunks, keeping only OnDemand hourly prices for
+    instances without pre-installed software or a bring-your-own license.
+    :param path_or_url: local snapshot path or https URL of a region's index.csv
+    :return: DataFrame with a 'price' column indexed by INDEX_COLUMNS.
+    """
+    print('Loading EC2 offer file: {}'.format(path_or_url))
+    start = time.time()
+
+    if path_or_url.startswith('http'):
+        response = requests.get(path_or_url, stream=True, timeout=60)
+        response.raise_for_status()
+        response.raw.decode_content = True
+        csv_file = response.raw
+    else:
+        csv_file = open(path_or_url)
+
+    try:
+        chunks = []
+        num_rows = 0
+        # keep_default_na=False, because 'NA' is a real 'Pre Installed S/W' value.
+        for chunk in pd.read_csv(csv_file, skiprows=OFFER_CSV_METADATA_LINES, dtype=str, keep_default_na=False,
+                                 usecols=lambda name: name in OFFER_COLUMNS, chunksize=OFFER_CSV_CHUNK_ROWS):
+            num_rows += len(chunk)
+            chunk = chunk.rename(columns=OFFER_COLUMNS)
+            keep = ((chunk['term_type'] == 'OnDemand') &
+                    (chunk['unit'] == 'Hrs') &
+                    (chunk['product_family'] == 'Compute Instance') &
+                    (chunk['pre_installed_sw'] == 'NA') &
+                    (chunk['license_model'] != 'Bring your own license'))
+            if 'capacity_status' in chunk:
+                keep &= chunk['capacity_status'] == 'Used'
+            chunks.append(chunk.loc[keep, INDEX_COLUMNS + ['price']])
+    finally:
+        csv_file.close()
+
+    table = pd.concat(chunks)
+    table['price'] = table['price'].astype(float)
+    num_prices = len(table)
+    table = table.drop_duplicates(INDEX_COLUMNS).set_index(INDEX_COLUMNS).sort_index()
+    print('EC2 offer file: {} rows, {} prices, {} duplicates dropped in {} sec.'.format(
+        num_rows, len(table), num_prices - len(table), time.time() - start))
+    return table
+
+
+def read_saved_table(region, version):
+    """
+    Read a saved table from /tmp, then S3.
+    :param region:
+    :param version: offer version wanted, or None to accept any saved version.
+    :return: tuple (DataFrame, version), or (None, None) if no saved table matches.
+    """
+    local_path, meta_path = get_local_paths(region)
+    for source in ['/tmp', 'S3']:
+        if source == 'S3':
+            download_saved_table(region)
+        if not os.path.exists(meta_path):
+            continue
+
+        with open(meta_path) as meta_file:
+            saved_version = json.load(meta_file).get('version')
+        if version is None or saved_version == version:
+            print('EC2 price table for {} from {}. version: {}'.format(region, source, saved_version))
+            return pd.read_parquet(local_path), saved_version
+        print('Saved EC2 price table for {} in {} is {}. Current is {}'.format(region, source, saved_version, version))
+
+    return None, None
+
+
+def save_table(region, table, version):
+    """
+    Write a table to /tmp and S3.
+    :param region:
+    :param table:
+    :param version:
+    :return: None
+    """
+    local_path, meta_path = get_local_paths(region)
+    table.to_parquet(local_path)
+    with open(meta_path, 'w') as meta_file:
+        json.dump({'region': region, 'version': version}, meta_file)
+
+    try:
+        s3_client = boto3.client('s3')
+        for path in [local_path, meta_path]:
+            s3_client.upload_file(path, CATALOG_BUCKET, '{}/{}'.format(CATALOG_S3_DIR, os.path.basename(path)))
+    except Exception as ex:
+        print('WARN: Could not upload EC2 price table for {}. Reason: {}'.format(region, ex))
+
+
+def download_saved_table(region):
+    """
+    Copy a table saved by another lambda container from S3 to /tmp.
+    Both files are downloaded before either replaces the /tmp copy.
+    :param region:
+    :return: None
+    """
+    s3_client = boto3.client('s3')
+    temp_paths = []
+    try:
+        for path in get_local_paths(region):
+            fd, temp_path = tempfile.mkstemp(dir=CATALOG_LOCAL_DIR)
+            os.close(fd)
+            temp_paths.append((temp_path, path))
+            s3_client.download_file(CATALOG_BUCKET, '{}/{}'.format(CATALOG_S3_DIR, os.path.basename(path)), temp_path)
+        for temp_path, path in temp_paths:
+            os.rename(temp_path, path)
+    except ClientError as ce:
+        for temp_path, path in temp_paths:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+        print('No saved EC2 price table for {} in S3. Reason: {}'.format(region, ce))
+
+
+def get_local_paths(region):
+    """
+    :param region:
+    :return: tuple (parquet path, metadata json path)
+    """
+    return (os.path.join(CATALOG_LOCAL_DIR, 'ec2_prices_{}.parquet'.format(region)),
+            os.path.join(CATALOG_LOCAL_DIR, 'ec2_prices_{}.json'.format(region)))
@@ -0,0 +1,291 @@
+"""
+Streaming writer for multi-sheet Excel reports.
+
+pd.ExcelWriter keeps the whole workbook in memory until save(). ReportWriter
+uses an openpyxl write-only workbook instead: rows are appended as each sheet
+is written, so the caller can drop each DataFrame right after write_sheet and
+memory stays about the size of one sheet.
+
+The destination is either an 's3://bucket/key.xlsx' location or a local path.
+For S3 the workbook is written straight into a multipart upload, without a
+copy in /tmp. Python 2 zipfile can't write to a stream it can't seek, so there
+the workbook goes through a spooled temp file instead.
+
+Each sheet can also be written as CSV and/or Parquet next to the workbook,
+like: s3://bucket/<report name>/<sheet name>.csv
+
+Usage:
+    report = ReportWriter('s3://awscost-data/20190301/20190301-AwsRIUsageReport.xlsx', sidecar_formats=['csv'])
+    report.write_sheet('ec2-us-east-1', df_ec2_east_hourly)
+    del df_ec2_east_hourly
+    report.close()
+"""
+from __future__ import print_function
+
+import io
+import os
+import sys
+import tempfile
+import time
+import boto3
+import numpy as np
+from openpyxl import Workbook
+
+# S3 multipart parts must be at least 5 MB, except the last one.
+MULTIPART_PART_SIZE = 8 * 1024 * 1024
+
+# Python 2 only. Size kept in memory before the spooled file moves to disk.
+SPOOL_MAX_BYTES = 64 * 1024 * 1024
+
+# Excel limits sheet names to 31 characters, without []:*?/\
+MAX_SHEET_NAME_LENGTH = 31
+INVALID_SHEET_NAME_CHARS = '[]:*?/\\'
+
+SIDECAR_FORMATS = ['csv', 'parquet']
+
+
+class ReportWriterError(Exception):
+    """
+    Raised when a report can't be written.
+    """
+    pass
+
+
+class S3MultipartWriter(object):
+    """
+    File-like object that uploads what is written to it as an S3 multipart
+    upload, one part every MULTIPART_PART_SIZE bytes. It can't seek.
+    """
+    def __init__(self, s3_client, bucket, key, part_size=MULTIPART_PART_SIZE):
+        """
+        :param s3_client: boto3 s3 client.
+        :param bucket:
+        :param key:
+        :param part_size: bytes per part.
+        """
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.key = key
+        self.part_size = part_size
+        self.buffer = io.BytesIO()
+        self.position = 0
+        self.parts = []
+        self.closed = False
+        response = s3_client.create_multipart_upload(Bucket=bucket, Key=key)
+        self.upload_id = response['UploadId']
+
+    def write(self, data):
+        """
+        :param data: bytes
+        :return: number of bytes written.
+        """
+        self.buffer.write(data)
+        self.position += len(data)
+        if self.buffer.tell() >= self.part_size:
+            self._upload_part()
+        return len(data)
+
+    def tell(self):
+        """
+        :return: number of bytes written so far.
+        """
+        return self.position
+
+    def seekable(self):
+        return False
+
+    def flush(self):
+        pass
+
+    def close(self):
+        """
+        Upload the last part and complete the upload.
+        :return: None
+        """
+        if self.closed:
+            return
+        if self.buffer.tell() or not self.parts:
+            self._upload_part()
+        self.s3_client.complete_multipart_upload(
+            Bucket=self.bucket,
+            Key=self.key,
+            UploadId=self.upload_id,
+            MultipartUpload={'Parts': self.parts}
+        )
+        self.closed = True
+
+    def abort(self):
+        """
+        Cancel the upload, so S3 doesn't keep the parts.
+        :return: None
+        """
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            self.s3_client.abort_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self.upload_id)
+        except Exception as ex:
+            print('WARN: Could not abort upload to s3://{}/{}. Reason: {}'.format(self.bucket, self.key, ex))
+
+    def _upload_part(self):
+        """
+        Upload the buffer as the next part.
+        :return: None
+        """
+        part_number = len(self.parts) + 1
+        response = self.s3_client.upload_part(
+            Bucket=self.bucket,
+            Key=self.key,
+            UploadId=self.upload_id,
+            PartNumber=part_number,
+            Body=self.buffer.getvalue()
+        )
+        self.parts.append({'ETag': response['ETag'], 'PartNumber': part_number})
+        self.buffer = io.BytesIO()
+
+
+class ReportWriter(object):
+    """
+    Writes DataFrames as sheets of one Excel file, one sheet at a time.
+    """
+    def __init__(self, destination, sidecar_formats=None):
+        """
+        :param destination: 's3://bucket/key.xlsx' or a local path.
+        :param sidecar_formats: list with 'csv' and/or 'parquet' to also write each sheet in those formats.
+        """
+        for sidecar_format in sidecar_formats or []:
+            if sidecar_format not in SIDECAR_FORMATS:
+                raise ReportWriterError('Unknown sidecar format: {}. Expected one of: {}'.format(
+                    sidecar_format, SIDECAR_FORMATS))
+        self.destination = destination
+        self.sidecar_formats = sidecar_formats or []
+        self.workbook = Workbook(write_only=True)
+        self.sheet_names = []
+        self.sheet_times = []
+        self.start = time.time()
+
+    def write_sheet(self, sheet_name, data_frame, index=None):
+        """
+        Append a DataFrame as a sheet, like DataFrame.to_excel(writer, sheet_name).
+        :param sheet_name: name of tab. Cut to 31 characters.
+        :param data_frame: DataFrame. The index is the first column.
+        :param index: position of the sheet in the workbook. None to add it at the end.
+        :return: None
+        """
+        start = time.time()
+        sheet_name = get_sheet_name(sheet_name)
+        sheet = self.workbook.create_sheet(title=sheet_name, index=index)
+
+        index_name = data_frame.index.name if data_frame.index.name else ''
+        sheet.append([index_name] + [str(c) for c in data_frame.columns])
+        # NaN is an empty cell, like DataFrame.to_excel. tolist() gives python types openpyxl can write.
+        values = data_frame.astype(object).where(data_frame.notnull(), None).values.tolist()
+        for index_value, row in zip(data_frame.index, values):
+            sheet.append([to_cell_value(index_value)] + row)
+
+        for sidecar_format in self.sidecar_formats:
+            self.write_sidecar(sheet_name, data_frame, sidecar_format)
+
+        duration = time.time() - start
+        self.sheet_names.append(sheet_name)
+        self.sheet_times.append(duration)
+        print('TIMER report sheet {}: {} sec. rows={} columns={}'.format(
+            sheet_name, duration, len(data_frame), len(data_frame.columns)))
+
+    def write_sidecar(self, sheet_name, data_frame, sidecar_format):
+        """
+        Write one sheet as a CSV or Parquet file next to the workbook.
+        :param sheet_name:
+        :param data_frame:
+        :param sidecar_format: 'csv' | 'parquet'
+        :return: None
+        """
+        file_name = '{}.{}'.format(sheet_name.replace(' ', '_'), sidecar_format)
+        buffer = io.BytesIO()
+        if sidecar_format == 'csv':
+            buffer.write(data_frame.to_csv().encode('utf-8'))
+        else:
+            data_frame.to_parquet(buffer)
+        buffer.seek(0)
+
+        sidecar_dir = os.path.splitext(self.destination)[0]
+        if is_s3(sidecar_dir):
+            bucket, key = split_s3_url(sidecar_dir)
+            boto3.client('s3').upload_fileobj(buffer, bucket, '{}/{}'.format(key, file_name))
+        else:
+            if not os.path.isdir(sidecar_dir):
+                os.makedirs(sidecar_dir)
+            with open(os.path.join(sidecar_dir, file_name), 'wb') as sidecar_file:
+                sidecar_file.write(buffer.getvalue())
+
+    def close(self):
+        """
+        Save the workbook to the destination.
+        :return: destination
+        """
+        start = time.time()
+        if not self.sheet_names:
+            # An Excel file needs at least one sheet.
+            self.workbook.create_sheet(title='Empty')
+
+        if not is_s3(self.destination):
+            self.workbook.save(self.destination)
+        elif sys.version_info[0] >= 3:
+            bucket, key = split_s3_url(self.destination)
+            s3_writer = S3MultipartWriter(boto3.client('s3'), bucket, key)
+            try:
+                self.workbook.save(s3_writer)
+                s3_writer.close()
+            except Exception:
+                s3_writer.abort()
+                raise
+        else:
+            bucket, key = split_s3_url(self.destination)
+            with tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_BYTES) as spool_file:
+                self.workbook.save(spool_file)
+                spool_file.seek(0)
+                boto3.client('s3').upload_fileobj(spool_file, bucket, key)
+
+        print('TIMER report save {}: {} sec.'.format(self.destination, time.time() - start))
+        print('TIMER report {}: {} sheets in {} sec. (sheets {} sec.)'.format(
+            self.destination, len(self.sheet_names), time.time() - self.start, sum(self.sheet_times)))
+        return self.destination
+
+
+def get_sheet_name(name):
+    """
+    :param name:
+    :return: name without characters Excel doesn't allow, cut to MAX_SHEET_NAME_LENGTH.
+    """
+    for c in INVALID_SHEET_NAME_CHARS:
+        name = name.replace(c, ' ')
+    return name[:MAX_SHEET_NAME_LENGTH]
+
+
+def to_cell_value(value):
+    """
+    :param value: value from a DataFrame.
+    :return: value openpyxl can write. NaN is an empty cell, like DataFrame.to_excel.
+    """
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, float) and value != value:
+        return None
+    return value
+
+
+def is_s3(destination):
+    """
+    :param destination:
+    :return: True if destination is an 's3://' location.
+    """
+    return destination.startswith('s3://')
+
+
+def split_s3_url(url):
+    """
+    :param url: like: s3://awscost-data/20190301/report.xlsx
+    :return: tuple (bucket, key)
+    """
+    parts = url[len('s3://'):].split('/', 1)
+    return parts[0], parts[1] if len(parts) > 1 else ''
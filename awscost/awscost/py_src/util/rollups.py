@@ -0,0 +1,310 @@
+"""
+Daily and monthly rollups of the Roku-wide AWSCost summary rows.
+
+For each summary key, like 'ec2os:roku:us-east-1', two more keys are kept:
+
+    awsResource = ec2os:roku:us-east-1:daily     time = YYYYMMDD
+    awsResource = ec2os:roku:us-east-1:monthly   time = YYYYMM
+
+They use their own awsResource, so hourly queries on the summary key never
+see them. Each row has:
+
+    'hours': number of hourly rows rolled up.
+    'stats': node type -> {'min', 'max', 'mean', 'p95'}
+    'histograms': node type -> {value: number of hours with that value}. Daily rows only.
+
+A daily histogram has at most 24 values per node type, so the daily row is no
+bigger than its hourly rows together, and merging them gives exact quantiles
+over any range of days. Monthly rows only keep the stats, built from the merged
+daily histograms. A month of histograms for a key like ec2os has no bound, and
+could go over the DynamoDB item size limit.
+Like DataFrame.quantile on the hourly data, hours without a node type are left
+out of its stats.
+
+update_rollups is called by do_summary for each hour. It rebuilds the day from
+its hourly rows (at most 24) and the month from its daily rows (at most 31)
+instead of adding the hour to the old values, so summarizing an hour again
+doesn't count it twice.
+"""
+from __future__ import print_function
+
+import decimal
+import numpy as np
+import pandas as pd
+from boto3.dynamodb.conditions import Key
+
+import util.awscost_helper_util as awscost_helper_util
+
+DAILY = 'daily'
+MONTHLY = 'monthly'
+
+# Same rows as the P95 tabs made with DataFrame.quantile.
+QUANTILES = [0.0, 0.05, 0.5, 0.95, 1.0]
+
+# Decimal places kept for stats. DynamoDB doesn't take floats.
+STATS_DECIMAL_PLACES = 4
+
+
+def get_rollup_key(key, period):
+    """
+    :param key: summary key like: ec2os:roku:us-east-1
+    :param period: DAILY | MONTHLY
+    :return: like: ec2os:roku:us-east-1:daily
+    """
+    return '{}:{}'.format(key, period)
+
+
+def update_rollups(awscost_table, key, time_index):
+    """
+    Rebuild the daily and monthly rollup rows that contain an hour.
+    :param awscost_table: boto3 Table for AWSCost
+    :param key: summary key like: ec2os:roku:us-east-1
+    :param time_index: hour just summarized, like: 20190301-14
+    :return: None
+    """
+    day = time_index[0:8]
+    month = time_index[0:6]
+
+    # Consistent reads, so the hour do_summary just wrote, and the day written
+    # below, are in the rollups. Nothing rebuilds a day after its last hour.
+    hourly_items = awscost_helper_util.query_time_series(
+        awscost_table, key, '{}-00'.format(day), '{}-23'.format(day), consistent_read=True)
+    histograms = {}
+    num_hours = 0
+    for item in hourly_items:
+        num_hours += 1
+        for node_type, value in (item.get('node_types') or {}).items():
+            add_to_histogram(histograms, node_type, {value_to_key(value): 1})
+    if not num_hours:
+        print('No {} rows for {}. No rollup.'.format(key, day))
+        return
+    write_rollup(awscost_table, key, DAILY, day, num_hours, histograms)
+
+    daily_items = query_rollup_rows(awscost_table, key, DAILY, '{}01'.format(month), '{}31'.format(month),
+                                    consistent_read=True)
+    histograms, num_hours, num_days = merge_rollup_rows(daily_items)
+    write_rollup(awscost_table, key, MONTHLY, month, num_hours, histograms, keep_histograms=False)
+    print('Rollups for {}: {} hours in {}, {} days in {}'.format(key, num_hours, day, num_days, month))
+
+
+def update_rollups_for_keys(awscost_table, keys, time_index):
+    """
+    update_rollups for several summary keys. A failure on one key is logged
+    and the rest are still updated.
+    :param awscost_table:
+    :param keys: list of summary keys.
+    :param time_index:
+    :return: None
+    """
+    start = awscost_helper_util.start_timer()
+    for key in keys:
+        try:
+            update_rollups(awscost_table, key, time_index)
+        except Exception as ex:
+            print('Failed to update rollups for {} {}'.format(key, time_index))
+            awscost_helper_util.log_traceback_exception(ex)
+    awscost_helper_util.print_delta_time(start, 'update_rollups_for_keys {} keys'.format(len(keys)))
+
+
+def rebuild_rollups(awscost_table, key, start_time, end_time):
+    """
+    Back-fill rollups for a range of days, like the days before rollups were added.
+    :param awscost_table:
+    :param key: summary key like: ec2os:roku:us-east-1
+    :param start_time: oldest time index like: 20181201-00
+    :param end_time: newest time index like: 20190301-00
+    :return: None
+    """
+    curr_time_index = '{}-00'.format(start_time[0:8])
+    while curr_time_index <= end_time:
+        update_rollups(awscost_table, key, curr_time_index)
+        curr_time_index = awscost_helper_util.increment_time_index(curr_time_index, 24)
+
+
+def get_stats_for_days(awscost_table, key, start_day, end_day):
+    """
+    Quantiles of each node type over a range of days, from the daily rollups.
+    :param awscost_table:
+    :param key: summary key like: ec2os:roku:us-east-1
+    :param start_day: like: 20190201
+    :param end_day: like: 20190228. Inclusive.
+    :return: DataFrame like DataFrame.quantile(QUANTILES) on the hourly data,
+    or None if a day in the range has no rollup.
+    """
+    daily_items = query_rollup_rows(awscost_table, key, DAILY, start_day, end_day)
+    histograms, num_hours, num_days = merge_rollup_rows(daily_items)
+    expected_days = len(get_days(start_day, end_day))
+    if num_days < expected_days:
+        print('{} has rollups for {} of {} days from {} to {}'.format(key, num_days, expected_days, start_day, end_day))
+        return None
+
+    columns = {}
+    for node_type in sorted(histograms.keys()):
+        values, counts = get_histogram_arrays(histograms[node_type])
+        expanded = np.repeat(values, counts)
+        columns[node_type] = [np.percentile(expanded, q * 100) for q in QUANTILES]
+
+    return pd.DataFrame(columns, index=QUANTILES, columns=sorted(histograms.keys()))
+
+
+def get_daily_data_frame(awscost_table, key, start_day, end_day, stat='mean'):
+    """
+    One row per day and one column per node type, from the daily rollups.
+    :param awscost_table:
+    :param key: summary key like: ec2os:roku:us-east-1
+    :param start_day: like: 20181221
+    :param end_day: like: 20190301. Inclusive.
+    :param stat: 'min' | 'max' | 'mean' | 'p95'
+    :return: DataFrame indexed by 'time' like: 20190301, oldest first. Missing cells are NaN.
+    """
+    records = []
+    days = []
+    for item in query_rollup_rows(awscost_table, key, DAILY, start_day, end_day, attributes=['stats']):
+        days.append(item['time'])
+        records.append(dict((node_type, float(stats[stat])) for node_type, stats in item.get('stats', {}).items()))
+
+    data_frame = pd.DataFrame.from_records(records, index=days) if records else pd.DataFrame(index=days)
+    data_frame = data_frame.reindex(sorted(data_frame.columns), axis=1)
+    data_frame.index.name = 'time'
+    return data_frame
+
+
+def query_rollup_rows(awscost_table, key, period, start, end, attributes=None, consistent_read=False):
+    """
+    Paginated query of rollup rows.
+    :param awscost_table:
+    :param key: summary key like: ec2os:roku:us-east-1
+    :param period: DAILY | MONTHLY
+    :param start: oldest 'time' like: 20190201
+    :param end: newest 'time' like: 20190228. Inclusive.
+    :param attributes: attributes to read besides 'time'. Default ['hours', 'histograms']
+    :param consistent_read: True to see rows written just before.
+    :return: generator of items, oldest first.
+    """
+    if attributes is None:
+        attributes = ['hours', 'histograms']
+    names = {'#t': 'time'}
+    for i, attribute in enumerate(attributes):
+        names['#a{}'.format(i)] = attribute
+
+    query_args = {
+        'KeyConditionExpression': Key('awsResource').eq(get_rollup_key(key, period)) & Key('time').between(start, end),
+        'ProjectionExpression': ', '.join(sorted(names.keys())),
+        'ExpressionAttributeNames': names
+    }
+    if consistent_read:
+        query_args['ConsistentRead'] = True
+    while True:
+        response = awscost_table.query(**query_args)
+        for item in response.get('Items', []):
+            yield item
+
+        last_key = response.get('LastEvaluatedKey')
+        if not last_key:
+            break
+        query_args['ExclusiveStartKey'] = last_key
+
+
+def merge_rollup_rows(items):
+    """
+    :param items: rollup rows with 'hours' and 'histograms'
+    :return: tuple (merged histograms, total hours, number of rows)
+    """
+    histograms = {}
+    num_hours = 0
+    num_rows = 0
+    for item in items:
+        num_rows += 1
+        num_hours += int(item.get('hours', 0))
+        for node_type, histogram in (item.get('histograms') or {}).items():
+            add_to_histogram(histograms, node_type, histogram)
+    return histograms, num_hours, num_rows
+
+
+def add_to_histogram(histograms, node_type, histogram):
+    """
+    :param histograms: node type -> {value key: count}. Updated in place.
+    :param node_type:
+    :param histogram: {value key: count} to add.
+    :return: None
+    """
+    node_histogram = histograms.setdefault(node_type, {})
+    for value_key, count in histogram.items():
+        node_histogram[value_key] = node_histogram.get(value_key, 0) + int(count)
+
+
+def write_rollup(awscost_table, key, period, time_value, num_hours, histograms, keep_histograms=True):
+    """
+    Put one rollup row.
+    :param awscost_table:
+    :param key: summary key
+    :param period: DAILY | MONTHLY
+    :param time_value: like: 20190301 or 201903
+    :param num_hours:
+    :param histograms: node type -> {value key: count}
+    :param keep_histograms: False to only write the stats, like for monthly rows.
+    :return: None
+    """
+    stats = {}
+    for node_type, histogram in histograms.items():
+        values, counts = get_histogram_arrays(histogram)
+        expanded = np.repeat(values, counts)
+        stats[node_type] = {
+            'min': to_decimal(expanded.min()),
+            'max': to_decimal(expanded.max()),
+            'mean': to_decimal(expanded.mean()),
+            'p95': to_decimal(np.percentile(expanded, 95))
+        }
+
+    item = {
+        'awsResource': get_rollup_key(key, period),
+        'time': time_value,
+        'hours': num_hours,
+        'stats': stats
+    }
+    if keep_histograms:
+        item['histograms'] = histograms
+    awscost_table.put_item(Item=item)
+
+
+def get_histogram_arrays(histogram):
+    """
+    :param histogram: {value key: count}
+    :return: tuple (numpy array of float values, numpy array of int counts), sorted by value.
+    """
+    pairs = sorted((float(value_key), int(count)) for value_key, count in histogram.items())
+    return np.array([p[0] for p in pairs]), np.array([p[1] for p in pairs])
+
+
+def value_to_key(value):
+    """
+    DynamoDB map keys must be strings.
+    :param value: node count, int, float or Decimal.
+    :return: like: '12' or '0.5'
+    """
+    value = float(value)
+    if value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+def to_decimal(value):
+    """
+    :param value: float
+    :return: Decimal rounded to STATS_DECIMAL_PLACES.
+    """
+    return decimal.Decimal(str(round(float(value), STATS_DECIMAL_PLACES)))
+
+
+def get_days(start_day, end_day):
+    """
+    :param start_day: like: 20190227
+    :param end_day: like: 20190302. Inclusive.
+    :return: list like: ['20190227', '20190228', '20190301', '20190302']
+    """
+    ret_val = []
+    curr_time_index = '{}-00'.format(start_day)
+    while curr_time_index[0:8] <= end_day:
+        ret_val.append(curr_time_index[0:8])
+        curr_time_index = awscost_helper_util.increment_time_index(curr_time_index, 24)
+    return ret_val
@@ -0,0 +1,247 @@
+"""
+Bounded-concurrency executor used to fan out AWS Cost scans across
+AWS account / region pairs.
+
+The check_* methods in awscost_lambda_function are independent of each other
+for a given account and region, so they can run on a small thread pool. Each
+AWS service gets its own rate limit so we don't trip API throttling in an
+account, and each task gets a timeout so one slow account can't hold the
+whole scan past the lambda function limit.
+"""
+from __future__ import print_function
+
+import threading
+import time
+
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
+# Default number of threads used for a scan.
+DEFAULT_MAX_WORKERS = 16
+
+# Default number of seconds a single task can run before it is reported as timed out.
+DEFAULT_TASK_TIMEOUT_SEC = 300
+
+# How often the executor checks for finished or timed-out tasks.
+POLL_INTERVAL_SEC = 0.25
+
+TASK_PENDING = 'pending'
+TASK_RUNNING = 'running'
+TASK_DONE = 'done'
+TASK_FAILED = 'failed'
+TASK_TIMEOUT = 'timeout'
+
+
+class RateLimiter(object):
+    """
+    Thread-safe limiter that spaces out calls so no more than
+    'calls_per_sec' start in any one second.
+    """
+    def __init__(self, calls_per_sec):
+        if calls_per_sec <= 0:
+            raise ValueError('RateLimiter expects calls_per_sec > 0. Was: {}'.format(calls_per_sec))
+        self.interval = 1.0 / calls_per_sec
+        self.next_time = 0.0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Block until the next call slot is available.
+        :return: None
+        """
+        with self.lock:
+            now = time.time()
+            wait_sec = self.next_time - now
+            self.next_time = max(now, self.next_time) + self.interval
+        if wait_sec > 0:
+            time.sleep(wait_sec)
+
+
+class ScanTask(object):
+    """
+    One unit of work for the ScanExecutor, like check_rds_usage for an account and region.
+    """
+    def __init__(self, service, label, func, args):
+        self.service = service
+        self.label = label
+        self.func = func
+        self.args = args
+        self.status = TASK_PENDING
+        self.result = None
+        self.error = None
+        self.start_time = None
+        self.end_time = None
+
+    def get_duration(self):
+        """
+        Seconds the task ran, or has been running so far.
+        :return: float seconds, or 0.0 if not started.
+        """
+        if self.start_time is None:
+            return 0.0
+        end_time = self.end_time
+        if end_time is None:
+            end_time = time.time()
+        return end_time - self.start_time
+
+
+class ScanExecutor(object):
+    """
+    Runs ScanTasks on a thread pool with per-service rate limits and per-task timeouts.
+
+    Usage:
+        executor = ScanExecutor(max_workers=16, rate_limits={'ec2': 5})
+        executor.submit('ec2', 'cti:us-east-1', check_ec2_usage, name, account_num, region, time_index)
+        tasks = executor.run('ec2_scan')
+    """
+    def __init__(self, max_workers=DEFAULT_MAX_WORKERS, rate_limits=None,
+                 task_timeout_sec=DEFAULT_TASK_TIMEOUT_SEC):
+        """
+        :param max_workers: maximum number of tasks running at the same time.
+        :param rate_limits: dict of service name to task starts per second. Ex: {'ec2': 5, 'rds': 10}
+        :param task_timeout_sec: seconds before a running task is reported as timed out.
+        """
+        if max_workers < 1:
+            raise ValueError('ScanExecutor expects max_workers >= 1. Was: {}'.format(max_workers))
+        self.max_workers = max_workers
+        self.task_timeout_sec = task_timeout_sec
+        self.rate_limiters = {}
+        if rate_limits:
+            for service, calls_per_sec in rate_limits.items():
+                self.rate_limiters[service] = RateLimiter(calls_per_sec)
+        self.tasks = []
+        self.lock = threading.Lock()
+
+    def submit(self, service, label, func, *args):
+        """
+        Add a task to the scan. Nothing runs until run() is called.
+        :param service: AWS service name used for rate limiting. Ex: 'ec2', 'rds', 'dynamodb'
+        :param label: name for the task in logs. Ex: 'cti:us-east-1'
+        :param func: the method to call.
+        :param args: arguments for the method.
+        :return: ScanTask
+        """
+        task = ScanTask(service, label, func, args)
+        self.tasks.append(task)
+        return task
+
+    def run(self, scan_name):
+        """
+        Run all submitted tasks and wait for them to finish or time out.
+        :param scan_name: name used in the log. Ex: 'hourly_scan'
+        :return: list of ScanTask with status, result and timing.
+        """
+        print('{}: running {} tasks with {} workers'.format(scan_name, len(self.tasks), self.max_workers))
+        scan_start = time.time()
+
+        work_queue = queue.Queue()
+        for task in self.tasks:
+            work_queue.put(task)
+
+        num_workers = min(self.max_workers, len(self.tasks))
+        for x in range(num_workers):
+            self._start_worker(work_queue)
+
+        while True:
+            unfinished = self._check_for_timeouts(work_queue)
+            if unfinished == 0:
+                break
+            time.sleep(POLL_INTERVAL_SEC)
+
+        self._log_summary(scan_name, time.time() - scan_start)
+        return self.tasks
+
+    def _start_worker(self, work_queue):
+        """
+        Start a daemon thread that pulls tasks until the queue is empty.
+        Daemon threads let the lambda function return even if a timed-out task is still stuck.
+        :param work_queue:
+        :return: None
+        """
+        worker = threading.Thread(target=self._worker, args=(work_queue,))
+        worker.daemon = True
+        worker.start()
+
+    def _worker(self, work_queue):
+        """
+        Thread body. Run tasks until the queue is empty.
+        :param work_queue:
+        :return: None
+        """
+        while True:
+            try:
+                task = work_queue.get_nowait()
+            except queue.Empty:
+                return
+
+            rate_limiter = self.rate_limiters.get(task.service)
+            if rate_limiter:
+                rate_limiter.acquire()
+
+            with self.lock:
+                task.status = TASK_RUNNING
+                task.start_time = time.time()
+
+            try:
+                result = task.func(*task.args)
+                with self.lock:
+                    task.end_time = time.time()
+                    if task.status == TASK_TIMEOUT:
+                        print('WARN: {} {} finished after timeout in {} sec.'.format(
+                            task.service, task.label, task.get_duration()))
+                    else:
+                        task.status = TASK_DONE
+                    task.result = result
+            except Exception as ex:
+                with self.lock:
+                    task.end_time = time.time()
+                    if task.status != TASK_TIMEOUT:
+                        task.status = TASK_FAILED
+                    task.error = ex
+                print('ERROR: {} {} failed: {}'.format(task.service, task.label, ex))
+
+    def _check_for_timeouts(self, work_queue):
+        """
+        Mark running tasks that passed the timeout. A replacement worker is started for each
+        one so the remaining tasks still get the full thread pool.
+        :param work_queue:
+        :return: number of tasks still pending or running.
+        """
+        now = time.time()
+        timed_out = []
+        unfinished = 0
+        with self.lock:
+            for task in self.tasks:
+                if task.status == TASK_RUNNING and now - task.start_time > self.task_timeout_sec:
+                    task.status = TASK_TIMEOUT
+                    timed_out.append(task)
+                elif task.status in (TASK_PENDING, TASK_RUNNING):
+                    unfinished += 1
+
+        for task in timed_out:
+            print('ERROR: {} {} timed out after {} sec.'.format(task.service, task.label, self.task_timeout_sec))
+            if not work_queue.empty():
+                self._start_worker(work_queue)
+
+        return unfinished
+
+    def _log_summary(self, scan_name, wall_time):
+        """
+        Print per-task timing, slowest first, and a summary line for the scan.
+        :param scan_name:
+        :param wall_time: seconds for the whole scan.
+        :return: None
+        """
+        status_counts = {}
+        serial_time = 0.0
+        for task in sorted(self.tasks, key=lambda t: t.get_duration(), reverse=True):
+            duration = task.get_duration()
+            serial_time += duration
+            status_counts[task.status] = status_counts.get(task.status, 0) + 1
+            print('TIMER {} {} {}: {} sec. status={}'.format(
+                scan_name, task.service, task.label, duration, task.status))
+
+        print('TIMER {}: {} sec. (sum of tasks {} sec.) results={}'.format(
+            scan_name, wall_time, serial_time, status_counts))
@@ -0,0 +1,399 @@
+"""
+Columnar cache of AWSCost time-series, for reports and Jupyter notebooks.
+
+Each awsResource key, like 'ec2os:roku:us-east-1', is stored as one Parquet
+file per month, with one row per hour and one column per node type:
+
+    <cache_root>/<key with ':' replaced by '_'>/<YYYYMM>.parquet
+    <cache_root>/<key with ':' replaced by '_'>/_watermark.json
+
+The watermark file has the first and last hour in the cache. update_series
+only queries DynamoDB for hours after the watermark (plus a few hours of
+overlap for late writes), so a daily report reads a day of new items instead
+of four weeks. Summary hours written later than that, like by the controller's
+catch-up, call invalidate_hour to move the watermark back.
+
+cache_root is either an S3 location like 's3://awscost-data/series' or a
+local directory. Notebooks can read the same files with load_series.
+"""
+from __future__ import print_function
+
+import json
+import os
+import shutil
+import tempfile
+import boto3
+import pandas as pd
+from botocore.exceptions import ClientError
+
+import util.awscost_helper_util as awscost_helper_util
+
+DEFAULT_CACHE_ROOT = 's3://awscost-data/series'
+
+# AWSCost has data back to Dec. 2018.
+DEFAULT_FIRST_TIME = '20181201-00'
+
+# Re-read this many hours before the watermark, in case summary rows were written late.
+REFRESH_OVERLAP_HOURS = 6
+
+WATERMARK_FILENAME = '_watermark.json'
+
+
+class SeriesCacheError(Exception):
+    """
+    Raised when the series cache can't be read or written.
+    """
+    pass
+
+
+def get_series(awscost_table, key, start_time, end_time, cache_root=DEFAULT_CACHE_ROOT):
+    """
+    Bring the cache for a key up to date, then load a time range from it.
+    If the cache can't be used, read the range from DynamoDB instead.
+    :param awscost_table: boto3 Table for AWSCost
+    :param key: AWSCost key value like: ec2os:roku:us-east-1
+    :param start_time: Time index like: 20190301-00. Either order is fine.
+    :param end_time: Time index like: 20190201-00
+    :param cache_root: 's3://bucket/prefix' or local directory.
+    :return: DataFrame indexed by 'time', newest hour first.
+    """
+    if start_time < end_time:
+        swap = end_time
+        end_time = start_time
+        start_time = swap
+
+    try:
+        update_series(awscost_table, key, start_time, end_time, cache_root)
+        return load_series(key, end_time, start_time, cache_root)
+
+    except Exception as ex:
+        print('WARN: Series cache failed for {}. Reading from DynamoDB. Reason: {}'.format(key, ex))
+        awscost_helper_util.log_traceback_exception(ex)
+        items = awscost_helper_util.query_time_series(awscost_table, key, end_time, start_time)
+        data_frame = awscost_helper_util.create_data_frame_from_items(items, [])
+        return data_frame.sort_index(ascending=False)
+
+
+def update_series(awscost_table, key, newest_time, oldest_time=DEFAULT_FIRST_TIME, cache_root=DEFAULT_CACHE_ROOT):
+    """
+    Append the hours newer than the watermark to the cache, and back-fill
+    the hours older than the cache if oldest_time is earlier than it.
+    :param awscost_table: boto3 Table for AWSCost
+    :param key: AWSCost key value like: ec2os:roku:us-east-1
+    :param newest_time: newest time index the cache needs.
+    :param oldest_time: oldest time index the cache needs.
+    :param cache_root: 's3://bucket/prefix' or local directory.
+    :return: dict, the new watermark.
+    """
+    watermark = read_watermark(key, cache_root)
+
+    ranges = []
+    if not watermark:
+        ranges.append((oldest_time, newest_time))
+    else:
+        if oldest_time < watermark['first_time']:
+            ranges.append((oldest_time, watermark['first_time']))
+        if newest_time > watermark['last_time']:
+            overlap_time = awscost_helper_util.increment_time_index(watermark['last_time'], -REFRESH_OVERLAP_HOURS)
+            ranges.append((overlap_time, newest_time))
+
+    if not ranges:
+        return watermark
+
+    start = awscost_helper_util.start_timer()
+    new_rows = 0
+    for range_start, range_end in ranges:
+        items = awscost_helper_util.query_time_series(awscost_table, key, range_start, range_end)
+        data_frame = awscost_helper_util.create_data_frame_from_items(items, [])
+        new_rows += len(data_frame)
+        write_rows(key, data_frame, cache_root)
+
+    if watermark:
+        watermark = {
+            'first_time': min(oldest_time, watermark['first_time']),
+            'last_time': max(newest_time, watermark['last_time'])
+        }
+    else:
+        watermark = {'first_time': oldest_time, 'last_time': newest_time}
+    write_watermark(key, watermark, cache_root)
+
+    awscost_helper_util.print_delta_time(start, 'update_series {} {} rows'.format(key, new_rows))
+    return watermark
+
+
+def invalidate_hour(keys, time_index, cache_root=DEFAULT_CACHE_ROOT):
+    """
+    Move the watermark of each key back, so the next update_series re-reads an hour
+    whose summary rows were written after the cache passed it.
+    Hours within REFRESH_OVERLAP_HOURS of the watermark are re-read anyway.
+    :param keys: AWSCost key values like: ['ec2os:roku:us-east-1']
+    :param time_index: hour written, like: 20190301-05
+    :param cache_root: 's3://bucket/prefix' or local directory.
+    :return: list of keys whose watermark was moved.
+    """
+    moved = []
+    for key in keys:
+        try:
+            watermark = read_watermark(key, cache_root)
+            if not watermark or time_index < watermark['first_time']:
+                continue
+            overlap_time = awscost_helper_util.increment_time_index(watermark['last_time'], -REFRESH_OVERLAP_HOURS)
+            if time_index >= overlap_time:
+                continue
+
+            # update_series starts REFRESH_OVERLAP_HOURS before last_time.
+            watermark['last_time'] = awscost_helper_util.increment_time_index(time_index, REFRESH_OVERLAP_HOURS)
+            write_watermark(key, watermark, cache_root)
+            moved.append(key)
+        except Exception as ex:
+            print('WARN: Failed to move series cache watermark of {} to {}. Reason: {}'.format(key, time_index, ex))
+            awscost_helper_util.log_traceback_exception(ex)
+
+    if moved:
+        print('Series cache watermark moved back to {} for: {}'.format(time_index, moved))
+    return moved
+
+
+def load_series(key, start_time, end_time, cache_root=DEFAULT_CACHE_ROOT):
+    """
+    Read a time range for a key from the cache. Does not call DynamoDB.
+    :param key: AWSCost key value like: ec2os:roku:us-east-1
+    :param start_time: oldest time index like: 20190201-00
+    :param end_time: newest time index like: 20190301-00
+    :param cache_root: 's3://bucket/prefix' or local directory.
+    :return: DataFrame indexed by 'time', newest hour first. Empty if nothing is cached.
+    """
+    if start_time > end_time:
+        swap = end_time
+        end_time = start_time
+        start_time = swap
+
+    data_frames = []
+    for month in get_months(start_time, end_time):
+        data_frame = read_partition(key, month, cache_root)
+        if data_frame is not None:
+            data_frames.append(data_frame)
+
+    if not data_frames:
+        ret_val = pd.DataFrame(index=pd.Index([], name='time'))
+    else:
+        ret_val = pd.concat(data_frames, sort=False)
+        ret_val = ret_val[(ret_val.index >= start_time) & (ret_val.index <= end_time)]
+
+    ret_val = ret_val.sort_index(ascending=False)
+    ret_val.index.name = 'time'
+    return ret_val
+
+
+def write_rows(key, data_frame, cache_root):
+    """
+    Merge rows into the monthly partitions. Rows already in a partition are replaced.
+    :param key: AWSCost key value
+    :param data_frame: DataFrame indexed by time index.
+    :param cache_root:
+    :return: None
+    """
+    if data_frame.empty:
+        return
+
+    months = data_frame.index.str.slice(0, 6)
+    for month in sorted(set(months)):
+        month_rows = data_frame[months == month]
+        existing = read_partition(key, month, cache_root)
+        if existing is not None:
+            existing = existing[~existing.index.isin(month_rows.index)]
+            month_rows = pd.concat([existing, month_rows], sort=False)
+        month_rows = month_rows.sort_index()
+        month_rows.index.name = 'time'
+        write_partition(key, month, month_rows, cache_root)
+
+
+def get_months(start_time, end_time):
+    """
+    Months touched by a time range.
+    :param start_time: oldest time index like: 20190115-00
+    :param end_time: newest time index like: 20190302-00
+    :return: list of 'YYYYMM' like: ['201901', '201902', '201903']
+    """
+    ret_val = []
+    year = int(start_time[0:4])
+    month = int(start_time[4:6])
+    last_month = end_time[0:6]
+    while True:
+        curr_month = '{:04d}{:02d}'.format(year, month)
+        if curr_month > last_month:
+            break
+        ret_val.append(curr_month)
+        month += 1
+        if month > 12:
+            month = 1
+            year += 1
+    return ret_val
+
+
+def get_key_dir(key):
+    """
+    Directory name for a key. ':' isn't safe in local file names.
+    :param key: like: ec2os:roku:us-east-1
+    :return: like: ec2os_roku_us-east-1
+    """
+    return key.replace(':', '_')
+
+
+def read_partition(key, month, cache_root):
+    """
+    Read one month of a key.
+    :param key:
+    :param month: 'YYYYMM'
+    :param cache_root:
+    :return: DataFrame, or None if the partition doesn't exist.
+    """
+    path = get_cache_file(cache_root, key, '{}.parquet'.format(month))
+    if path is None:
+        return None
+    try:
+        return pd.read_parquet(path)
+    finally:
+        remove_temp_file(cache_root, path)
+
+
+def write_partition(key, month, data_frame, cache_root):
+    """
+    Write one month of a key.
+    :param key:
+    :param month: 'YYYYMM'
+    :param data_frame:
+    :param cache_root:
+    :return: None
+    """
+    filename = '{}.parquet'.format(month)
+    local_path = get_local_write_path(cache_root, key, filename)
+    data_frame.to_parquet(local_path)
+    put_cache_file(cache_root, key, filename, local_path)
+
+
+def read_watermark(key, cache_root):
+    """
+    :param key:
+    :param cache_root:
+    :return: dict with 'first_time' and 'last_time', or None if nothing is cached for the key.
+    """
+    path = get_cache_file(cache_root, key, WATERMARK_FILENAME)
+    if path is None:
+        return None
+    try:
+        with open(path) as watermark_file:
+            return json.load(watermark_file)
+    finally:
+        remove_temp_file(cache_root, path)
+
+
+def write_watermark(key, watermark, cache_root):
+    """
+    Write the watermark after the partitions, so a failed update is re-read next time.
+    :param key:
+    :param watermark: dict with 'first_time' and 'last_time'
+    :param cache_root:
+    :return: None
+    """
+    local_path = get_local_write_path(cache_root, key, WATERMARK_FILENAME)
+    with open(local_path, 'w') as watermark_file:
+        json.dump(watermark, watermark_file)
+    put_cache_file(cache_root, key, WATERMARK_FILENAME, local_path)
+
+
+# Storage helpers below. S3 files are copied through a temp file.
+def is_s3(cache_root):
+    """
+    :param cache_root:
+    :return: True if cache_root is an 's3://' location.
+    """
+    return cache_root.startswith('s3://')
+
+
+def split_s3_root(cache_root, key, filename):
+    """
+    :param cache_root: like: s3://awscost-data/series
+    :param key:
+    :param filename:
+    :return: tuple (bucket, s3 key)
+    """
+    bucket_and_prefix = cache_root[len('s3://'):].rstrip('/')
+    parts = bucket_and_prefix.split('/', 1)
+    bucket = parts[0]
+    prefix = parts[1] + '/' if len(parts) > 1 else ''
+    return bucket, '{}{}/{}'.format(prefix, get_key_dir(key), filename)
+
+
+def get_cache_file(cache_root, key, filename):
+    """
+    Get a local path for a cache file, downloading it from S3 if needed.
+    :param cache_root:
+    :param key:
+    :param filename:
+    :return: local path, or None if the file doesn't exist.
+    """
+    if not is_s3(cache_root):
+        path = os.path.join(cache_root, get_key_dir(key), filename)
+        return path if os.path.exists(path) else None
+
+    bucket, s3_key = split_s3_root(cache_root, key, filename)
+    fd, temp_path = tempfile.mkstemp(suffix='_' + filename)
+    os.close(fd)
+    try:
+        boto3.client('s3').download_file(bucket, s3_key, temp_path)
+    except ClientError as ce:
+        os.remove(temp_path)
+        if ce.response['Error']['Code'] in ('404', 'NoSuchKey'):
+            return None
+        raise SeriesCacheError('Failed to read s3://{}/{}. Reason: {}'.format(bucket, s3_key, ce))
+    return temp_path
+
+
+def get_local_write_path(cache_root, key, filename):
+    """
+    :param cache_root:
+    :param key:
+    :param filename:
+    :return: path to write a cache file to before put_cache_file.
+    """
+    if is_s3(cache_root):
+        fd, temp_path = tempfile.mkstemp(suffix='_' + filename)
+        os.close(fd)
+        return temp_path
+
+    key_dir = os.path.join(cache_root, get_key_dir(key))
+    if not os.path.isdir(key_dir):
+        os.makedirs(key_dir)
+    return os.path.join(key_dir, filename + '.tmp')
+
+
+def put_cache_file(cache_root, key, filename, local_path):
+    """
+    Move a written file into the cache.
+    :param cache_root:
+    :param key:
+    :param filename:
+    :param local_path: from get_local_write_path
+    :return: None
+    """
+    if not is_s3(cache_root):
+        shutil.move(local_path, os.path.join(cache_root, get_key_dir(key), filename))
+        return
+
+    bucket, s3_key = split_s3_root(cache_root, key, filename)
+    try:
+        boto3.client('s3').upload_file(local_path, bucket, s3_key)
+    finally:
+        os.remove(local_path)
+
+
+def remove_temp_file(cache_root, path):
+    """
+    Remove a file downloaded from S3 by get_cache_file.
+    :param cache_root:
+    :param path:
+    :return: None
+    """
+    if is_s3(cache_root) and os.path.exists(path):
+        os.remove(path)
@@ -0,0 +1,155 @@
+"""
+Write-behind buffer for DynamoDB puts.
+
+Scans produce one AWSCost row per account / region / resource type. Instead of
+a put_item for each, rows are buffered and sent with batch_write_item, 25 items
+per request, when the buffer reaches a size threshold or the scan calls flush().
+
+A second put for the same key before a flush replaces the first one, since
+batch_write_item rejects requests with duplicate keys.
+"""
+from __future__ import print_function
+
+import threading
+import time
+
+# batch_write_item accepts at most 25 put or delete requests.
+BATCH_WRITE_ITEM_SIZE = 25
+
+# Flush when this many rows are buffered.
+DEFAULT_FLUSH_THRESHOLD = 100
+
+MAX_RETRIES = 8
+BACKOFF_BASE_SEC = 0.05
+BACKOFF_MAX_SEC = 5.0
+
+
+class BatchWriteError(Exception):
+    """
+    Raised when items are still unprocessed after MAX_RETRIES.
+    """
+    pass
+
+
+class BatchWriteBuffer(object):
+    """
+    Thread-safe buffer of low-level DynamoDB items for one table.
+
+    Usage:
+        buffer = BatchWriteBuffer(boto3.client('dynamodb'), 'AWSCost', ['awsResource', 'time'])
+        buffer.put_item({'awsResource': {'S': 'rds:123456789012:us-east-1'}, 'time': {'S': '20181115-14'}, ...})
+        buffer.flush()
+    """
+    def __init__(self, dynamodb_client, table_name, key_names, flush_threshold=DEFAULT_FLUSH_THRESHOLD):
+        """
+        :param dynamodb_client: boto3 dynamodb client.
+        :param table_name: like: 'AWSCost'
+        :param key_names: hash and range key attribute names, used to coalesce puts to the same key.
+        :param flush_threshold: number of buffered items that triggers a flush.
+        """
+        self.dynamodb_client = dynamodb_client
+        self.table_name = table_name
+        self.key_names = key_names
+        self.flush_threshold = flush_threshold
+        self.items = {}
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.stats = {
+            'puts': 0,
+            'coalesced': 0,
+            'items_written': 0,
+            'requests': 0,
+            'retries': 0,
+            'consumed_wcu': 0.0
+        }
+
+    def put_item(self, item):
+        """
+        Buffer an item. Flushes if the buffer reached the threshold.
+        :param item: low-level DynamoDB item, like: {'awsResource': {'S': '...'}, ...}
+        :return: None
+        """
+        key = tuple(sorted(item[name].items())[0] for name in self.key_names)
+        with self.lock:
+            self.stats['puts'] += 1
+            if key in self.items:
+                self.stats['coalesced'] += 1
+            self.items[key] = item
+            should_flush = len(self.items) >= self.flush_threshold
+
+        if should_flush:
+            self.flush()
+
+    def flush(self):
+        """
+        Write all buffered items.
+        :return: number of items written.
+        """
+        with self.flush_lock:
+            with self.lock:
+                items = list(self.items.values())
+                self.items = {}
+
+            for i in range(0, len(items), BATCH_WRITE_ITEM_SIZE):
+                try:
+                    self._write_batch(items[i:i + BATCH_WRITE_ITEM_SIZE])
+                except Exception:
+                    # Keep the items not written yet, unless newer puts replaced them, for the next flush.
+                    self._requeue(items[i:])
+                    raise
+
+            return len(items)
+
+    def _requeue(self, items):
+        """
+        Put items back in the buffer after a failed flush.
+        :param items:
+        :return: None
+        """
+        with self.lock:
+            for item in items:
+                key = tuple(sorted(item[name].items())[0] for name in self.key_names)
+                if key not in self.items:
+                    self.items[key] = item
+
+    def get_stats(self):
+        """
+        Counts since the buffer was created, including consumed write capacity units.
+        :return: dict
+        """
+        with self.lock:
+            ret_val = dict(self.stats)
+            ret_val['buffered'] = len(self.items)
+            return ret_val
+
+    def _write_batch(self, items):
+        """
+        One batch_write_item, retrying UnprocessedItems with exponential back-off.
+        :param items: up to BATCH_WRITE_ITEM_SIZE items.
+        :return: None
+        """
+        request_items = {self.table_name: [{'PutRequest': {'Item': item}} for item in items]}
+        retries = 0
+        while request_items:
+            response = self.dynamodb_client.batch_write_item(
+                RequestItems=request_items,
+                ReturnConsumedCapacity='TOTAL'
+            )
+            unprocessed = response.get('UnprocessedItems') or {}
+            num_unprocessed = len(unprocessed.get(self.table_name, []))
+
+            with self.lock:
+                self.stats['requests'] += 1
+                self.stats['items_written'] += len(request_items[self.table_name]) - num_unprocessed
+                for capacity in response.get('ConsumedCapacity', []):
+                    self.stats['consumed_wcu'] += capacity.get('CapacityUnits', 0.0)
+
+            request_items = unprocessed if num_unprocessed else None
+            if request_items:
+                retries += 1
+                if retries > MAX_RETRIES:
+                    raise BatchWriteError('batch_write_item on {} still had {} unprocessed items after {} retries'
+                                          .format(self.table_name, num_unprocessed, MAX_RETRIES))
+                with self.lock:
+                    self.stats['retries'] += 1
+                time.sleep(min(BACKOFF_BASE_SEC * (2 ** retries), BACKOFF_MAX_SEC))
@@ -106,6 +106,12 @@ public class Main {
                     lambdaEvent.addProperty("az", az);
                     lambdaEvent.addProperty("api-handler", "get-state");
 
+                    //Farm generation from the last response. Unchanged farms return 304.
+                    String ifNoneMatch = req.headers("If-None-Match");
+                    if (ifNoneMatch != null) {
+                        lambdaEvent.addProperty("if-none-match", ifNoneMatch);
+                    }
+
                     String gardenerApiLambdaFunctionName = getGardenerApiLambdaFunctionName();
                     InvokeRequest lambdaReq = new InvokeRequest()
                             .withFunctionName(gardenerApiLambdaFunctionName)
@@ -144,6 +150,18 @@ public class Main {
 
                         JsonElement data = new Gson().fromJson(p, JsonElement.class);
 
+                        if (data.isJsonObject()) {
+                            JsonObject dataObject = data.getAsJsonObject();
+                            if (dataObject.has("generation")) {
+                                res.header("ETag", "\"" + dataObject.get("generation").getAsString() + "\"");
+                            }
+                            if (dataObject.has("notModified")) {
+                                LOG.fine("farm: "+farmName+" not modified.");
+                                res.status(304);
+                                return "";
+                            }
+                        }
+
                         LOG.info("response (data.toString) = _"+data.toString()+"_");
                         return new Gson().toJson(new StandardResponse(StatusResponse.SUCCESS, data));
                     } catch (Exception e) {
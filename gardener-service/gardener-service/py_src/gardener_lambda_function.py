@@ -12,12 +12,16 @@ It can be case insensitive.
 
 """
 import json
+import os
 import time
 import util.garden_helper_util as garden_helper_util
 import util.aws_util as aws_util
+import util.farm_query as farm_query
+import util.service_template as service_template
 import base64
 import boto3
 import datetime
+from collections import OrderedDict
 from boto3.dynamodb.conditions import Key, Attr
 from botocore.exceptions import ClientError
 
@@ -38,6 +42,62 @@ STATE_DELETE = "delete"
 STATE_ERROR = "ERROR"
 ITEM_NOT_FOUND_IN_DB = "ERROR: Item not found"
 
+# FarmState attributes read by get_state.
+FARM_STATE_ATTRIBUTES = ['serviceName', 'state', 'serviceMode', 'repoUrl', 'versionString', 'targetRegion']
+
+# Row in the FarmStatus table with the generation of a farm's desired state.
+# update_service, change_service_mode and delete_service bump it after each change.
+FARM_GENERATION_KEY = '$generation'
+
+# Rendered get_state responses for this lambda container.
+# farmName -> {'generation': int, 'body': string, 'created': time-stamp}
+FARM_STATE_CACHE = {}
+
+# Re-render a farm after this long, even if the generation didn't change. Covers
+# changes to FarmState made outside of this lambda function, for full responses only.
+# "notModified" replies depend on the generation alone, so changes made outside
+# of this lambda function need to bump it too.
+FARM_STATE_CACHE_MAX_AGE_SEC = 15 * 60
+
+# Optional table, with hash key farmName, that shares rendered get_state responses
+# between lambda containers. Not used unless the environment variable is set.
+STATE_CACHE_TABLE_NAME = os.environ.get('GARDENER_STATE_CACHE_TABLE')
+
+# FarmServiceStatus rows expire this long after they are written. Rows of a
+# GroundsKeeper that stops reporting go away after this time.
+REPORTED_STATUS_TTL_SEC = 1800
+
+# Rewrite unchanged FarmServiceStatus rows when their ttl expires within this time.
+# GroundsKeeper reports every few minutes, so this needs to be more than one report
+# interval. Unchanged rows are written about every (TTL - REFRESH) seconds.
+REPORTED_STATUS_REFRESH_SEC = 900
+
+# A cached row is only trusted if this lambda container also took the previous report
+# of the farm and az, at most this long ago. Reports through other containers can
+# change the row in between, and then the gap here is two report intervals or more.
+# Set it to GroundsKeeper's report interval, plus a little for jitter. Check the
+# 'untrusted' count in the report_state stats log to see if it is too short.
+REPORTED_STATUS_TRUST_SEC = int(os.environ.get('REPORTED_STATUS_TRUST_SEC', str(3 * 60)))
+
+# Last FarmServiceStatus row written by this lambda container.
+# (farmName:az, serviceName) -> {'item': row without last_update and ttl, 'ttl': ttl written,
+#                                'seen': time of the last report with this row}
+REPORTED_STATUS_CACHE = {}
+REPORTED_STATUS_CACHE_MAX_ENTRIES = 50000
+
+# Rows reported to this lambda container, and how many were written or skipped.
+# 'untrusted' rows were unchanged, but written since the cached row was too old to trust.
+REPORTED_STATUS_STATS = {'rows': 0, 'skipped': 0, 'changed': 0, 'untrusted': 0, 'refreshed': 0}
+
+# Build numbers taken from the BuildNumbers table at a time. Above 1 the rest of
+# the block is kept for the next builds of the service in this lambda container,
+# for bursts of builds. Numbers left in a block when the container stops are skipped,
+# and builds through different containers don't get their numbers in order.
+BUILD_NUMBER_BLOCK_SIZE = int(os.environ.get('BUILD_NUMBER_BLOCK_SIZE', '1'))
+
+# serviceName -> [next build number, end of block (exclusive)]
+BUILD_NUMBER_BLOCKS = {}
+
 
 def lambda_handler(event, context):
     """
@@ -119,63 +179,81 @@ def get_state(event):
     Pull the farmName from the event, look it up in the DynamoDB table and return the result as
     a JSON object.
 
-    Also record the machine making the request.
+    The response has the farm's generation. A GroundsKeeper can send it back as "if-none-match",
+    and if the farm hasn't changed since, gets a short "notModified" response instead.
+
+    Rendered responses are cached by farm and generation, so polls of an unchanged farm
+    only read the generation row.
     :param event:
-    :return:
+    :return: '{ "generation": 12, "services": [...] }' or '{ "notModified": true, "generation": 12 }'
     """
     print('get_state')
 
     farm_name = event.get('farmName')
+    if_none_match = normalize_etag(event.get('if-none-match'))
+
+    generation = get_farm_generation(farm_name)
+    if generation is not None and if_none_match == str(generation):
+        print('get_state: {} not modified. generation={}'.format(farm_name, generation))
+        return '{ "notModified": true, "generation": %d }' % generation
 
-    response = FARM_STATE_TABLE.query(
-        KeyConditionExpression=Key('farmName').eq(farm_name)
+    ret_val = get_cached_farm_state(farm_name, generation)
+    if ret_val:
+        return ret_val
+
+    ret_val = render_farm_state(farm_name, generation)
+
+    # A change made while rendering might be in the response or not. Don't cache it
+    # under a generation it might not match.
+    if generation is not None and get_farm_generation(farm_name) == generation:
+        put_cached_farm_state(farm_name, generation, ret_val)
+    else:
+        print('get_state: {} changed while rendering. Not cached.'.format(farm_name))
+
+    return ret_val
+
+
+def render_farm_state(farm_name, generation):
+    """
+    Query FarmState for all services in a farm and fill in their state JSON, from
+    templates compiled once per service build.
+    :param farm_name:
+    :param generation: generation of the farm, or None if unknown.
+    :return: JSON string like: '{ "generation": 12, "services": [...] }'
+    """
+    start = garden_helper_util.start_timer()
+    # Consistent, so a change is seen by the first get_state of its generation.
+    items = farm_query.query_all(
+        FARM_STATE_TABLE, Key('farmName').eq(farm_name), attributes=FARM_STATE_ATTRIBUTES,
+        consistent_read=True
     )
 
     services = []
-    services_str = None
-    for i in response['Items']:
+    for i in items:
         try: 
-            json_with_escape_chars = i.get('state')
-            if not json_with_escape_chars:
+            if not i.get('state'):
                 print('WARN: state not found for a service in farm: {}'.format(farm_name))
                 continue
-            raw_json = json_with_escape_chars.replace('\\', '')
-
-            # replace $serviceMode
-            service_mode = i['serviceMode']
-            raw_json = raw_json.replace('$serviceMode', service_mode)
-
-            # replace $repoUrl
-            repo_url = i.get('repoUrl')
-            if repo_url:
-                raw_json = raw_json.replace('$repoUrl', repo_url)
-
-            # replace $versionString
-            version_string = i.get('versionString')
-            if version_string:
-                raw_json = raw_json.replace('$versionString', version_string)
-
-            # replace $targetRegion
-            target_region = i.get('targetRegion')
-            if not target_region:
-                target_region = 'all'
-            raw_json = raw_json.replace('$targetRegion', target_region)
-
-            services.append(raw_json)
-            if not services_str:
-                services_str = raw_json
-            else:
-                services_str += ', '+raw_json
+
+            template = service_template.get_template(i['serviceName'], i.get('versionString'), i['state'])
+            services.append(template.fill({
+                'serviceMode': i['serviceMode'],
+                'repoUrl': i.get('repoUrl') or None,
+                'versionString': i.get('versionString') or None,
+                'targetRegion': i.get('targetRegion') or 'all'
+            }))
         except Exception as ex:
-            print('ERROR: get_state - {}'.format(ex.message))
+            print('ERROR: get_state - {}'.format(ex))
             garden_helper_util.log_traceback_exception(ex)
             continue
 
-    if len(services) == 0:
-        ret_val = '{ "services": [] }'
-    else:
-        ret_val = '{ "services": [%s] }' % services_str
+    ret_val = OrderedDict()
+    if generation is not None:
+        ret_val['generation'] = generation
+    ret_val['services'] = services
+    ret_val = json.dumps(ret_val)
 
+    garden_helper_util.print_delta_time(start, 'render_farm_state {} services: {}'.format(farm_name, len(services)))
     return ret_val
 
 
@@ -183,6 +261,9 @@ def report_state(event):
     """
     This is the reported state of the machine. Look for differences between this and
     what is in the database, and highlight services that are out of sync in other applications.
+
+    Only services whose status changed since the last report are written, plus rows whose
+    ttl is about to expire. They are written together with batch_write_item.
     :param event:
     :return:
     """
@@ -200,77 +281,26 @@ def report_state(event):
         data = state_d.get('data')
         services = data.get('services')
 
+        aws_region = az
+        primary_key = '{}:{}'.format(farm_name, aws_region)
+
+        # expire the row in REPORTED_STATUS_TTL_SEC.
+        ts_epoch = int(round(time.time()))
+        ttl = ts_epoch + REPORTED_STATUS_TTL_SEC
+        last_update = datetime.datetime.fromtimestamp(ts_epoch).strftime('%Y-%m-%d_%H:%M:%S')
+
+        items = []
         for service in services:
             try:
-                # Get the required names
-                service_name = service.get('service_name')
-                aws_region = az
-                primary_key = '{}:{}'.format(farm_name, aws_region)
-
-                version = service.get('version')
-
-                # expire the row in one hour.
-                ts_epoch = round(time.time())
-                ttl = int(ts_epoch + 600)
-                last_update = datetime.datetime.fromtimestamp(ts_epoch).strftime('%Y-%m-%d_%H:%M:%S')
-
-                service_state = service.get('state')
-                service_status = service.get('status')
-                if service_status:
-                    status = service_status.get('status')
-                    error_msg = service_status.get('error_msg')
-                    error_details = service_status.get('error_details')
-                    if not error_details:
-                        error_details = '-'
-                    if not error_msg:
-                        error_msg = '-'
-                    else:
-                        error_count = service_status.get('error_count')
-                        error_msg = '{} ({})'.format(error_msg, error_count)
-                    running_count = service_status.get('running_count')
-                    when = service_status.get('when')
-                    if not when:
-                        when = '?'
-
-                    # Take the required fields and put them into the database.
-                    print('farmName: {}, serviceName: {}, region: {}, status: {}, version: {}, '
-                          'error_msg: {}, when: {}, last_update: {}'
-                          .format(farm_name, service_name, aws_region, status, version,
-                                  error_msg, when, last_update))
-
-                    # Populate the table.
-                    FARM_SERVICE_STATUS_TABLE.put_item(
-                        Item={
-                            'farmName': primary_key,
-                            'serviceName': service_name,
-                            'status': status,
-                            'version': version,
-                            'running_count': running_count,
-                            'error_msg': error_msg,
-                            'error_details': error_details,
-                            'when': when,
-                            'last_update': last_update,
-                            'ttl': ttl
-                        }
-                    )
-                else:
-                    # Populate the table with unknown results since no status block.
-                    report_status = service_state.upper()
-                    FARM_SERVICE_STATUS_TABLE.put_item(
-                        Item={
-                            'farmName': primary_key,
-                            'serviceName': service_name,
-                            'status': report_status,
-                            'version': version,
-                            'last_update': last_update,
-                            'ttl': ttl
-                        }
-                    )
-
+                item = make_service_status_item(primary_key, service)
+                if item:
+                    items.append(item)
             except Exception as ex:
                 print('ERROR: report_state - {}'.format(ex.message))
                 garden_helper_util.log_traceback_exception(ex)
 
+        write_changed_service_status(primary_key, items, ts_epoch, ttl, last_update)
+
         return None
 
     except Exception as ex:
@@ -278,6 +308,128 @@ def report_state(event):
         garden_helper_util.log_traceback_exception(ex)
 
 
+def make_service_status_item(primary_key, service):
+    """
+    Convert one service of a GroundsKeeper report into a FarmServiceStatus row,
+    without the 'last_update' and 'ttl' attributes.
+    :param primary_key: like: <farmName>:<az>
+    :param service: dictionary from the report's services list.
+    :return: dictionary, or None if the service has no name.
+    """
+    # Get the required names
+    service_name = service.get('service_name')
+    if not service_name:
+        print('WARN: report_state service without service_name in: {}'.format(primary_key))
+        return None
+
+    version = service.get('version')
+
+    service_state = service.get('state')
+    service_status = service.get('status')
+    if service_status:
+        status = service_status.get('status')
+        error_msg = service_status.get('error_msg')
+        error_details = service_status.get('error_details')
+        if not error_details:
+            error_details = '-'
+        if not error_msg:
+            error_msg = '-'
+        else:
+            error_count = service_status.get('error_count')
+            error_msg = '{} ({})'.format(error_msg, error_count)
+        running_count = service_status.get('running_count')
+        when = service_status.get('when')
+        if not when:
+            when = '?'
+
+        return {
+            'farmName': primary_key,
+            'serviceName': service_name,
+            'status': status,
+            'version': version,
+            'running_count': running_count,
+            'error_msg': error_msg,
+            'error_details': error_details,
+            'when': when
+        }
+    else:
+        # Populate the table with unknown results since no status block.
+        return {
+            'farmName': primary_key,
+            'serviceName': service_name,
+            'status': service_state.upper(),
+            'version': version
+        }
+
+
+def write_changed_service_status(primary_key, items, ts_epoch, ttl, last_update):
+    """
+    Write the FarmServiceStatus rows that changed since the last report from this farm and az.
+
+    Unchanged rows are skipped if this lambda container took the previous report within
+    REPORTED_STATUS_TRUST_SEC, unless their ttl expires within REPORTED_STATUS_REFRESH_SEC.
+    When one row needs a refresh, all unchanged rows of the farm and az are refreshed with it,
+    so their ttl stays aligned and later reports can skip them all.
+    :param primary_key: like: <farmName>:<az>
+    :param items: from make_service_status_item
+    :param ts_epoch: time of this report.
+    :param ttl: new ttl for rows written.
+    :param last_update: like: 2018-11-07_14:05:00
+    :return: number of rows written.
+    """
+    start = garden_helper_util.start_timer()
+
+    changed = []
+    unchanged = []
+    num_untrusted = 0
+    refresh = False
+    for item in items:
+        cache_key = (primary_key, item['serviceName'])
+        entry = REPORTED_STATUS_CACHE.get(cache_key)
+        if entry is None or entry['item'] != item:
+            changed.append(item)
+        elif ts_epoch - entry['seen'] > REPORTED_STATUS_TRUST_SEC:
+            changed.append(item)
+            num_untrusted += 1
+        else:
+            unchanged.append(item)
+            entry['seen'] = ts_epoch
+            if entry['ttl'] - ts_epoch < REPORTED_STATUS_REFRESH_SEC:
+                refresh = True
+
+    to_write = changed + unchanged if refresh else changed
+    if to_write:
+        with FARM_SERVICE_STATUS_TABLE.batch_writer(overwrite_by_pkeys=['farmName', 'serviceName']) as batch:
+            for item in to_write:
+                row = dict(item)
+                row['last_update'] = last_update
+                row['ttl'] = ttl
+                batch.put_item(Item=row)
+
+        if len(REPORTED_STATUS_CACHE) > REPORTED_STATUS_CACHE_MAX_ENTRIES:
+            REPORTED_STATUS_CACHE.clear()
+        for item in to_write:
+            REPORTED_STATUS_CACHE[(primary_key, item['serviceName'])] = {'item': item, 'ttl': ttl, 'seen': ts_epoch}
+
+    for item in changed:
+        print('farmName: {}, serviceName: {}, status: {}, version: {}, last_update: {}'
+              .format(primary_key, item['serviceName'], item['status'], item['version'], last_update))
+
+    stats = REPORTED_STATUS_STATS
+    stats['rows'] += len(items)
+    stats['skipped'] += len(items) - len(to_write)
+    stats['changed'] += len(changed) - num_untrusted
+    stats['untrusted'] += num_untrusted
+    stats['refreshed'] += len(to_write) - len(changed)
+
+    garden_helper_util.print_delta_time(
+        start, 'report_state {} services: {}, changed: {}, untrusted: {}, ttl refreshed: {}'.format(
+            primary_key, len(items), len(changed) - num_untrusted, num_untrusted, len(to_write) - len(changed)))
+    print('report_state stats: {}, skip rate: {}%'.format(
+        stats, round(100.0 * stats['skipped'] / stats['rows'], 1) if stats['rows'] else 0))
+    return len(to_write)
+
+
 def update_service(event):
     """
     Look-up the farm and service and update that entry in the database.
@@ -317,6 +469,10 @@ def update_service(event):
         raise ValueError('Missing repoUrl for service: {} - {}.'.format(service, version_string))
     if service_json is None:
         raise ValueError('Missing JSON for service: {} - {}'.format(service, version_string))
+    try:
+        service_template.get_template(service, version_string, service_json)
+    except Exception as ex:
+        print('WARN: Could not compile JSON for service: {} - {}. Reason: {}'.format(service, version_string, ex))
 
     FARM_STATE_TABLE.put_item(
         Item={
@@ -329,6 +485,7 @@ def update_service(event):
             'repoUrl': repo_url
         }
     )
+    bump_farm_generation(farm_name)
 
     # Add entry to SERVICE_HISTORY_TABLE
     state = 'deploy'
@@ -373,6 +530,7 @@ def delete_service(event):
             'serviceName': service
         }
     )
+    bump_farm_generation(farm_name)
 
     # ToDo: Added delete to history table. Verify user is included.
     # SERVICE_HISTORY_TABLE - undeploy
@@ -493,6 +651,7 @@ def change_service_mode(event):
             ':val': state
         }
     )
+    bump_farm_generation(farm_name)
 
     # SERVICE_HISTORY_TABLE - change state
     put_service_history_table_entry(service, farm_name, state, user)
@@ -536,11 +695,11 @@ def get_farm_inspect(event):
     farm_name = event.get('farmName')
 
     # Make call for all services in farm.
-    response = FARM_STATE_TABLE.query(
-        KeyConditionExpression=Key('farmName').eq(farm_name)
+    items = farm_query.query_all(
+        FARM_STATE_TABLE, Key('farmName').eq(farm_name), attributes=['serviceName', 'serviceMode', 'versionString']
     )
     ret_val = ''
-    for i in response['Items']:
+    for i in items:
         service_name = i['serviceName']
         service_mode = i['serviceMode']
         optional_version_string = i.get('versionString')
@@ -614,36 +773,13 @@ def post_service_build_info(event):
     print('service: {}, user: {}, '.format(service, build_user))
 
     # get the next version number for this service.
-
-    # invoke lambda function... build-number-service
-    lambda_client = boto3.client("lambda")
-
-    build_event = {
-        "service": service,
-        "user": build_user
-    }
-
-    response = lambda_client.invoke(
-        FunctionName='build-number-service',  # This is ctidev
-        InvocationType="RequestResponse",
-        Payload=json.dumps(build_event)
-    )
-
-    print('DEBUG: Build-Number-Service response: {}'.format(response))
-
-    # log result.
-    status_code = response['StatusCode']
-    print('Build-Number-Service Status Code: {}'.format(status_code))
-
-    payload = response['Payload'].read()
-    print('Payload={}'.format(payload))
+    build_number = allocate_build_number(service, build_user)
+    print('Build number: {}'.format(build_number))
 
     now = datetime.datetime.now()
     date_string = now.strftime('%Y%m%d')
     print('post_service_build_info date_string: _{}_'.format(date_string))
 
-    build_number = payload
-
     build_version = '{}-{}-{}-{}'.format(date_string, build_number, short_git_hash, build_branch)
 
     # put values in database.
@@ -653,7 +789,9 @@ def post_service_build_info(event):
         print('DEBUG: service_json=_{}_'.format(service_json))
 
         # inject the restricted keys. state, repo, version, target_region
-        service_json = inject_restricted_json_keys(service_json)
+        service_json, service_dict = inject_restricted_json_keys(service_json)
+        if service_dict:
+            service_template.put_template(service, build_version, service_template.ServiceTemplate(service_dict))
 
         BUILD_VERSION_TABLE.put_item(
             Item={
@@ -681,51 +819,49 @@ def post_service_build_info(event):
 
 def get_service_status_everywhere(event):
     """
-    Scan the FarmStatus table and return information about
+    Query the FarmServiceStatus table and return information about
     a service status in JSON format.
 
-
-
     :param event:
     :return: JSON or "ERROR: <message> if an error occurs.
     """
-    print('post_service_build_info')
+    print('get_service_status_everywhere')
 
     # Build a python dictionary.
     service = event.get('service')
     if not service:
-        raise ValueError('Call post_service_build_info is missing: service')
+        raise ValueError('Call get_service_status_everywhere is missing: service')
 
-    # Scan the FarmStatus table.
-    response = FARM_SERVICE_STATUS_TABLE.query(
-        IndexName='ByService',
-        KeyConditionExpression=Key('serviceName').eq(service)
+    # Query the FarmServiceStatus table, one thread per range of farm names.
+    items, metrics = farm_query.query_range_segments(
+        FARM_SERVICE_STATUS_TABLE, 'serviceName', service, 'farmName', index_name='ByService',
+        attributes=['farmName', 'status', 'version', 'running_count', 'last_update', 'error_msg']
     )
+    for metric in metrics:
+        print('ByService {} segment: {}, page: {}, items: {}, latency: {} ms'.format(
+            service, metric['segment'], metric['page'], metric['count'], metric['latency_ms']))
 
     services = []
+    for i in items:
 
-    items = response.get('Items')
-    if items:
-        for i in response['Items']:
-
-            status = i.get('status')
-            version = i.get('version')
-            running_count = i.get('running_count')
-            last_update = i.get('last_update')
-            farm_name = i.get('farmName')
-            err_message = i.get('error_msg')
+        status = i.get('status')
+        version = i.get('version')
+        running_count = i.get('running_count')
+        last_update = i.get('last_update')
+        farm_name = i.get('farmName')
+        err_message = i.get('error_msg')
 
-            # add the
-            curr_service = {
-                'farmName': farm_name,
-                'status': status,
-                'version': version,
-                'running_count': running_count,
-                'last_update': last_update,
-                'err_message': err_message
-            }
+        # add the
+        curr_service = {
+            'farmName': farm_name,
+            'status': status,
+            'version': version,
+            'running_count': running_count,
+            'last_update': last_update,
+            'err_message': err_message
+        }
 
-            services.append(curr_service)
+        services.append(curr_service)
 
     ret_val = {
         'services': services
@@ -792,7 +928,7 @@ def inject_restricted_json_keys(service_json):
     state: $serviceMode
     target_region: $targetRegion
     :param service_json:
-    :return:
+    :return: tuple (JSON string, dictionary). On error the service_json as it was and None.
     """
     print('type(service_json)={}'.format(type(service_json)))
 
@@ -805,13 +941,66 @@ def inject_restricted_json_keys(service_json):
         service_dict['target_region'] = '$targetRegion'
 
         ret_val = json.dumps(service_dict)
-        return ret_val
+        return ret_val, service_dict
 
-    except Exception as ex:
-        print('inject_restricted_json_keys had Error: {}'.format(e.message))
+    except Exception as e:
+        print('inject_restricted_json_keys had Error: {}'.format(e))
         garden_helper_util.log_traceback_exception(e)
 
-        return service_json
+        return service_json, None
+
+
+def allocate_build_number(service, user, block_size=None):
+    """
+    Next build number for a service, from an atomic update of the BuildNumbers table.
+
+    The table keeps the next number to give out, like the build-number-service lambda
+    did. A new service starts at 1.
+    :param service: like: drss
+    :param user: build user, recorded in BuildHistory.
+    :param block_size: numbers to reserve at a time. Default BUILD_NUMBER_BLOCK_SIZE
+    :return: int
+    """
+    if block_size is None:
+        block_size = BUILD_NUMBER_BLOCK_SIZE
+
+    block = BUILD_NUMBER_BLOCKS.get(service)
+    if block and block[0] < block[1]:
+        build_number = block[0]
+        block[0] += 1
+        print('Build number {} for {} from reserved block ending at {}'.format(build_number, service, block[1]))
+    else:
+        response = BUILD_NUMBERS_TABLE.update_item(
+            Key={
+                'serviceName': service
+            },
+            UpdateExpression='SET buildNumber = if_not_exists(buildNumber, :one) + :count, '
+                             'createdBy = if_not_exists(createdBy, :user)',
+            ExpressionAttributeValues={
+                ':one': 1,
+                ':count': block_size,
+                ':user': user
+            },
+            ReturnValues='UPDATED_NEW'
+        )
+        end = int(response['Attributes']['buildNumber'])
+        build_number = end - block_size
+        if block_size > 1:
+            BUILD_NUMBER_BLOCKS[service] = [build_number + 1, end]
+
+    try:
+        BUILD_HISTORY_TABLE.put_item(
+            Item={
+                'serviceName': service,
+                'buildNumber': build_number,
+                'date': datetime.datetime.now().strftime('%Y%m%d-%H%M%S'),
+                'user': user
+            }
+        )
+    except Exception as e:
+        print('WARN: Failed to write BuildHistory for {} build {}. Reason: {}'.format(service, build_number, e))
+
+    return build_number
 
 
 def get_current_mode_from_farm_state_table(farm_name, service):
@@ -843,6 +1032,144 @@ def get_current_mode_from_farm_state_table(farm_name, service):
         return '{}: {}'.format(STATE_ERROR, e.message)
 
 
+def get_farm_generation(farm_name):
+    """
+    Read the generation of a farm's desired state.
+    :param farm_name:
+    :return: int, 0 if the farm was never changed, or None on error.
+    """
+    try:
+        response = FARM_STATUS_TABLE.get_item(
+            Key={
+                'farmName': farm_name,
+                'serviceName': FARM_GENERATION_KEY
+            },
+            ProjectionExpression='generation',
+            ConsistentRead=True
+        )
+        item = response.get('Item')
+        if not item:
+            return 0
+        return int(item.get('generation', 0))
+    except Exception as e:
+        print('Failed to read generation of farm: {}. Reason: {}'.format(farm_name, e))
+        garden_helper_util.log_traceback_exception(e)
+        return None
+
+
+def bump_farm_generation(farm_name):
+    """
+    Add one to the generation of a farm, after a change to its services in FarmState.
+    Cached get_state responses for the old generation are no longer used.
+
+    A failure is raised, so the change fails and gets retried. Otherwise GroundsKeepers
+    polling with the old generation would get "notModified" until the next change.
+    :param farm_name:
+    :return: new generation
+    """
+    FARM_STATE_CACHE.pop(farm_name, None)
+    try:
+        response = FARM_STATUS_TABLE.update_item(
+            Key={
+                'farmName': farm_name,
+                'serviceName': FARM_GENERATION_KEY
+            },
+            UpdateExpression='ADD generation :one',
+            ExpressionAttributeValues={
+                ':one': 1
+            },
+            ReturnValues='UPDATED_NEW'
+        )
+        generation = int(response['Attributes']['generation'])
+        print('Farm: {} is now generation: {}'.format(farm_name, generation))
+        return generation
+    except Exception as e:
+        print('ERROR: Failed to bump generation of farm: {}. Reason: {}'.format(farm_name, e))
+        raise
+
+
+def get_cached_farm_state(farm_name, generation):
+    """
+    Look for a rendered get_state response of this generation, first in this
+    lambda container, then in the shared cache table if there is one.
+    :param farm_name:
+    :param generation: None means unknown, and never matches.
+    :return: JSON string, or None if not cached.
+    """
+    if generation is None:
+        return None
+
+    now = time.time()
+    entry = FARM_STATE_CACHE.get(farm_name)
+    if entry and entry['generation'] == generation and now - entry['created'] < FARM_STATE_CACHE_MAX_AGE_SEC:
+        print('get_state: {} generation {} from cache'.format(farm_name, generation))
+        return entry['body']
+
+    if not STATE_CACHE_TABLE_NAME:
+        return None
+    try:
+        response = DYNAMODB.Table(STATE_CACHE_TABLE_NAME).get_item(
+            Key={
+                'farmName': farm_name
+            }
+        )
+        item = response.get('Item')
+        if item and int(item['generation']) == generation and now - int(item['created']) < FARM_STATE_CACHE_MAX_AGE_SEC:
+            print('get_state: {} generation {} from {}'.format(farm_name, generation, STATE_CACHE_TABLE_NAME))
+            FARM_STATE_CACHE[farm_name] = {'generation': generation, 'body': item['body'], 'created': int(item['created'])}
+            return item['body']
+    except Exception as e:
+        print('WARN: Failed to read {} for farm: {}. Reason: {}'.format(STATE_CACHE_TABLE_NAME, farm_name, e))
+    return None
+
+
+def put_cached_farm_state(farm_name, generation, body):
+    """
+    Keep a rendered get_state response in this lambda container and the shared cache table.
+    :param farm_name:
+    :param generation: None means unknown, and it isn't cached.
+    :param body: JSON string
+    :return: None
+    """
+    if generation is None:
+        return
+
+    created = int(time.time())
+    FARM_STATE_CACHE[farm_name] = {'generation': generation, 'body': body, 'created': created}
+
+    if not STATE_CACHE_TABLE_NAME:
+        return
+    try:
+        DYNAMODB.Table(STATE_CACHE_TABLE_NAME).put_item(
+            Item={
+                'farmName': farm_name,
+                'generation': generation,
+                'body': body,
+                'created': created,
+                'ttl': created + FARM_STATE_CACHE_MAX_AGE_SEC
+            }
+        )
+    except Exception as e:
+        print('WARN: Failed to write {} for farm: {}. Reason: {}'.format(STATE_CACHE_TABLE_NAME, farm_name, e))
+
+
+def normalize_etag(etag):
+    """
+    Accept the generation as a number or as an HTTP ETag header value.
+    :param etag: like: 12, "12" or W/"12"
+    :return: string like: '12', or None if not set.
+    """
+    if etag is None:
+        return None
+    etag = str(etag).strip()
+    if etag.startswith('W/'):
+        etag = etag[2:]
+    etag = etag.strip('"')
+    if not etag:
+        return None
+    return etag
+
+
 def convert_to_python_dictionary(service):
     """
     Service likely comes in as a JSON String. Convert it into a python dictionary.
@@ -0,0 +1,140 @@
+"""
+Paginated queries of the Farm* DynamoDB tables.
+
+A single query returns at most 1 MB. query_all follows LastEvaluatedKey so
+large farms aren't cut off.
+
+query_range_segments splits the range key into segments, like farmName
+'a' - 'e', 'e' - 'j', ..., and pages through each segment on its own
+thread. Used for the ByService index, where one service has a row for every
+farm:az it runs in.
+
+Both take a list of attributes to read, since FarmState rows have the whole
+service JSON.
+"""
+from __future__ import print_function
+
+import time
+from multiprocessing.pool import ThreadPool
+from boto3.dynamodb.conditions import Key
+
+# Range key segments for query_range_segments. Farm names are lower case.
+DEFAULT_SEGMENT_BOUNDARIES = ['e', 'j', 'o', 't']
+
+MAX_SEGMENT_THREADS = 5
+
+
+def query_all(table, key_condition, index_name=None, attributes=None, consistent_read=False, metrics=None):
+    """
+    Query all pages.
+    :param table: boto3 dynamodb Table
+    :param key_condition: like: Key('farmName').eq(farm_name)
+    :param index_name: like: 'ByService', or None for the table.
+    :param attributes: list of attribute names to read, or None for all.
+    :param consistent_read: not allowed on global secondary indexes.
+    :param metrics: list to append a dict for each call, with 'page', 'count' and 'latency_ms'.
+    :return: generator of items.
+    """
+    query_args = {
+        'TableName': table.name,
+        'KeyConditionExpression': key_condition
+    }
+    if index_name:
+        query_args['IndexName'] = index_name
+    if consistent_read:
+        query_args['ConsistentRead'] = True
+    if attributes:
+        # Names like 'status', 'when' and 'ttl' are reserved words.
+        names = {}
+        for i, attribute in enumerate(attributes):
+            names['#p{}'.format(i)] = attribute
+        query_args['ProjectionExpression'] = ', '.join(sorted(names.keys()))
+        query_args['ExpressionAttributeNames'] = names
+
+    # The table's client is thread-safe, the Table resource isn't.
+    client = table.meta.client
+    page = 0
+    while True:
+        start = time.time()
+        response = client.query(**query_args)
+        page += 1
+        items = response.get('Items', [])
+        if metrics is not None:
+            metrics.append({
+                'page': page,
+                'count': len(items),
+                'latency_ms': int((time.time() - start) * 1000)
+            })
+
+        for item in items:
+            yield item
+
+        last_key = response.get('LastEvaluatedKey')
+        if not last_key:
+            break
+        query_args['ExclusiveStartKey'] = last_key
+
+
+def query_range_segments(table, hash_key_name, hash_value, range_key_name, index_name=None, attributes=None,
+                         boundaries=None, max_threads=MAX_SEGMENT_THREADS):
+    """
+    Query all pages for one hash key, with the range key split into segments
+    that are read at the same time.
+    :param table: boto3 dynamodb Table
+    :param hash_key_name: like: 'serviceName'
+    :param hash_value: like: 'drss'
+    :param range_key_name: like: 'farmName'
+    :param index_name: like: 'ByService'
+    :param attributes: list of attribute names to read, or None for all. Needs the range key.
+    :param boundaries: sorted list of range key values between segments. Default DEFAULT_SEGMENT_BOUNDARIES
+    :param max_threads:
+    :return: tuple (list of items sorted by range key, list of metrics dicts with 'segment', 'page', 'count'
+    and 'latency_ms')
+    """
+    if boundaries is None:
+        boundaries = DEFAULT_SEGMENT_BOUNDARIES
+    if attributes and range_key_name not in attributes:
+        attributes = list(attributes) + [range_key_name]
+
+    hash_condition = Key(hash_key_name).eq(hash_value)
+    range_key = Key(range_key_name)
+    segments = []
+    for i in range(len(boundaries) + 1):
+        if i == 0:
+            segments.append(('< {}'.format(boundaries[0]), range_key.lt(boundaries[0])))
+        elif i == len(boundaries):
+            segments.append(('>= {}'.format(boundaries[-1]), range_key.gte(boundaries[-1])))
+        else:
+            # between is inclusive at both ends, duplicates are removed below.
+            segments.append(('{} - {}'.format(boundaries[i - 1], boundaries[i]),
+                             range_key.between(boundaries[i - 1], boundaries[i])))
+
+    def query_segment(segment):
+        name, range_condition = segment
+        segment_metrics = []
+        items = list(query_all(table, hash_condition & range_condition, index_name=index_name,
+                               attributes=attributes, metrics=segment_metrics))
+        for metric in segment_metrics:
+            metric['segment'] = name
+        return items, segment_metrics
+
+    start = time.time()
+    pool = ThreadPool(min(max_threads, len(segments)))
+    try:
+        results = pool.map(query_segment, segments)
+    finally:
+        pool.close()
+        pool.join()
+
+    merged = {}
+    metrics = []
+    for items, segment_metrics in results:
+        metrics.extend(segment_metrics)
+        for item in items:
+            merged[item[range_key_name]] = item
+
+    ret_val = [merged[k] for k in sorted(merged.keys())]
+    print('query_range_segments {} {}={}: {} items, {} calls in {} ms. slowest call: {} ms'.format(
+        table.name, hash_key_name, hash_value, len(ret_val), len(metrics), int((time.time() - start) * 1000),
+        max([m['latency_ms'] for m in metrics] or [0])))
+    return ret_val, metrics
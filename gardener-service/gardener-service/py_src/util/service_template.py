@@ -0,0 +1,194 @@
+"""
+Compiled templates of the service JSON in FarmState.
+
+The stored service JSON has placeholders that get_state fills in for each farm,
+like: "state": "$serviceMode". inject_restricted_json_keys adds them when a
+build is posted.
+
+A ServiceTemplate parses the JSON once and keeps which strings have
+placeholders. fill() copies only those strings and the dicts and lists that
+hold them. Everything else is shared with the template, so the filled service
+is only good for json.dumps.
+
+Templates are cached by (service, version), since the JSON of a build doesn't
+change.
+"""
+from __future__ import print_function
+
+import json
+import re
+
+PLACEHOLDERS = ['serviceMode', 'repoUrl', 'versionString', 'targetRegion']
+PLACEHOLDER_PATTERN = re.compile(r'\$(' + '|'.join(PLACEHOLDERS) + ')')
+
+# (service, version) -> ServiceTemplate
+TEMPLATE_CACHE = {}
+TEMPLATE_CACHE_MAX_ENTRIES = 2000
+
+
+class ServiceTemplate(object):
+    """
+    Service JSON with placeholder slots.
+    """
+    def __init__(self, service_json):
+        """
+        :param service_json: JSON string, or the already parsed dict.
+        """
+        if not isinstance(service_json, dict):
+            # Older rows have escaped quotes, like: {\"name\": ...}
+            service_json = json.loads(service_json.replace('\\', ''))
+        self.root, self.num_slots = compile_node(service_json)
+
+    def fill(self, values):
+        """
+        :param values: placeholder name -> value, like: {'serviceMode': 'run'}. Placeholders
+        that are missing or None are left as they are.
+        :return: dict for json.dumps
+        """
+        return fill_node(self.root, values)
+
+
+class TemplateString(object):
+    """
+    String with placeholders, split into literal text and placeholder names.
+    """
+    def __init__(self, value):
+        """
+        :param value: like: '$repoUrl:$versionString'
+        """
+        # re.split with a group gives [text, name, text, name, ..., text]
+        self.parts = PLACEHOLDER_PATTERN.split(value)
+
+    def fill(self, values):
+        """
+        :param values: placeholder name -> value
+        :return: string
+        """
+        ret_val = []
+        for i, part in enumerate(self.parts):
+            if i % 2 == 0:
+                ret_val.append(part)
+            else:
+                value = values.get(part)
+                ret_val.append('$' + part if value is None else value)
+        return ''.join(ret_val)
+
+
+class TemplateDict(object):
+    """
+    Dict with at least one placeholder somewhere in its values.
+    """
+    def __init__(self, constant, slots):
+        """
+        :param constant: the keys without placeholders.
+        :param slots: key -> compiled node with placeholders.
+        """
+        self.constant = constant
+        self.slots = slots
+
+
+class TemplateList(object):
+    """
+    List with at least one placeholder somewhere in its items.
+    """
+    def __init__(self, items):
+        """
+        :param items: list of constant values and compiled nodes.
+        """
+        self.items = items
+
+
+def compile_node(node):
+    """
+    :param node: parsed JSON value.
+    :return: tuple (compiled node, number of placeholder strings). The node is returned
+    unchanged if it has no placeholders.
+    """
+    if isinstance(node, dict):
+        constant = {}
+        slots = {}
+        num_slots = 0
+        for key, value in node.items():
+            compiled, count = compile_node(value)
+            if count:
+                slots[key] = compiled
+                num_slots += count
+            else:
+                constant[key] = value
+        if not num_slots:
+            return node, 0
+        return TemplateDict(constant, slots), num_slots
+
+    if isinstance(node, list):
+        items = []
+        num_slots = 0
+        for value in node:
+            compiled, count = compile_node(value)
+            items.append(compiled)
+            num_slots += count
+        if not num_slots:
+            return node, 0
+        return TemplateList(items), num_slots
+
+    if is_string(node) and PLACEHOLDER_PATTERN.search(node):
+        return TemplateString(node), 1
+
+    return node, 0
+
+
+def fill_node(node, values):
+    """
+    :param node: from compile_node
+    :param values: placeholder name -> value
+    :return: JSON value
+    """
+    if isinstance(node, TemplateString):
+        return node.fill(values)
+    if isinstance(node, TemplateDict):
+        ret_val = dict(node.constant)
+        for key, value in node.slots.items():
+            ret_val[key] = fill_node(value, values)
+        return ret_val
+    if isinstance(node, TemplateList):
+        return [fill_node(value, values) for value in node.items]
+    return node
+
+
+def get_template(service, version, service_json):
+    """
+    Cached template for a service build.
+    :param service: like: drss
+    :param version: like: 20181107-30-1b178b42-master. None to skip the cache.
+    :param service_json: stored JSON string, or parsed dict, used if not cached.
+    :return: ServiceTemplate
+    """
+    key = (service, version)
+    template = TEMPLATE_CACHE.get(key) if version else None
+    if template is None:
+        template = ServiceTemplate(service_json)
+        if version:
+            put_template(service, version, template)
+    return template
+
+
+def put_template(service, version, template):
+    """
+    :param service:
+    :param version:
+    :param template: ServiceTemplate
+    :return: None
+    """
+    if len(TEMPLATE_CACHE) >= TEMPLATE_CACHE_MAX_ENTRIES:
+        TEMPLATE_CACHE.clear()
+    TEMPLATE_CACHE[(service, version)] = template
+
+
+def is_string(value):
+    """
+    :param value:
+    :return: True for str and unicode, in python 2 and 3.
+    """
+    try:
+        return isinstance(value, basestring)
+    except NameError:
+        return isinstance(value, str)
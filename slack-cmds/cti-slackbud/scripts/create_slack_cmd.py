@@ -5,85 +5,32 @@ import os
 
 def update_entry_point(cmd_lower_case, cmd):
     """
-    Updates the entry point with needed import for new command.
+    Adds the new command to the command registry, which both entry points
+    (lambda_function.py and lambda_longtasks.py) use to find it.
 
     :param cmd_lower_case:
+    :param cmd:
     :return: True if it succeeded.
     """
-    # Open the entry point file for reading and writing.
+    # Open the registry file for reading and writing.
     try:
-        with open('../slack_bud/lambda_function.py', "r+") as f:
+        with open('../slack_bud/cmds/cmd_registry.py', "r+") as f:
             original_file = f.read()
 
             # write the backup file.
-            backup_fh = open('../slack_bud/lambda_function_backup.py', "w")
+            backup_fh = open('../slack_bud/cmds/cmd_registry_backup.py', "w")
             backup_fh.writelines(original_file)
             backup_fh.close()
 
-            # read the template files.
-            import_fh = open('./create_slack_cmdimportline.txt', 'r')
-            import_template = import_fh.read()
-            switch_fh = open('./create_slack_cmdswitchline.txt', 'r')
-            switch_template = switch_fh.read()
-            confirm_fh = open('./create_slack_cmdconfirmsline.txt', 'r')
-            confirm_template = confirm_fh.read()
-
-            # modify entry point.
-            import_template = import_template.replace('{cmdlowercase}', cmd_lower_case)
-            import_template = import_template.replace('{cmd}', cmd)
-            switch_template = switch_template.replace('{cmdlowercase}', cmd_lower_case)
-            switch_template = switch_template.replace('{cmd}', cmd)
-            confirm_template = confirm_template.replace('{cmdlowercase}', cmd_lower_case)
-            confirm_template = confirm_template.replace('{cmd}', cmd)
-
-            modified_file = original_file.replace('# {cmdimportline}', import_template)
-            modified_file = modified_file.replace('# {cmdswitchline}', switch_template)
-            modified_file = modified_file.replace('# {cmdconfirmsline}', confirm_template)
+            # read the template file.
+            registry_fh = open('./create_slack_cmdregistryline.txt', 'r')
+            registry_template = registry_fh.read()
 
-            f.seek(0)
-            f.write(modified_file)
-            f.truncate()
-            f.close()
-        return True
-    except Exception as ex:
-        print("Something went wrong.")
-        print("Restore the original file from the backup. ")
-        print("   slack_bud/lambda_function_backup.py")
-        print()
-        print("Error: {}".format(ex))
-        return False
+            # modify registry.
+            registry_template = registry_template.replace('{cmdlowercase}', cmd_lower_case)
+            registry_template = registry_template.replace('{cmd}', cmd)
 
-
-def update_longtask_entry_point(cmd_lower_case, cmd):
-    try:
-        print('...')
-        with open('../slack_bud/lambda_longtasks.py', "r+") as f:
-            original_file = f.read()
-
-            # write the backup file.
-            backup_fh = open('../slack_bud/lambda_longtasks_backup.py', "w")
-            backup_fh.writelines(original_file)
-            backup_fh.close()
-
-            # read the template files.
-            import_fh = open('./create_slack_cmdimportline.txt', 'r')
-            import_template = import_fh.read()
-            switch_fh = open('./create_slack_cmdlongtaskswitchline.txt', 'r')
-            switch_template = switch_fh.read()
-            confirm_fh = open('./create_slack_cmdconfirmsline.txt', 'r')
-            confirm_template = confirm_fh.read()
-
-            # modify entry point.
-            import_template = import_template.replace('{cmdlowercase}', cmd_lower_case)
-            import_template = import_template.replace('{cmd}', cmd)
-            switch_template = switch_template.replace('{cmdlowercase}', cmd_lower_case)
-            switch_template = switch_template.replace('{cmd}', cmd)
-            confirm_template = confirm_template.replace('{cmdlowercase}', cmd_lower_case)
-            confirm_template = confirm_template.replace('{cmd}', cmd)
-
-            modified_file = original_file.replace('# {cmdimportline}', import_template)
-            modified_file = modified_file.replace('# {cmdlongtaskswitchline}', switch_template)
-            modified_file = modified_file.replace('# {cmdconfirmsline}', confirm_template)
+            modified_file = original_file.replace('# {cmdregistryline}', registry_template)
 
             f.seek(0)
             f.write(modified_file)
@@ -93,19 +40,20 @@ def update_longtask_entry_point(cmd_lower_case, cmd):
     except Exception as ex:
         print("Something went wrong.")
         print("Restore the original file from the backup. ")
-        print("   slack_bud/lambda_function_backup.py")
+        print("   slack_bud/cmds/cmd_registry_backup.py")
         print()
         print("Error: {}".format(ex))
         return False
 
+
 def delete_backup_entry_point_files():
     """
     If everything goes well, delete the backup file.
 
     :return: None
     """
-    os.remove('../slack_bud/lambda_function_backup.py')
-    os.remove('../slack_bud/lambda_longtasks_backup.py')
+    os.remove('../slack_bud/cmds/cmd_registry_backup.py')
+
 
 def list_current_commands():
     """
@@ -407,14 +355,12 @@ def main():
     fh.writelines(new_cmd_file)
     fh.close()
 
-    # update the entry point.
+    # update the command registry.
     success = update_entry_point(new_cmd_lower_case, new_cmd_title)
     if success:
-        success = update_longtask_entry_point(new_cmd_lower_case, new_cmd_title)
-        if success:
-            print("Commit new files to git.")
-            print("Check /rundev in a few minutes for new command.")
-            delete_backup_entry_point_files()
+        print("Commit new files to git.")
+        print("Check /rundev in a few minutes for new command.")
+        delete_backup_entry_point_files()
     else:
         print("Don't commit new files to git.")
         print("Restore backup file.")
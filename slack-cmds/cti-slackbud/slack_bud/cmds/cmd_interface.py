@@ -25,7 +25,8 @@ import util.groups as groups
 from util.slack_ui_util import ShowSlackError
 from util.bud_helper_util import squash_token_print
 from util.bud_helper_util import get_slack_bud_environment
-from util.aws_util import get_ssm_parameter
+import util.auth_cache as auth_cache
+import util.async_writer as async_writer
 
 HEADER = {"Content-type": "application/json"}
 DYNAMODB = boto3.resource('dynamodb')
@@ -749,10 +750,13 @@ class CmdInterface:
             cmd_specific_data = self.build_cmd_specific_data()
             cmd_inputs.set_cmd_specific_data(cmd_specific_data)
 
-        # Add cmd history to database.
+        # Add cmd history to database. For longtasks the longtask lambda writes it.
         where_am_i = cmd_inputs.get_where_am_i()
+        history_item = None
         if where_am_i == 'shorttask':
-            self.__add_cmd_history_to_db()
+            history_item = self.__create_cmd_history_item()
+            if history_item and run_type != 'longtask':
+                async_writer.put_item(SLACK_CMD_TABLE.name, history_item)
 
         # Read the sub-commands 'run-type' property to determine where it is run.
         if run_type == 'shorttask':
@@ -775,6 +779,8 @@ class CmdInterface:
                     'key2': 'value2'
                 }
                 payload = self.create_longtask_payload(custom_data)
+                if history_item:
+                    payload['pending_writes'] = [[SLACK_CMD_TABLE.name, history_item]]
                 slack_bud_env = cmd_inputs.get_slack_bud_env()
                 bud_helper_util.invoke_longtask_lambda(slack_bud_env, payload)
                 print('(debug). Invoking Longtask Lambda in {}'.format(slack_bud_env))
@@ -822,8 +828,10 @@ class CmdInterface:
             original_message_text)
         )
 
-        SLACK_SESSION_TABLE.put_item(
-            Item={
+        # Written before the response goes back to slack, by async_writer.flush()
+        async_writer.put_item(
+            SLACK_SESSION_TABLE.name,
+            {
                 'slackBudSessionId': str(session_id),
                 'text': original_message_text,
                 'ttl': ttl
@@ -874,11 +882,11 @@ class CmdInterface:
             return None
         return response['Item']['text']
 
-    def __add_cmd_history_to_db(self):
+    def __create_cmd_history_item(self):
         """
-        Add a validated command line to the history table.
+        Create the history table row for a validated command line.
         If an error occurs log it, but don't stop the command from running.
-        :return: None
+        :return: dict, or None if it failed.
         """
         try:
             raw_cmd_line = self._cmd_inputs.get_raw_inputs()
@@ -888,22 +896,15 @@ class CmdInterface:
             # expire the row in 6 months.
             ttl = int(round(time.time()) + (3600*24*30*6))
 
-            print('(DEBUG) calling put_item. userid={}, timestamp={}, ttl={}, cmdline={}'
+            print('(DEBUG) cmd history. userid={}, timestamp={}, ttl={}, cmdline={}'
                   .format(user_id, time_str, ttl, raw_cmd_line))
 
-            response = SLACK_CMD_TABLE.put_item(
-                Item={
-                    'userid': user_id,
-                    'timestamp': time_str,
-                    'cmdline': raw_cmd_line,
-                    'ttl': ttl
-                }
-            )
-
-            if response['ResponseMetadata']['HTTPStatusCode'] == 200:
-                print('Insert success')
-            else:
-                print('Insert failed')
+            return {
+                'userid': user_id,
+                'timestamp': time_str,
+                'cmdline': raw_cmd_line,
+                'ttl': ttl
+            }
 
         except Exception as ex:
             # Log the error, but don't stop the command.
@@ -934,9 +935,11 @@ def is_valid_token(params):
     slack_env = get_slack_bud_environment(params)
     token_name = 'bud_' + slack_env + '_slack_token'
     print('DEBUG: getting token for: {}'.format(token_name))
-    ssm_token = get_ssm_parameter(token_name)
-    print('new token name = {}'.format(token_name))
-    if ssm_token == 'none':
+    ssm_token = auth_cache.get_ssm_parameter(token_name)
+    if ssm_token != token and ssm_token != auth_cache.SSM_PARAMETER_NOT_FOUND:
+        # The token might have been rotated since it was cached.
+        ssm_token = auth_cache.get_ssm_parameter(token_name, refresh=True)
+    if ssm_token == auth_cache.SSM_PARAMETER_NOT_FOUND:
         ssm_token = EXPECTED_TOKEN
     if token != ssm_token:
         # Log what you can about this request.
@@ -953,23 +956,18 @@ def look_up_bud_user(params):
     """
     Look-up userid in the BudUsers table.
     If found return the user name.
+    Cached across warm invocations, see util/auth_cache.py
     :param params: params
     :return: return user name. If not found return None.
     """
     user_id = params['user_id'][0]
     print('use_id={}'.format(user_id))
-    response = BUD_USERS_TABLE.get_item(
-        Key={
-            'userid': user_id,
-        }
-    )
-
-    print('TEMP: BUD_USERS_TABLE.get_item response: {}'.format(response))
-    if 'Item' not in response:
+    item = auth_cache.get_bud_user(BUD_USERS_TABLE, user_id)
+    if item is None:
         # Log this user_id
         print("Invalid user_id: {}".format(user_id))
         return None
-    return response['Item']
+    return item
 
 
 def is_user_in_cmd_group(slack_user_group, cmd_group):
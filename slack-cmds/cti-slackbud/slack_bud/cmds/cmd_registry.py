@@ -0,0 +1,150 @@
+"""
+Registry of SlackBud commands.
+
+Maps each command to the module and class that implement it. The entry points
+(lambda_function.py and lambda_longtasks.py) import a command's module only
+when a request uses it, so a cold start doesn't pay for pandas, jira, ldap3,
+etc. unless the command needs them. The import time of each command module is
+logged the first time it is loaded.
+
+New commands are added here by scripts/create_slack_cmd.py
+"""
+from __future__ import print_function
+
+import importlib
+import json
+import os
+import subprocess
+import sys
+import util.import_profiler as import_profiler
+
+# command name -> (module, class name). The longtask 'task' is the class name.
+COMMANDS = {
+    'version': ('cmds.cmds_version', 'CmdVersion'),
+    'help': ('cmds.cmds_help', 'CmdHelp'),
+    'untagged': ('cmds.cmds_untagged', 'CmdUntagged'),
+    'user': ('cmds.cmds_user', 'CmdUser'),
+    'cmd': ('cmds.cmds_cmd', 'CmdCmd'),
+    'spend': ('cmds.cmds_spend', 'CmdSpend'),
+    'farm': ('cmds.cmds_farm', 'CmdFarm'),
+    'apps_flamegraph': ('cmds.cmds_apps_flamegraph', 'CmdApps_Flamegraph'),
+    'jupyter': ('cmds.cmds_jupyter', 'CmdJupyter'),
+    'awslogin': ('cmds.cmds_awslogin', 'CmdAwslogin'),
+    'flamegraph': ('cmds.cmds_flamegraph', 'CmdFlamegraph'),
+    'dsnacpu': ('cmds.cmds_dsnacpu', 'CmdDsnacpu'),
+    's3stats': ('cmds.cmds_s3stats', 'CmdS3Stats'),
+    'rtbproto': ('cmds.cmds_rtbproto', 'CmdRtbproto'),
+    'ri': ('cmds.cmds_ri', 'CmdRi'),
+    'uxeng': ('cmds.cmds_uxeng', 'CmdUxeng'),
+    'cost': ('cmds.cmds_cost', 'CmdCost'),
+    'p4': ('cmds.cmds_p4', 'CmdP4'),
+    'unity': ('cmds.cmds_unity', 'CmdUnity'),
+    'awsinfo': ('cmds.cmds_awsinfo', 'CmdAwsinfo'),
+    'ebs': ('cmds.cmds_ebs', 'CmdEbs'),
+    'patch': ('cmds.cmds_patch', 'CmdPatch'),
+    'uitests': ('cmds.cmds_uitests', 'CmdUitests'),
+# {cmdregistryline}
+}
+
+# longtask 'task' (class name) -> (module, class name)
+TASKS = dict((class_name, (module_name, class_name)) for module_name, class_name in COMMANDS.values())
+
+# (module, class name) -> class, for classes already imported.
+LOADED_CLASSES = {}
+
+# Modules the shortterm entry point must not import until a command needs them.
+HEAVY_MODULES = ['pandas', 'numpy', 'jira', 'ldap3', 'matplotlib']
+
+# Seconds allowed to import lambda_function, in test_shortterm_import_footprint.
+SHORTTERM_IMPORT_BUDGET_SEC = 1.5
+
+
+def get_cmd_class(command):
+    """
+    Import the class for a slash command.
+    :param command: like: untagged
+    :return: class like CmdUntagged, or None if not a command.
+    """
+    entry = COMMANDS.get(command)
+    if not entry:
+        return None
+    return load_class(entry[0], entry[1])
+
+
+def get_task_class(task):
+    """
+    Import the class for a longtask.
+    :param task: class name like: CmdUntagged
+    :return: class, or None if not a command.
+    """
+    entry = TASKS.get(task)
+    if not entry:
+        return None
+    return load_class(entry[0], entry[1])
+
+
+def load_class(module_name, class_name):
+    """
+    :param module_name: like: cmds.cmds_untagged
+    :param class_name: like: CmdUntagged
+    :return: class
+    """
+    key = (module_name, class_name)
+    klass = LOADED_CLASSES.get(key)
+    if klass is None:
+        with import_profiler.profile_imports(module_name):
+            module = importlib.import_module(module_name)
+        klass = getattr(module, class_name)
+        LOADED_CLASSES[key] = klass
+    return klass
+
+
+# Star unit-test section. All test function must start with "test_..."
+
+def test_shortterm_import_footprint():
+    """
+    Import the shortterm entry point in a new python process, and check that it
+    doesn't load any command module or HEAVY_MODULES, and stays under
+    SHORTTERM_IMPORT_BUDGET_SEC.
+
+    Run from the slack_bud directory with: python -m cmds.cmd_registry
+    :return: True if the test passes.
+    """
+    script = ('import json, sys, time\n'
+              'start = time.time()\n'
+              'import lambda_function\n'
+              'sys.stdout.write("\\n" + json.dumps({"sec": time.time() - start, "modules": list(sys.modules)}))\n')
+    slack_bud_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    output = subprocess.check_output([sys.executable, '-c', script], cwd=slack_bud_dir)
+    result = json.loads(output.decode('utf-8').strip().split('\n')[-1])
+
+    loaded = set(result['modules'])
+    cmd_modules = sorted(m for m in loaded if m.startswith('cmds.cmds_'))
+    heavy_modules = sorted(m for m in HEAVY_MODULES if m in loaded)
+    print('lambda_function imports: {} sec. {} modules'.format(round(result['sec'], 4), len(loaded)))
+
+    assert not cmd_modules, 'lambda_function imported command modules: {}'.format(cmd_modules)
+    assert not heavy_modules, 'lambda_function imported: {}'.format(heavy_modules)
+    assert result['sec'] < SHORTTERM_IMPORT_BUDGET_SEC, \
+        'lambda_function imports took {} sec. Budget is {} sec.'.format(result['sec'], SHORTTERM_IMPORT_BUDGET_SEC)
+    return True
+
+
+def test_registry_classes():
+    """
+    Every command in the registry has a module and class, named like the other commands.
+    :return: True if the test passes.
+    """
+    cmds_dir = os.path.dirname(os.path.abspath(__file__))
+    for command, (module_name, class_name) in COMMANDS.items():
+        assert module_name == 'cmds.cmds_{}'.format(command), module_name
+        assert os.path.isfile(os.path.join(cmds_dir, 'cmds_{}.py'.format(command))), module_name
+        assert class_name.startswith('Cmd'), class_name
+    assert len(TASKS) == len(COMMANDS)
+    return True
+
+
+if __name__ == '__main__':
+    test_registry_classes()
+    test_shortterm_import_footprint()
+    print('cmd_registry tests passed.')
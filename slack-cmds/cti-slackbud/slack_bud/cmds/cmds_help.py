@@ -11,6 +11,7 @@ import util.aws_util as aws_util
 import util.bud_helper_util as bud_helper_util
 from cmd_interface import CmdInterface
 from cmd_inputs import CmdInputs
+import cmd_registry
 
 
 class CmdHelp(CmdInterface):
@@ -231,11 +232,8 @@ def import_class_from_name(import_class_package):
     :return: class
     """
     print('import_class_package={}'.format(import_class_package))
-    components = import_class_package.split('.')
-    mod = __import__(components[0])
-    for comp in components[1:]:
-        mod = getattr(mod, comp)
-    return mod
+    module_name, class_name = import_class_package.rsplit('.', 1)
+    return cmd_registry.load_class(module_name, class_name)
 
 
 # End static helper methods
@@ -7,6 +7,7 @@ import operator
 from util.slack_ui_util import ShowSlackError
 import util.bud_helper_util as bud_helper_util
 import util.groups as groups
+import util.auth_cache as auth_cache
 from cmd_interface import CmdInterface
 
 DYNAMODB = boto3.resource('dynamodb')
@@ -122,7 +123,8 @@ class CmdUser(CmdInterface):
             )
 
             # invalidate the user table cache. For reload on next use.
-            USER_TABLE_CACHE = {}
+            USER_TABLE_CACHE.clear()
+            auth_cache.invalidate_bud_user(userid)
 
             # append some useful command for the user to see.
             text += '\n\nSome useful commands:'
@@ -375,7 +377,8 @@ class CmdUser(CmdInterface):
             )
 
             # invalidate the user table cache. For reload on next use.
-            USER_TABLE_CACHE = {}
+            USER_TABLE_CACHE.clear()
+            auth_cache.invalidate_bud_user(userid)
             # Standard response below. Change title and text for output.
             return self.slack_ui_standard_response(title, text)
         except ShowSlackError:
@@ -739,6 +742,13 @@ class CmdUser(CmdInterface):
                 'user_name': user_name
             }
 
+        elif sub_command == 'addgroup' or sub_command == 'removegroup':
+            # These run in the longtask lambda, but authenticate_request reads the
+            # auth_cache here in the shorttask lambda. Clear this container's users.
+            if cmd_inputs.get_where_am_i() == 'shorttask':
+                auth_cache.invalidate_bud_user()
+            cmd_specific_data = {}
+
         else:
             cmd_specific_data = {}
 
@@ -869,6 +879,9 @@ def modify_user_entry(curr_user, operation, group_name):
                 'group': new_groups
             }
         )
+        # Only clears the cache of this (longtask) container. See build_cmd_specific_data
+        # for the shorttask container that authenticates the next command.
+        auth_cache.invalidate_bud_user(user_id)
 
         return result
 
@@ -1,36 +1,15 @@
 """Entry point for all slack calls"""
-import json
-from urlparse import parse_qs
-from cmds.cmd_inputs import CmdInputs
-from cmds.cmds_version import CmdVersion
-from cmds.cmds_help import CmdHelp
-from cmds.cmds_untagged import CmdUntagged
-from cmds.cmds_user import CmdUser
-from cmds.cmds_cmd import CmdCmd
-from cmds.cmds_spend import CmdSpend
-from cmds.cmds_farm import CmdFarm
-from cmds.cmds_apps_flamegraph import CmdApps_Flamegraph
-from cmds.cmds_jupyter import CmdJupyter
-from cmds.cmds_awslogin import CmdAwslogin
-from cmds.cmds_flamegraph import CmdFlamegraph
-from cmds.cmds_dsnacpu import CmdDsnacpu
-from cmds.cmds_s3stats import CmdS3Stats
-from cmds.cmds_rtbproto import CmdRtbproto
-from cmds.cmds_ri import CmdRi
-from cmds.cmds_ri import CmdRi
-from cmds.cmds_uxeng import CmdUxeng
-from cmds.cmds_cost import CmdCost
-from cmds.cmds_p4 import CmdP4
-from cmds.cmds_unity import CmdUnity
-from cmds.cmds_awsinfo import CmdAwsinfo
-from cmds.cmds_ebs import CmdEbs
-from cmds.cmds_patch import CmdPatch
-from cmds.cmds_uitests import CmdUitests
-# {cmdimportline}
-import util.bud_helper_util as bud_helper_util
-import util.slack_ui_util as slack_ui_util
-from util.slack_ui_util import ShowSlackError
-from util.bud_helper_util import BudHelperError
+import util.import_profiler as import_profiler
+with import_profiler.profile_imports('lambda_function'):
+    import json
+    from urlparse import parse_qs
+    from cmds.cmd_inputs import CmdInputs
+    import cmds.cmd_registry as cmd_registry
+    import util.bud_helper_util as bud_helper_util
+    import util.slack_ui_util as slack_ui_util
+    import util.async_writer as async_writer
+    from util.slack_ui_util import ShowSlackError
+    from util.bud_helper_util import BudHelperError
 
 # for panda 0.23 warnings about numpy
 import warnings
@@ -74,60 +53,12 @@ def lambda_handler(event, context):
         command = cmd_inputs.get_command()
         print('REFACTORING: command={}'.format(command))
 
-        # Create the Cmd class.
-        cmd_class = None
-        if command == 'version':
-            cmd_class = CmdVersion(cmd_inputs)
-        elif command == 'help':
-            cmd_class = CmdHelp(cmd_inputs)
-        elif command == 'untagged':
-            cmd_class = CmdUntagged(cmd_inputs)
-        elif command == 'user':
-            cmd_class = CmdUser(cmd_inputs)
-        elif command == 'cmd':
-            cmd_class = CmdCmd(cmd_inputs)
-        elif command == 'spend':
-            cmd_class = CmdSpend(cmd_inputs)
-        elif command == 'farm':
-            cmd_class = CmdFarm(cmd_inputs)
-        elif command == 'apps_flamegraph':
-            cmd_class = CmdApps_Flamegraph(cmd_inputs)
-        elif command == 'jupyter':
-            cmd_class = CmdJupyter(cmd_inputs)
-        elif command == 'awslogin':
-            cmd_class = CmdAwslogin(cmd_inputs)
-        elif command == 'flamegraph':
-            cmd_class = CmdFlamegraph(cmd_inputs)
-        elif command == 'dsnacpu':
-            cmd_class = CmdDsnacpu(cmd_inputs)
-        elif command == 's3stats':
-            cmd_class = CmdS3Stats(cmd_inputs)
-        elif command == 'rtbproto':
-            cmd_class = CmdRtbproto(cmd_inputs)
-        elif command == 'ri':
-            cmd_class = CmdRi(cmd_inputs)
-        elif command == 'ri':
-            cmd_class = CmdRi(cmd_inputs)
-        elif command == 'uxeng':
-            cmd_class = CmdUxeng(cmd_inputs)
-        elif command == 'cost':
-            cmd_class = CmdCost(cmd_inputs)
-        elif command == 'p4':
-            cmd_class = CmdP4(cmd_inputs)
-        elif command == 'unity':
-            cmd_class = CmdUnity(cmd_inputs)
-        elif command == 'awsinfo':
-            cmd_class = CmdAwsinfo(cmd_inputs)
-        elif command == 'ebs':
-            cmd_class = CmdEbs(cmd_inputs)
-        elif command == 'patch':
-            cmd_class = CmdPatch(cmd_inputs)
-        elif command == 'uitests':
-            cmd_class = CmdUitests(cmd_inputs)
-# {cmdswitchline}
-        else:
+        # Create the Cmd class. Only its module is imported.
+        cmd_class_type = cmd_registry.get_cmd_class(command)
+        if not cmd_class_type:
             err_msg = "The command '{}' is invalid. Please enter a valid command...".format(command)
             return slack_ui_util.error_response(err_msg)
+        cmd_class = cmd_class_type(cmd_inputs)
 
         cmd_class.authenticate_request(params)
         cmd_class.parse_inputs()
@@ -145,6 +76,10 @@ def lambda_handler(event, context):
         slack_error_message = 'An error occurred. Please check logs.'
         return slack_ui_util.error_response(slack_error_message)
 
+    finally:
+        # Write the cmd history and session rows before the container is frozen.
+        async_writer.flush()
+
 
 def is_scheduled_event(event):
     """
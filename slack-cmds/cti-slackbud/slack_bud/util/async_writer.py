@@ -0,0 +1,190 @@
+"""
+Write DynamoDB rows on a background thread, so they don't add to the time
+Slack waits for a response.
+
+    async_writer.put_item(SLACK_CMD_TABLE.name, item)
+    ...
+    async_writer.flush()    # at the end of lambda_handler
+
+put_item only queues the row. A thread writes the queue with
+batch_write_item while the command runs, so rows for several tables go in
+one request. The lambda container is frozen once the handler returns, so
+lambda_handler calls flush() before it returns. By then the thread is
+normally done and flush() doesn't wait.
+
+Used for the command history and the session rows of confirmation
+commands. Write errors are logged, they don't fail the command.
+"""
+from __future__ import print_function
+
+import threading
+import time
+import boto3
+from botocore.exceptions import ClientError
+
+import util.bud_helper_util as bud_helper_util
+
+# batch_write_item limit.
+MAX_BATCH_ITEMS = 25
+MAX_UNPROCESSED_RETRIES = 3
+FLUSH_TIMEOUT_SEC = 2.0
+
+# list of (table name, item) not yet taken by the writer thread.
+PENDING_WRITES = []
+PENDING_LOCK = threading.Lock()
+WRITER_THREAD = None
+
+# Timing of the current invocation, logged and reset by flush()
+WRITE_STATS = {'items': 0, 'requests': 0, 'write_ms': 0}
+
+# Created on the calling thread, since creating a boto3 resource isn't thread-safe.
+DYNAMODB = None
+
+
+def put_item(table_name, item):
+    """
+    Queue a row, and start the writer thread if it isn't running.
+    :param table_name: like: SlackBudCmds
+    :param item: dict of python values, like for Table.put_item. No floats.
+    :return: None
+    """
+    global WRITER_THREAD, DYNAMODB
+    if DYNAMODB is None:
+        DYNAMODB = boto3.resource('dynamodb')
+
+    with PENDING_LOCK:
+        PENDING_WRITES.append((table_name, item))
+        if WRITER_THREAD is None:
+            WRITER_THREAD = threading.Thread(target=write_pending, name='async_writer')
+            WRITER_THREAD.daemon = True
+            WRITER_THREAD.start()
+
+
+def flush(timeout_sec=FLUSH_TIMEOUT_SEC):
+    """
+    Wait for the queued rows to be written. Call before the lambda handler returns.
+    :param timeout_sec: rows not written by then stay queued for the next invocation.
+    :return: number of rows still queued.
+    """
+    start = time.time()
+    thread = WRITER_THREAD
+    if thread is not None:
+        thread.join(timeout_sec)
+    wait_ms = int((time.time() - start) * 1000)
+
+    with PENDING_LOCK:
+        num_pending = len(PENDING_WRITES)
+        if WRITER_THREAD is not None:
+            num_pending += 1
+
+    if WRITE_STATS['items'] or num_pending:
+        # write_ms - wait_ms is the time taken off the response.
+        print('TIMER async_writer: {} items in {} requests took {} ms. flush waited {} ms'.format(
+            WRITE_STATS['items'], WRITE_STATS['requests'], WRITE_STATS['write_ms'], wait_ms))
+    if num_pending:
+        print('WARN: async_writer flush timed out. Still writing.')
+    WRITE_STATS.update(items=0, requests=0, write_ms=0)
+    return num_pending
+
+
+def write_pending():
+    """
+    Writer thread. Writes the queue until it is empty.
+    :return: None
+    """
+    global WRITER_THREAD
+    while True:
+        with PENDING_LOCK:
+            if not PENDING_WRITES:
+                WRITER_THREAD = None
+                return
+            writes = PENDING_WRITES[:]
+            del PENDING_WRITES[:]
+
+        start = time.time()
+        try:
+            for i in range(0, len(writes), MAX_BATCH_ITEMS):
+                write_batch(writes[i:i + MAX_BATCH_ITEMS])
+        except Exception as ex:
+            # Log the error, but don't stop the command.
+            bud_helper_util.log_traceback_exception(ex)
+        WRITE_STATS['items'] += len(writes)
+        WRITE_STATS['write_ms'] += int((time.time() - start) * 1000)
+
+
+def write_batch(writes):
+    """
+    One batch_write_item, retrying UnprocessedItems.
+    :param writes: list of (table name, item), at most MAX_BATCH_ITEMS.
+    :return: None
+    """
+    request_items = {}
+    for table_name, item in writes:
+        request_items.setdefault(table_name, []).append({'PutRequest': {'Item': item}})
+
+    try:
+        for attempt in range(MAX_UNPROCESSED_RETRIES + 1):
+            if attempt:
+                time.sleep(0.05 * 2 ** attempt)
+            response = DYNAMODB.batch_write_item(RequestItems=request_items)
+            WRITE_STATS['requests'] += 1
+            request_items = response.get('UnprocessedItems')
+            if not request_items:
+                return
+        print('ERROR: async_writer gave up on unprocessed items: {}'.format(request_items))
+    except ClientError as ce:
+        if ce.response['Error']['Code'] != 'ValidationException':
+            raise
+        # Like two rows with the same key in one batch. Write them one at a time.
+        print('WARN: batch_write_item failed, writing items one at a time. Reason: {}'.format(ce))
+        for table_name, item in writes:
+            DYNAMODB.Table(table_name).put_item(Item=item)
+            WRITE_STATS['requests'] += 1
+
+
+# Star unit-test section. All test function must start with "test_..."
+
+class _FakeDynamoDB(object):
+    """
+    Stands in for the dynamodb resource. The first response has one unprocessed item.
+    """
+    def __init__(self):
+        self.requests = []
+
+    def batch_write_item(self, RequestItems):
+        self.requests.append(RequestItems)
+        if len(self.requests) == 1:
+            table_name = sorted(RequestItems.keys())[0]
+            return {'UnprocessedItems': {table_name: RequestItems[table_name][:1]}}
+        return {'UnprocessedItems': {}}
+
+
+def test_batched_writes():
+    """
+    Rows for two tables go in one request, and unprocessed items are retried.
+    :return: True if the test passes.
+    """
+    global DYNAMODB
+    saved = DYNAMODB
+    DYNAMODB = _FakeDynamoDB()
+    try:
+        with PENDING_LOCK:
+            # Hold the lock so the writer thread sees all the rows at once.
+            PENDING_WRITES.append(('SlackBudCmds', {'userid': 'U1', 'timestamp': '1'}))
+            PENDING_WRITES.append(('SlackBudSession', {'slackBudSessionId': '2'}))
+        put_item('SlackBudCmds', {'userid': 'U1', 'timestamp': '3'})
+        assert flush() == 0
+
+        requests = DYNAMODB.requests
+        assert len(requests) == 2, requests
+        assert len(requests[0]['SlackBudCmds']) == 2
+        assert len(requests[0]['SlackBudSession']) == 1
+        assert requests[1] == {'SlackBudCmds': [{'PutRequest': {'Item': {'userid': 'U1', 'timestamp': '1'}}}]}
+    finally:
+        DYNAMODB = saved
+    return True
+
+
+if __name__ == '__main__':
+    test_batched_writes()
+    print('async_writer tests passed.')
@@ -0,0 +1,254 @@
+"""
+Cache of the data used to authenticate each slash command.
+
+authenticate_request needs the Slack token from SSM and the user's
+SlackBudUsers row. Both change rarely, so they are kept in module level
+dicts, which last as long as a warm lambda container.
+
+    ssm_token = auth_cache.get_ssm_parameter('bud_prod_slack_token')
+    slack_user = auth_cache.get_bud_user(BUD_USERS_TABLE, user_id)
+
+Users that aren't in the table are cached too, for a shorter time, so a
+stranger running /run over and over doesn't cost a DynamoDB read each time.
+
+CmdUser calls invalidate_bud_user after it changes the table. That only
+clears this container's cache, other warm containers see the change when
+their entry expires, so BUD_USER_TTL_SEC is the longest a removed user or
+group can still be used. addgroup and removegroup change the table in the
+longtask lambda, which doesn't authenticate commands, so the shorttask
+container that dispatches them clears its cache before the longtask runs.
+
+A cached parameter can be re-read early with refresh=True, like after a token
+mismatch, but at most once per SSM_REFRESH_MIN_INTERVAL_SEC, so bad tokens
+don't each cost an SSM read. If SSM fails, like when throttled, the cached
+value is kept.
+"""
+from __future__ import print_function
+
+import time
+import boto3
+
+SSM_PARAMETER_TTL_SEC = 5 * 60
+BUD_USER_TTL_SEC = 60
+UNKNOWN_USER_TTL_SEC = 15
+
+# Least time between SSM reads of a cached parameter, for refresh=True.
+SSM_REFRESH_MIN_INTERVAL_SEC = 30
+
+# Value get_ssm_parameter returns for a missing parameter, like aws_util.get_ssm_parameter
+SSM_PARAMETER_NOT_FOUND = 'none'
+
+# parameter name -> (value, expire time, time read from SSM)
+SSM_PARAMETER_CACHE = {}
+
+# userid -> (SlackBudUsers item or None, expire time)
+BUD_USER_CACHE = {}
+BUD_USER_CACHE_MAX_ENTRIES = 5000
+
+# Created on first use, and kept for the life of the container.
+SSM_CLIENT = None
+
+
+def get_ssm_parameter(param_name, refresh=False):
+    """
+    Decrypted value of an SSM parameter, cached for SSM_PARAMETER_TTL_SEC.
+    :param param_name: like: bud_prod_slack_token
+    :param refresh: True to read SSM even if the value is cached. Ignored if the value
+        was read within SSM_REFRESH_MIN_INTERVAL_SEC.
+    :return: value, or SSM_PARAMETER_NOT_FOUND if there is no such parameter.
+    """
+    now = time.time()
+    cached = SSM_PARAMETER_CACHE.get(param_name)
+    if cached:
+        if refresh and now - cached[2] < SSM_REFRESH_MIN_INTERVAL_SEC:
+            print('ssm {} read {} sec ago. Not refreshed.'.format(param_name, int(now - cached[2])))
+            return cached[0]
+        if not refresh and cached[1] > now:
+            return cached[0]
+
+    global SSM_CLIENT
+    if SSM_CLIENT is None:
+        SSM_CLIENT = boto3.client('ssm')
+    start = time.time()
+    try:
+        response = SSM_CLIENT.get_parameter(Name=param_name, WithDecryption=True)
+        value = response['Parameter']['Value']
+    except SSM_CLIENT.exceptions.ParameterNotFound:
+        print('no ssm parameter found named: {}'.format(param_name))
+        value = SSM_PARAMETER_NOT_FOUND
+    except Exception as ex:
+        if not cached:
+            raise
+        # Like throttling. Keep the value we have, and try again after the interval.
+        print('WARN: ssm get_parameter {} failed, using cached value. Reason: {}'.format(param_name, ex))
+        SSM_PARAMETER_CACHE[param_name] = (cached[0], cached[1], now)
+        return cached[0]
+    print('TIMER ssm get_parameter {}: {} ms'.format(param_name, int((time.time() - start) * 1000)))
+
+    SSM_PARAMETER_CACHE[param_name] = (value, now + SSM_PARAMETER_TTL_SEC, now)
+    return value
+
+
+def get_bud_user(table, user_id):
+    """
+    SlackBudUsers row for a user. Found users are cached for BUD_USER_TTL_SEC,
+    unknown users for UNKNOWN_USER_TTL_SEC.
+    :param table: boto3 dynamodb Table for SlackBudUsers
+    :param user_id: slack userid like: U1RGUPMHA
+    :return: item dict, or None if the user isn't in the table.
+    """
+    now = time.time()
+    cached = BUD_USER_CACHE.get(user_id)
+    if cached and cached[1] > now:
+        print('BudUser cache hit: {}'.format(user_id))
+        return cached[0]
+
+    start = time.time()
+    response = table.get_item(
+        Key={
+            'userid': user_id,
+        }
+    )
+    item = response.get('Item')
+    print('TIMER BudUsers get_item {}: {} ms'.format(user_id, int((time.time() - start) * 1000)))
+
+    if len(BUD_USER_CACHE) >= BUD_USER_CACHE_MAX_ENTRIES:
+        BUD_USER_CACHE.clear()
+    ttl = BUD_USER_TTL_SEC if item else UNKNOWN_USER_TTL_SEC
+    BUD_USER_CACHE[user_id] = (item, now + ttl)
+    return item
+
+
+def invalidate_bud_user(user_id=None):
+    """
+    Drop a user from the cache, after the SlackBudUsers row is changed.
+    :param user_id: slack userid, or None to drop all users.
+    :return: None
+    """
+    if user_id is None:
+        BUD_USER_CACHE.clear()
+    else:
+        BUD_USER_CACHE.pop(user_id, None)
+
+
+def invalidate_ssm_parameter(param_name=None):
+    """
+    :param param_name: or None to drop all parameters.
+    :return: None
+    """
+    if param_name is None:
+        SSM_PARAMETER_CACHE.clear()
+    else:
+        SSM_PARAMETER_CACHE.pop(param_name, None)
+
+
+# Star unit-test section. All test function must start with "test_..."
+
+class _FakeSSMClient(object):
+    """
+    Stands in for the ssm client, and counts the reads.
+    """
+    class exceptions(object):
+        class ParameterNotFound(Exception):
+            pass
+
+    def __init__(self, value):
+        self.value = value
+        self.reads = 0
+        self.fail = False
+
+    def get_parameter(self, Name, WithDecryption):
+        self.reads += 1
+        if self.fail:
+            raise Exception('ThrottlingException')
+        return {'Parameter': {'Value': self.value}}
+
+
+class _CountingTable(object):
+    """
+    Stands in for the SlackBudUsers Table, and counts the reads.
+    """
+    def __init__(self, items):
+        self.items = items
+        self.reads = 0
+
+    def get_item(self, Key):
+        self.reads += 1
+        item = self.items.get(Key['userid'])
+        return {'Item': item} if item else {}
+
+
+def test_bud_user_cache():
+    """
+    Users are read once per TTL, unknown users are cached, and invalidate forces a read.
+    :return: True if the test passes.
+    """
+    global UNKNOWN_USER_TTL_SEC
+    invalidate_bud_user()
+    table = _CountingTable({'U1': {'userid': 'U1', 'role': 'dev', 'group': 'bill'}})
+
+    assert get_bud_user(table, 'U1')['role'] == 'dev'
+    assert get_bud_user(table, 'U1')['role'] == 'dev'
+    assert table.reads == 1
+
+    assert get_bud_user(table, 'U2') is None
+    assert get_bud_user(table, 'U2') is None
+    assert table.reads == 2
+
+    table.items['U2'] = {'userid': 'U2', 'role': 'admin', 'group': 'bill'}
+    invalidate_bud_user('U2')
+    assert get_bud_user(table, 'U2')['role'] == 'admin'
+    assert table.reads == 3
+
+    saved_ttl = UNKNOWN_USER_TTL_SEC
+    UNKNOWN_USER_TTL_SEC = -1
+    try:
+        assert get_bud_user(table, 'U3') is None
+        assert get_bud_user(table, 'U3') is None
+        assert table.reads == 5
+    finally:
+        UNKNOWN_USER_TTL_SEC = saved_ttl
+        invalidate_bud_user()
+    return True
+
+
+def test_ssm_refresh_rate_limit():
+    """
+    refresh=True reads SSM at most once per SSM_REFRESH_MIN_INTERVAL_SEC, and a
+    failed read keeps the cached value.
+    :return: True if the test passes.
+    """
+    global SSM_CLIENT
+    saved = SSM_CLIENT
+    SSM_CLIENT = _FakeSSMClient('token-1')
+    invalidate_ssm_parameter('test_token')
+    try:
+        assert get_ssm_parameter('test_token') == 'token-1'
+        SSM_CLIENT.value = 'token-2'
+        for _ in range(10):
+            assert get_ssm_parameter('test_token', refresh=True) == 'token-1'
+        assert SSM_CLIENT.reads == 1
+
+        # Read long enough ago to refresh, then SSM is throttled.
+        value, expire, _ = SSM_PARAMETER_CACHE['test_token']
+        SSM_PARAMETER_CACHE['test_token'] = (value, expire, time.time() - SSM_REFRESH_MIN_INTERVAL_SEC)
+        SSM_CLIENT.fail = True
+        assert get_ssm_parameter('test_token', refresh=True) == 'token-1'
+        assert get_ssm_parameter('test_token', refresh=True) == 'token-1'
+        assert SSM_CLIENT.reads == 2
+
+        SSM_CLIENT.fail = False
+        value, expire, _ = SSM_PARAMETER_CACHE['test_token']
+        SSM_PARAMETER_CACHE['test_token'] = (value, expire, time.time() - SSM_REFRESH_MIN_INTERVAL_SEC)
+        assert get_ssm_parameter('test_token', refresh=True) == 'token-2'
+        assert SSM_CLIENT.reads == 3
+    finally:
+        SSM_CLIENT = saved
+        invalidate_ssm_parameter('test_token')
+    return True
+
+
+if __name__ == '__main__':
+    test_bud_user_cache()
+    test_ssm_refresh_rate_limit()
+    print('auth_cache tests passed.')
@@ -2,6 +2,7 @@
 from __future__ import print_function
 
 import json
+import threading
 import boto3
 import pendulum
 
@@ -23,6 +24,9 @@ AWS_REGIONS = [
     'ap-southeast-1',
     'ap-southeast-2']
 
+# boto3.client() and boto3.resource() use the default session, which isn't thread-safe.
+BOTO3_LOCK = threading.Lock()
+
 # DEPRECATED - Call AWS Account Info service
 ENVIRONMENTS = {
     'adeng-admin': '123456789012',  # dataxu-admin
@@ -100,21 +104,22 @@ def get_boto3_client_by_name(name, session, region):
     :return:
     """
     print('Getting boto3 client: {}'.format(name))
-    if region:
-        some_aws_client = boto3.client(
-            name,
-            aws_access_key_id=session['Credentials']['AccessKeyId'],
-            aws_secret_access_key=session['Credentials']['SecretAccessKey'],
-            aws_session_token=session['Credentials']['SessionToken'],
-            region_name=region
-        )
-    else:
-        some_aws_client = boto3.client(
-            name,
-            aws_access_key_id=session['Credentials']['AccessKeyId'],
-            aws_secret_access_key=session['Credentials']['SecretAccessKey'],
-            aws_session_token=session['Credentials']['SessionToken']
-        )
+    with BOTO3_LOCK:
+        if region:
+            some_aws_client = boto3.client(
+                name,
+                aws_access_key_id=session['Credentials']['AccessKeyId'],
+                aws_secret_access_key=session['Credentials']['SecretAccessKey'],
+                aws_session_token=session['Credentials']['SessionToken'],
+                region_name=region
+            )
+        else:
+            some_aws_client = boto3.client(
+                name,
+                aws_access_key_id=session['Credentials']['AccessKeyId'],
+                aws_secret_access_key=session['Credentials']['SecretAccessKey'],
+                aws_session_token=session['Credentials']['SessionToken']
+            )
     return some_aws_client
 
 
@@ -127,13 +132,14 @@ def get_boto3_resource_by_name(name, session, region):
     :return:
     """
     print('Getting boto3 resource: {}'.format(name))
-    some_aws_resource = boto3.resource(
-        name,
-        aws_access_key_id=session['Credentials']['AccessKeyId'],
-        aws_secret_access_key=session['Credentials']['SecretAccessKey'],
-        aws_session_token=session['Credentials']['SessionToken'],
-        region_name=region
-    )
+    with BOTO3_LOCK:
+        some_aws_resource = boto3.resource(
+            name,
+            aws_access_key_id=session['Credentials']['AccessKeyId'],
+            aws_secret_access_key=session['Credentials']['SecretAccessKey'],
+            aws_session_token=session['Credentials']['SessionToken'],
+            region_name=region
+        )
     return some_aws_resource
 
 
@@ -0,0 +1,80 @@
+"""
+Log how long imports take on a lambda cold start.
+
+    with import_profiler.profile_imports('lambda_function'):
+        import util.slack_ui_util as slack_ui_util
+        ...
+
+While profiling, __import__ is wrapped to time each import made directly in
+the block. The time of an import includes the modules it imports in turn.
+Modules that were already loaded cost nothing and aren't listed.
+"""
+from __future__ import print_function
+
+import sys
+import time
+from contextlib import contextmanager
+
+try:
+    import __builtin__ as builtins
+except ImportError:
+    import builtins
+
+# Only imports that took longer are logged one by one.
+LOG_MIN_SEC = 0.005
+
+# module name -> seconds, for every profiled import since the cold start.
+IMPORT_COSTS = {}
+
+
+@contextmanager
+def profile_imports(label):
+    """
+    Time the imports made in a with block, and log them at the end.
+    :param label: name for the log, like: lambda_function
+    :return: context manager
+    """
+    original_import = builtins.__import__
+    costs = []
+    depth = [0]
+
+    def timed_import(name, *args, **kwargs):
+        if depth[0] or name in sys.modules:
+            depth[0] += 1
+            try:
+                return original_import(name, *args, **kwargs)
+            finally:
+                depth[0] -= 1
+
+        depth[0] += 1
+        start = time.time()
+        try:
+            return original_import(name, *args, **kwargs)
+        finally:
+            depth[0] -= 1
+            costs.append((name, time.time() - start))
+
+    start = time.time()
+    num_modules = len(sys.modules)
+    builtins.__import__ = timed_import
+    try:
+        yield costs
+    finally:
+        builtins.__import__ = original_import
+        log_costs(label, costs, time.time() - start, len(sys.modules) - num_modules)
+
+
+def log_costs(label, costs, total_sec, num_new_modules):
+    """
+    :param label:
+    :param costs: list of (module name, seconds)
+    :param total_sec:
+    :param num_new_modules: modules added to sys.modules, including nested imports.
+    :return: None
+    """
+    for name, sec in costs:
+        IMPORT_COSTS[name] = IMPORT_COSTS.get(name, 0.0) + sec
+    print('TIMER imports {}: {} sec. {} new modules'.format(label, round(total_sec, 4), num_new_modules))
+    for name, sec in sorted(costs, key=lambda c: c[1], reverse=True):
+        if sec >= LOG_MIN_SEC:
+            print('  IMPORT {}: {} sec.'.format(name, round(sec, 4)))
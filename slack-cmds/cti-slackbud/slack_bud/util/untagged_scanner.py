@@ -0,0 +1,879 @@
+"""
+Run the untagged resource checks of CmdUntagged and CmdSpend at the same time.
+
+Each resource type, like ec2 or s3, is checked on its own thread, and all of
+them share one deadline. Types that don't finish by the deadline are left
+out of the report and listed as incomplete, so a report always comes back
+before the lambda time limit.
+
+    data_frame_dict, scans = untagged_scanner.scan_untagged_types(
+        'untagged_report', ['ec2', 's3'], untagged_scanner.get_untagged_scanners(),
+        session, region, tagging_client, summary_data_frame)
+
+The check_for_untagged_* functions of both commands are here. Only the EC2
+sheet differs, so each command passes its columns and row function to
+get_untagged_scanners. A check that raises is marked failed and listed as
+incomplete, instead of looking like a type with nothing untagged.
+
+S3 tags are read from several regions, get_tagged_arn_set_globally
+reads them at the same time too.
+
+Resources are listed with iter_resources, which follows every page and yields
+one resource at a time. The checks compare them to the set of tagged ARNs
+and keep only the untagged ones.
+"""
+from __future__ import print_function
+
+import functools
+import threading
+import time
+import traceback
+
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
+import pandas as pandas
+
+import util.aws_util as aws_util
+import util.bud_helper_util as bud_helper_util
+import util.cti_helper_util as cti_helper_util
+
+# Lambda has a 5 min limit. Leave time to write the report.
+SCAN_DEADLINE_SEC = 240
+MAX_TYPE_WORKERS = 10
+
+# Regions read by get_tagged_arn_set_globally
+GLOBAL_TAG_REGIONS = ['us-east-1', 'us-east-2', 'us-west-2', 'us-west-1', 'ap-southeast-2', 'eu-west-1']
+
+SCAN_PENDING = 'pending'
+SCAN_RUNNING = 'running'
+SCAN_DONE = 'done'
+SCAN_FAILED = 'failed'
+SCAN_TIMEOUT = 'timeout'
+
+# How often run_scans checks if the scans are done.
+POLL_INTERVAL_SEC = 0.1
+
+# Default columns of the EC2 sheet. See get_untagged_scanners
+EC2_COLUMNS = ['name', 'instance_id', 'cost-estimate', 'spend_category']
+
+
+class Scan(object):
+    """
+    One check on a scan thread, like the ec2 check, with its result and timing.
+    """
+    def __init__(self, label, func, args):
+        self.label = label
+        self.func = func
+        self.args = args
+        self.status = SCAN_PENDING
+        self.result = None
+        self.error = None
+        self.start_time = None
+        self.end_time = None
+
+    def get_duration(self):
+        """
+        :return: seconds the scan ran, or has been running. 0.0 if it didn't start.
+        """
+        if self.start_time is None:
+            return 0.0
+        end_time = self.end_time
+        if end_time is None:
+            end_time = time.time()
+        return end_time - self.start_time
+
+
+def run_scans(scan_name, scans, deadline=None, max_workers=MAX_TYPE_WORKERS):
+    """
+    Run scans on daemon threads until they finish or the deadline passes.
+    Scans still running at the deadline are marked SCAN_TIMEOUT and left
+    behind. Scans that didn't start stay SCAN_PENDING.
+    :param scan_name: name for the log, like: untagged_report
+    :param scans: list of Scan
+    :param deadline: time.time() value to stop waiting at, or None to wait for all.
+    :param max_workers:
+    :return: the list of scans.
+    """
+    start = time.time()
+    lock = threading.Lock()
+    stopped = [False]
+    work_queue = queue.Queue()
+    for scan in scans:
+        work_queue.put(scan)
+
+    def worker():
+        while True:
+            with lock:
+                if stopped[0]:
+                    return
+                try:
+                    scan = work_queue.get_nowait()
+                except queue.Empty:
+                    return
+                scan.status = SCAN_RUNNING
+                scan.start_time = time.time()
+            try:
+                result = scan.func(*scan.args)
+                status = SCAN_DONE
+            except Exception as ex:
+                print('ERROR: {} {} failed: {}'.format(scan_name, scan.label, ex))
+                print('Error traceback \n{}'.format(traceback.format_exc()))
+                result = None
+                status = SCAN_FAILED
+                scan.error = ex
+            with lock:
+                scan.end_time = time.time()
+                if scan.status == SCAN_TIMEOUT:
+                    print('WARN: {} {} finished after the deadline.'.format(scan_name, scan.label))
+                else:
+                    scan.status = status
+                    scan.result = result
+
+    for x in range(min(max_workers, len(scans))):
+        thread = threading.Thread(target=worker, name='{}-{}'.format(scan_name, x))
+        thread.daemon = True
+        thread.start()
+
+    while True:
+        with lock:
+            unfinished = [s for s in scans if s.status in (SCAN_PENDING, SCAN_RUNNING)]
+            if unfinished and deadline and time.time() > deadline:
+                stopped[0] = True
+                for scan in unfinished:
+                    if scan.status == SCAN_RUNNING:
+                        scan.status = SCAN_TIMEOUT
+                unfinished = []
+        if not unfinished:
+            break
+        time.sleep(POLL_INTERVAL_SEC)
+
+    for scan in sorted(scans, key=lambda s: s.get_duration(), reverse=True):
+        print('TIMER {} {}: {} sec. status={}'.format(scan_name, scan.label, round(scan.get_duration(), 3), scan.status))
+    print('TIMER {}: {} sec. (sum of scans {} sec.)'.format(
+        scan_name, round(time.time() - start, 3), round(sum(s.get_duration() for s in scans), 3)))
+    return scans
+
+
+def scan_untagged_types(scan_name, aws_type_list, scanners, session, region, tagging_client,
+                        summary_data_frame, deadline_sec=SCAN_DEADLINE_SEC):
+    """
+    Run the check_for_untagged_* function of each type at the same time.
+    :param scan_name: name for the log.
+    :param aws_type_list: like: ['cloudfront', 'ec2', 's3']
+    :param scanners: dict of type to check function, like: {'ec2': check_for_untagged_ec2_instances}
+    :param session: session to the AWS account.
+    :param region: AWS Region: us-east-1
+    :param tagging_client: boto3 client for reading tags
+    :param summary_data_frame: panda DataFrame. A row is added for each type, in aws_type_list order.
+    :param deadline_sec: seconds to wait for all the types.
+    :return: tuple (dict of type to panda DataFrame of untagged resources, list of Scan).
+    Types that failed, timed out or were empty aren't in the dict.
+    """
+    deadline = time.time() + deadline_sec
+    scans = []
+    for aws_type in aws_type_list:
+        aws_type = aws_type.strip()
+        scanner = scanners.get(aws_type)
+        if not scanner:
+            print('WARN: Unknown AWS type: {}. Types are: {}'.format(aws_type, sorted(scanners.keys())))
+            continue
+        # Each check adds its row to its own empty copy of the summary, so threads don't share one.
+        type_summary_data_frame = summary_data_frame.iloc[0:0].copy()
+        scans.append(Scan(aws_type, scanner, (session, region, tagging_client, type_summary_data_frame)))
+
+    run_scans(scan_name, scans, deadline=deadline)
+
+    data_frame_dict = {}
+    for scan in scans:
+        if scan.status == SCAN_DONE:
+            type_summary_data_frame = scan.args[3]
+            for row in type_summary_data_frame.values.tolist():
+                summary_data_frame.loc[len(summary_data_frame)] = row
+            data_frame = scan.result
+            if data_frame is not None and not data_frame.empty:
+                data_frame_dict[scan.label] = data_frame
+            else:
+                print('AWS type: {} was empty.'.format(scan.label))
+        else:
+            summary_data_frame.loc[len(summary_data_frame)] = [scan.label, round(scan.get_duration(), 3),
+                                                               scan.status, 'n/a']
+    return data_frame_dict, scans
+
+
+def get_incomplete_text(scans):
+    """
+    :param scans: from scan_untagged_types
+    :return: line for the report listing types that didn't finish, or '' if all did.
+    """
+    incomplete = ['{} ({})'.format(s.label, s.status) for s in scans if s.status != SCAN_DONE]
+    if not incomplete:
+        return ''
+    return 'Incomplete: {}\n'.format(', '.join(incomplete))
+
+
+def get_tagged_arn_set_globally(session, resource_type, regions=None):
+    """
+    S3 is a global-ish service and needs to be treated differently.
+    We need to get the tags for all the (likely) regions. Regions are read at the same time.
+    :param session:
+    :param resource_type: like: 's3'
+    :param regions: default GLOBAL_TAG_REGIONS
+    :return: set of tagged ARNs from all the regions. Raises RuntimeError if a region failed.
+    """
+    if regions is None:
+        regions = GLOBAL_TAG_REGIONS
+
+    def get_region_set(region):
+        tagging_client = aws_util.get_tagging_client(session, region)
+        return get_tagged_arn_set(tagging_client, resource_type)
+
+    scans = [Scan(region, get_region_set, (region,)) for region in regions]
+    run_scans('tagged_{}'.format(resource_type), scans, max_workers=len(regions))
+
+    incomplete_text = get_incomplete_text(scans)
+    if incomplete_text:
+        raise RuntimeError('Tags of {} not read. {}'.format(resource_type, incomplete_text.strip()))
+
+    arn_set = set()
+    counts = []
+    for scan in scans:
+        region_set = scan.result
+        arn_set.update(region_set)
+        counts.append('{} {}'.format(scan.label, len(region_set)))
+
+    print('{} found the following number of tagged items.\n{}'.format(resource_type, ', '.join(counts)))
+    return arn_set
+
+
+def get_tagged_arn_set(tagging_client, resource_type):
+    """
+    Use boto3 tagging client to get the ARNs of all resources that
+    have the Spend_Category tag.
+    Errors are raised, so the check fails instead of listing tagged resources as untagged.
+    :param tagging_client:
+    :param resource_type: sting like: 'dynamodb:table'
+    :return: set of ARNs
+    """
+    arn_set = set()
+    for resource in iter_resources(tagging_client, 'get_resources', 'ResourceTagMappingList',
+                                   TagFilters=[{'Key': 'Spend_Category'}],
+                                   ResourceTypeFilters=[resource_type]):
+        arn_set.add(resource['ResourceARN'])
+
+    return arn_set
+
+
+def iter_resources(client, operation_name, result_key, **kwargs):
+    """
+    Call a boto3 list or describe method for all pages, and yield the items one at a time.
+    Only one page is in memory at a time.
+    :param client: boto3 client
+    :param operation_name: like: 'describe_instances'
+    :param result_key: key of the list in each page like: 'Reservations', or a list of keys
+    for a nested list like: ['DistributionList', 'Items']
+    :param kwargs: arguments for the method.
+    :return: generator of items.
+    """
+    if not isinstance(result_key, list):
+        result_key = [result_key]
+
+    num_pages = 0
+    paginator = client.get_paginator(operation_name)
+    for page in paginator.paginate(**kwargs):
+        num_pages += 1
+        items = page
+        for key in result_key:
+            items = items.get(key) or {}
+        for item in items or []:
+            yield item
+
+    if num_pages > 1:
+        print('{}: {} pages'.format(operation_name, num_pages))
+
+
+def find_untagged(resource_ids, tagged_ids):
+    """
+    Stream resources and keep only the untagged ones.
+    :param resource_ids: iterable of all resource ids, like from iter_resources.
+    :param tagged_ids: set of the tagged ids, in the same form.
+    :return: tuple (set of untagged ids, total number of resources)
+    """
+    untagged = set()
+    total = 0
+    for resource_id in resource_ids:
+        total += 1
+        if resource_id not in tagged_ids:
+            untagged.add(resource_id)
+    return untagged, total
+
+
+def init_standard_data_frame():
+    """
+    Create the standard data_frame within all apps that use it.
+    :return: panda DataFrame object
+    """
+    data_frame = pandas.DataFrame(columns=['name', 'cost-estimate'])
+    return data_frame
+
+
+def init_summary_data_frame():
+    """
+    Create a data_frame specific for summary.
+    :return: panda DataFrame object
+    """
+    summary_type_data_frame = pandas.DataFrame(columns=['AWS Type', 'run-time', 'untagged instance', 'total instance'])
+    return summary_type_data_frame
+
+
+def append_summary_data(summary_data_frame, aws_type, run_time, untagged_resource_count, all_resource_count):
+    """
+    Appends a row to the summary page in Excel file in a standard way, since this is done in many places.
+    :param summary_data_frame: panda DataFrame that summarizes the information.
+    :param aws_type: String that is type of AWS resource like (rds, ec2, dynamo, ...)
+    :param run_time: float that is runtime in seconds.
+    :param untagged_resource_count:
+    :param all_resource_count:
+    :return:
+    """
+    # keep this in sync with init_summary_data_frame
+    summary_data_frame.loc[len(summary_data_frame)] = [aws_type, run_time, untagged_resource_count, all_resource_count]
+
+
+def make_untagged_data_frame(untagged_set, all_tagged_text):
+    """
+    Standard data_frame with one row per untagged resource.
+    :param untagged_set: from find_untagged
+    :param all_tagged_text: only row if nothing is untagged, like: 'All 12 S3 buckets tagged.'
+    :return: panda DataFrame object
+    """
+    data_frame = init_standard_data_frame()
+    if untagged_set:
+        for curr_name in sorted(untagged_set):
+            data_frame.loc[len(data_frame)] = [curr_name, 'n/a']
+    else:
+        data_frame.loc[0] = [all_tagged_text, 'n/a']
+    return data_frame
+
+
+def check_for_untagged_autoscaling_groups(session, region, tagging_client, summary_data_frame):
+    """
+    List all untagged AutoScaling Groups resources
+    and estimate percent tagged resource of this type.
+    :param session:  session to the AWS account.
+    :param region: AWS Region:  us-east-1
+    :param tagging_client: boto3 client for reading tags
+    :param summary_data_frame: panda DataFrame to store summary information
+    :return: panda DataFrame of untagged groups.
+    """
+    start_time = bud_helper_util.start_timer()
+
+    autoscaling_client = aws_util.get_boto3_client_by_name('autoscaling', session, region)
+    tagged_arn_set = get_tagged_arn_set(tagging_client, 'autoscaling:autoScalingGroup')
+
+    all_group_arns = (curr_group['AutoScalingGroupARN'] for curr_group in iter_resources(
+        autoscaling_client, 'describe_auto_scaling_groups', 'AutoScalingGroups'))
+    untagged_set, all_groups_len = find_untagged(all_group_arns, tagged_arn_set)
+    print('AutoScaling found {} untagged of {} total groups'.format(len(untagged_set), all_groups_len))
+
+    data_frame = make_untagged_data_frame(untagged_set, 'All {} Autoscaling groups tagged.\n'.format(all_groups_len))
+
+    run_time = bud_helper_util.delta_time(start_time)
+    append_summary_data(summary_data_frame, 'autoscaling', run_time, len(untagged_set), all_groups_len)
+
+    return data_frame
+
+
+def check_for_untagged_cloud_front_distributions(session, region, tagging_client, summary_data_frame):
+    """
+    List all untagged CloudFront Distributions resources
+    and estimate percent tagged resource of this type.
+    :param session:  session to the AWS account.
+    :param region: AWS Region:  us-east-1
+    :param tagging_client: boto3 client for reading tags
+    :param summary_data_frame: panda DataFrame to store summary information
+    :return: panda DataFrame of untagged distributions.
+    """
+    start_time = bud_helper_util.start_timer()
+
+    cfront_client = aws_util.get_boto3_client_by_name('cloudfront', session, region)
+    tagged_arn_set = get_tagged_arn_set(tagging_client, 'cloudfront:distribution')
+
+    all_cf_distro_arns = (curr_cfront_distro['ARN'] for curr_cfront_distro in iter_resources(
+        cfront_client, 'list_distributions', ['DistributionList', 'Items']))
+    untagged_set, all_cf_distros_len = find_untagged(all_cf_distro_arns, tagged_arn_set)
+    print('CloudFront found {} untagged of {} total distributions'.format(len(untagged_set), all_cf_distros_len))
+
+    data_frame = make_untagged_data_frame(
+        untagged_set, 'All {} CloudFront distributions tagged.\n'.format(all_cf_distros_len))
+
+    run_time = bud_helper_util.delta_time(start_time)
+    append_summary_data(summary_data_frame, 'cloudfront', run_time, len(untagged_set), all_cf_distros_len)
+
+    return data_frame
+
+
+def check_for_untagged_dynamo_tables(session, region, tagging_client, summary_data_frame):
+    """
+    List all untagged DynamoDB table resources
+    and estimate percent tagged resource of this type.
+    :param session:  session to the AWS account.
+    :param region: AWS Region:  us-east-1
+    :param tagging_client: boto3 client for reading tags
+    :param summary_data_frame: panda DataFrame to store summary information
+    :return: panda DataFrame of untagged tables.
+    """
+    start_time = bud_helper_util.start_timer()
+
+    dynamodb = aws_util.get_dynamo_resource(session, region, client=True)
+    tagged_arn_set = set(normalize_arn_list(get_tagged_arn_set(tagging_client, 'dynamodb:table')))
+
+    untagged_set, table_names_len = find_untagged(
+        iter_resources(dynamodb, 'list_tables', 'TableNames'), tagged_arn_set)
+    print('Dynamo found {} untagged of {} total tables'.format(len(untagged_set), table_names_len))
+
+    data_frame = make_untagged_data_frame(untagged_set, 'All {} DynamoDB tables tagged.\n'.format(table_names_len))
+
+    run_time = bud_helper_util.delta_time(start_time)
+    append_summary_data(summary_data_frame, 'dynamo', run_time, len(untagged_set), table_names_len)
+
+    return data_frame
+
+
+def make_default_ec2_row(instance, tags, name_value, spend_category_tag):
+    """
+    Default row of the EC2 sheet, for EC2_COLUMNS
+    :param instance: from describe_instances
+    :param tags: the instance's tags. Empty list if it has none.
+    :param name_value: Name tag, or the instance id if it has none.
+    :param spend_category_tag: '' or 'unknown'
+    :return: list
+    """
+    return [name_value, instance['InstanceId'], instance['InstanceType'], spend_category_tag]
+
+
+def check_for_untagged_ec2_instances(session, region, tagging_client, summary_data_frame,
+                                     ec2_columns=EC2_COLUMNS, make_ec2_row=make_default_ec2_row, tag_counter=None):
+    """
+    List all EC2 Instances without a Spend_Category tag, or with a value of unknown,
+    and estimate percent tagged resource of this type.
+    :param session:  session to the AWS account.
+    :param region: AWS Region:  us-east-1
+    :param tagging_client: not used. describe_instances already has the tags.
+    :param summary_data_frame: panda DataFrame to store summary information
+    :param ec2_columns: columns of the returned DataFrame.
+    :param make_ec2_row: function(instance, tags, name_value, spend_category_tag) that returns a row.
+    :param tag_counter: TagCounter to count the Spend_Category values, or None.
+    :return: panda DataFrame of untagged instances.
+    """
+    start_time = bud_helper_util.start_timer()
+
+    spend_category_set = set([])
+    ec2_client = aws_util.get_ec2_resource(session, region, client=True)
+    all_ec2_instance_len = 0
+    tagged_len = 0
+    untagged_rows = []
+    for reservation in iter_resources(ec2_client, 'describe_instances', 'Reservations'):
+        for instance in reservation["Instances"]:
+            all_ec2_instance_len += 1
+            tags = instance.get('Tags') or []
+            name_value = cti_helper_util.get_tag_value_from_list(tags, 'Name')
+            if not name_value:
+                name_value = instance['InstanceId']
+
+            spend_category_tag = cti_helper_util.get_tag_value_from_list(tags, 'Spend_Category')
+            if not spend_category_tag:
+                spend_category_tag = ''
+            else:
+                tagged_len += 1
+
+            spend_category_set.add(spend_category_tag)
+            if tag_counter is not None:
+                tag_counter.increment(spend_category_tag)
+
+            # List any EC2 Instances without a Spend_Category tag or a value of unknown.
+            if spend_category_tag == '' or spend_category_tag.lower() == 'unknown':
+                untagged_rows.append(make_ec2_row(instance, tags, name_value, spend_category_tag))
+
+    ec2_type_data_frame = pandas.DataFrame(untagged_rows, columns=ec2_columns)
+
+    untagged_len = all_ec2_instance_len - tagged_len
+    print('EC2 found {} tagged of {} total instances\nSpend_Category values: {}'.format(
+        tagged_len, all_ec2_instance_len, sorted(spend_category_set)))
+
+    run_time = bud_helper_util.delta_time(start_time)
+    append_summary_data(summary_data_frame, 'ec2', run_time, untagged_len, all_ec2_instance_len)
+
+    return ec2_type_data_frame
+
+
+def check_for_untagged_elasticache_replication_groups(session, region, tagging_client, summary_data_frame):
+    """
+    List all untagged ElastiCache Clusters resources
+    and estimate percent tagged resource of this type.
+    :param session:  session to the AWS account.
+    :param region: AWS Region:  us-east-1
+    :param tagging_client: boto3 client for reading tags
+    :param summary_data_frame: panda DataFrame to store summary information
+    :return: panda DataFrame of untagged replication groups.
+    """
+    start_time = bud_helper_util.start_timer()
+
+    elasticache_client = aws_util.get_boto3_client_by_name('elasticache', session, region)
+    tagged_arn_set = get_tagged_arn_set(tagging_client, 'elasticache:cluster')
+    normalized_arn_set = set(normalize_elasticache_list(tagged_arn_set))
+
+    all_rep_group_ids = (curr_rep_group['ReplicationGroupId'] for curr_rep_group in iter_resources(
+        elasticache_client, 'describe_replication_groups', 'ReplicationGroups'))
+    untagged_set, total_rep_groups = find_untagged(all_rep_group_ids, normalized_arn_set)
+    print(write_untagged_items(untagged_set, total_rep_groups, 'ElastiCache Groups'))
+
+    data_frame = make_untagged_data_frame(
+        untagged_set, 'All {} ElastiCache Groups tagged.\n'.format(total_rep_groups))
+
+    run_time = bud_helper_util.delta_time(start_time)
+    append_summary_data(summary_data_frame, 'elasticache', run_time, len(untagged_set), total_rep_groups)
+
+    return data_frame
+
+
+def check_for_untagged_load_balancers(session, region, tagging_client, summary_data_frame):
+    """
+    List all untagged Load Balancers resources
+    and estimate percent tagged resource of this type.
+    :param session:  session to the AWS account.
+    :param region: AWS Region:  us-east-1
+    :param tagging_client: boto3 client for reading tags
+    :param summary_data_frame: panda DataFrame to store summary information
+    :return: panda DataFrame of untagged load balancers.
+    """
+    start_time = bud_helper_util.start_timer()
+
+    elb_client = aws_util.get_boto3_client_by_name('elb', session, region)
+    tagged_arn_set = set(normalize_arn_list(get_tagged_arn_set(tagging_client, 'elasticloadbalancing:loadbalancer')))
+
+    all_lb_names = (curr_load_balancer['LoadBalancerName'] for curr_load_balancer in iter_resources(
+        elb_client, 'describe_load_balancers', 'LoadBalancerDescriptions'))
+    untagged_set, total_lb_count = find_untagged(all_lb_names, tagged_arn_set)
+    print('Found {} untagged of {} total (classic)ELB'.format(len(untagged_set), total_lb_count))
+
+    data_frame = make_untagged_data_frame(untagged_set, 'All {} ELBs (classic) tagged.\n'.format(total_lb_count))
+
+    run_time = bud_helper_util.delta_time(start_time)
+    append_summary_data(summary_data_frame, 'elb', run_time, len(untagged_set), total_lb_count)
+
+    return data_frame
+
+
+def check_for_untagged_log_groups(session, region, tagging_client, summary_data_frame):
+    """
+    List all untagged Log Groups
+    :param session:  session to the AWS account.
+    :param region: AWS Region:  us-east-1
+    :param tagging_client: boto3 client for reading tags
+    :param summary_data_frame: panda DataFrame to store summary information
+    :return: panda DataFrame of untagged log groups.
+    """
+    start_time = bud_helper_util.start_timer()
+
+    log_client = aws_util.get_boto3_client_by_name('logs', session, region)
+    arn_set = get_tagged_arn_set(tagging_client, 'logs:log-group')
+
+    # Note we don't need to normalize this list since we seem to have the ARN.
+    log_group_arns = (curr_log_group['arn'] for curr_log_group in iter_resources(
+        log_client, 'describe_log_groups', 'logGroups'))
+    untagged_set, total_log_groups = find_untagged(log_group_arns, arn_set)
+    print('Found {} untagged of {} total log groups'.format(len(untagged_set), total_log_groups))
+
+    data_frame = make_untagged_data_frame(untagged_set, 'All {} Log Groups tagged.\n'.format(total_log_groups))
+
+    run_time = bud_helper_util.delta_time(start_time)
+    append_summary_data(summary_data_frame, 'logs', run_time, len(untagged_set), total_log_groups)
+
+    return data_frame
+
+
+def check_for_untagged_rds_instances(session, region, tagging_client, summary_data_frame):
+    """
+    Count the tagged RDS Instances. Untagged ones aren't listed yet.
+    :param session:  session to the AWS account.
+    :param region: AWS Region:  us-east-1
+    :param tagging_client: boto3 client for reading tags
+    :param summary_data_frame: panda DataFrame to store summary information
+    :return: empty panda DataFrame
+    """
+    print('RDS found {} tagged Instances'.format(len(get_tagged_arn_set(tagging_client, 'rds:db'))))
+    return init_standard_data_frame()
+
+
+def check_for_untagged_rds_groups(session, region, tagging_client, summary_data_frame):
+    """
+    Count the tagged RDS Clusters. Untagged ones aren't listed yet.
+    :param session:  session to the AWS account.
+    :param region: AWS Region:  us-east-1
+    :param tagging_client: boto3 client for reading tags
+    :param summary_data_frame: panda DataFrame to store summary information
+    :return: empty panda DataFrame
+    """
+    print('RDS Groups found {} tagged clusters'.format(len(get_tagged_arn_set(tagging_client, 'rds:cluster'))))
+    return init_standard_data_frame()
+
+
+def check_for_untagged_s3_buckets(session, region, tagging_client, summary_data_frame):
+    """
+    List all untagged S3 resources
+    and estimate percent tagged resource of this type.
+    :param session:  session to the AWS account.
+    :param region: AWS Region:  us-east-1
+    :param tagging_client: boto3 client for reading tags
+    :param summary_data_frame: panda DataFrame to store summary information
+    :return: panda DataFrame of untagged buckets.
+    """
+    start_time = bud_helper_util.start_timer()
+
+    s3_client = aws_util.get_s3_client(session, region)
+    tagged_bucket_set = set(normalize_s3_list(get_tagged_arn_set_globally(session, 's3')))
+
+    # list_buckets has no pages.
+    response = s3_client.list_buckets()
+    s3_bucket_names = (curr_bucket['Name'] for curr_bucket in response['Buckets'])
+    untagged_set, total_s3_buckets = find_untagged(s3_bucket_names, tagged_bucket_set)
+    print('Found S3 {} untagged of {} total buckets'.format(len(untagged_set), total_s3_buckets))
+
+    data_frame = make_untagged_data_frame(untagged_set, 'All {} S3 buckets tagged.\n'.format(total_s3_buckets))
+
+    run_time = bud_helper_util.delta_time(start_time)
+    append_summary_data(summary_data_frame, 's3', run_time, len(untagged_set), total_s3_buckets)
+
+    return data_frame
+
+
+def get_untagged_scanners(ec2_columns=EC2_COLUMNS, make_ec2_row=None, tag_counter=None):
+    """
+    Check function of each type, for scan_untagged_types.
+    The EC2 sheet is the only one that differs by command.
+    :param ec2_columns: columns of the EC2 sheet.
+    :param make_ec2_row: function(instance, tags, name_value, spend_category_tag) that returns
+    a row for ec2_columns. Default make_default_ec2_row
+    :param tag_counter: TagCounter to count the Spend_Category values of EC2 instances, or None.
+    :return: dict of type to check function, like: {'ec2': check function}
+    """
+    if make_ec2_row is None:
+        make_ec2_row = make_default_ec2_row
+
+    return {
+        'autoscale': check_for_untagged_autoscaling_groups,
+        'cloudfront': check_for_untagged_cloud_front_distributions,
+        'dynamo': check_for_untagged_dynamo_tables,
+        'ec2': functools.partial(check_for_untagged_ec2_instances, ec2_columns=ec2_columns,
+                                 make_ec2_row=make_ec2_row, tag_counter=tag_counter),
+        'elasticache': check_for_untagged_elasticache_replication_groups,
+        'elb': check_for_untagged_load_balancers,
+        'logs': check_for_untagged_log_groups,
+        'rds': check_for_untagged_rds_instances,
+        'rds-cluster': check_for_untagged_rds_groups,
+        's3': check_for_untagged_s3_buckets
+    }
+
+
+def normalize_arn_list(arn_list):
+    """
+    Given a list of ARNs normalize the list by removing everything before the '\'
+    :param arn_list: list or ARNs in the format 'arn:aws:dynamodb:us-east-1:123456789012:table/FeedGroups'
+    :return: list normalized to look like 'FeedGroups'
+    """
+    normalize_list = []
+    for curr_arn in arn_list:
+        if '/' in curr_arn:
+            curr_arn = curr_arn.split('/')[1]
+        normalize_list.append(curr_arn)
+
+    return normalize_list
+
+
+def write_untagged_items(untagged_items_set, total_items_len, description):
+    """
+    Method to list all untagged items.
+    :param untagged_items_set:
+    :param total_items_len:
+    :param description:
+    :return:
+    """
+    ret_val = ''
+    untagged_set_len = len(untagged_items_set)
+    if untagged_set_len > 0:
+        ret_val = 'Found {} untagged of {} total {}\n'\
+            .format(untagged_set_len, total_items_len, description)
+        sorted_untagged_table_list = sorted(untagged_items_set)
+        index = 0
+        for curr_name in sorted_untagged_table_list:
+            index += 1
+            ret_val += '    {}) {}\n'.format(index, curr_name)
+    else:
+        ret_val = 'All {} {} tagged.\n'.format(total_items_len, description)
+
+    return ret_val
+
+
+def normalize_elasticache_list(elasticache_list):
+    """
+    Need to convert this:
+    arn:aws:elasticache:us-east-1:123456789012:cluster:recsys-b-20170525-0001-001
+    into:
+    recsys-b-20170525
+    and eliminate duplicates.
+
+
+    :param elasticache_list: Raw ARN with duplicates.
+    :return: deduplicated list like: recsys-b-20170525
+    """
+    trimmed_list = []
+    for curr_arn in elasticache_list:
+        post_fix = curr_arn.rpartition(':')[2]
+        element = post_fix.rpartition('-')[0]
+        element = element.rpartition('-')[0]
+        trimmed_list.append(element)
+    ret_val = list(set(trimmed_list))
+    return ret_val
+
+
+def normalize_s3_list(s3_arn_list):
+    """
+    Need to convert:
+    arn:aws:s3:::roku-downloader-123456789012
+    into:
+    roku-downloader-123456789012
+    :param s3_arn_list:
+    :return:
+    """
+    ret_val_list = []
+    for curr_arn in s3_arn_list:
+        post_fix = curr_arn.rpartition(':')[2]
+        ret_val_list.append(post_fix)
+    return ret_val_list
+
+
+# Star unit-test section. All test function must start with "test_..."
+
+def test_run_scans_deadline():
+    """
+    Slow scans are cut off at the deadline, and the rest still return their results.
+    :return: True if the test passes.
+    """
+    def slow(sec, value):
+        time.sleep(sec)
+        return value
+
+    def fail():
+        raise ValueError('fail')
+
+    scans = [Scan('fast', slow, (0.05, 1)), Scan('slow', slow, (5, 2)), Scan('error', fail, ())]
+    start = time.time()
+    run_scans('test', scans, deadline=time.time() + 0.5)
+    assert time.time() - start < 1.0
+    assert [s.status for s in scans] == [SCAN_DONE, SCAN_TIMEOUT, SCAN_FAILED], [s.status for s in scans]
+    assert scans[0].result == 1
+    assert get_incomplete_text(scans) == 'Incomplete: slow (timeout), error (failed)\n'
+
+    # Scans run at the same time.
+    scans = [Scan(str(i), slow, (0.2, i)) for i in range(8)]
+    start = time.time()
+    run_scans('test', scans)
+    assert time.time() - start < 0.6
+    assert [s.result for s in scans] == list(range(8))
+    return True
+
+
+def test_failed_type_is_reported():
+    """
+    A check that raises is listed as failed in the summary and the incomplete line,
+    not as an empty type.
+    :return: True if the test passes.
+    """
+    def ok_check(session, region, tagging_client, summary_data_frame):
+        append_summary_data(summary_data_frame, 'ok', 0.1, 1, 2)
+        data_frame = init_standard_data_frame()
+        data_frame.loc[0] = ['untagged-thing', 'n/a']
+        return data_frame
+
+    def failed_check(session, region, tagging_client, summary_data_frame):
+        raise ValueError('AccessDenied')
+
+    summary_data_frame = init_summary_data_frame()
+    data_frame_dict, scans = scan_untagged_types(
+        'test', ['ok', 'failed'], {'ok': ok_check, 'failed': failed_check}, None, None, None, summary_data_frame)
+    assert sorted(data_frame_dict.keys()) == ['ok']
+    assert [s.status for s in scans] == [SCAN_DONE, SCAN_FAILED]
+    assert summary_data_frame['AWS Type'].tolist() == ['ok', 'failed']
+    assert summary_data_frame['untagged instance'].tolist() == [1, SCAN_FAILED]
+    assert get_incomplete_text(scans) == 'Incomplete: failed (failed)\n'
+    return True
+
+
+class _FakePaginator(object):
+    """
+    Stands in for a boto3 paginator. Pages are made as they are read.
+    """
+    def __init__(self, make_pages):
+        self.make_pages = make_pages
+
+    def paginate(self, **kwargs):
+        return self.make_pages()
+
+
+class _FakeClient(object):
+    """
+    Stands in for a boto3 client, with a function that makes the pages of each operation.
+    """
+    def __init__(self, make_pages_by_operation):
+        self.make_pages_by_operation = make_pages_by_operation
+
+    def get_paginator(self, operation_name):
+        return _FakePaginator(self.make_pages_by_operation[operation_name])
+
+
+def test_benchmark_50k_resources(num_resources=50000):
+    """
+    List 50k log groups in pages of 1000, with 1 in 5 untagged, and tagged ARNs in
+    pages of 100 like the tagging API.
+    :param num_resources:
+    :return: True if the test passes.
+    """
+    arn_format = 'arn:aws:logs:us-east-1:123456789012:log-group:/app/group-{}'
+
+    def log_group_pages():
+        for page_start in range(0, num_resources, 1000):
+            yield {'logGroups': [{'logGroupName': '/app/group-{}'.format(i), 'arn': arn_format.format(i)}
+                                 for i in range(page_start, min(page_start + 1000, num_resources))]}
+
+    def tagged_pages():
+        tagged = [i for i in range(num_resources) if i % 5]
+        for page_start in range(0, len(tagged), 100):
+            yield {'ResourceTagMappingList': [{'ResourceARN': arn_format.format(i)}
+                                              for i in tagged[page_start:page_start + 100]]}
+
+    client = _FakeClient({'describe_log_groups': log_group_pages, 'get_resources': tagged_pages})
+
+    start = time.time()
+    tagged_arn_set = get_tagged_arn_set(client, 'logs:log-group')
+    tagged_sec = time.time() - start
+    untagged, total = find_untagged(
+        (g['arn'] for g in iter_resources(client, 'describe_log_groups', 'logGroups')), tagged_arn_set)
+    total_sec = time.time() - start
+
+    print('TIMER benchmark {} resources: tagged set {} sec, untagged {} sec'.format(
+        num_resources, round(tagged_sec, 3), round(total_sec - tagged_sec, 3)))
+    assert total == num_resources
+    assert len(tagged_arn_set) == num_resources - num_resources // 5
+    assert len(untagged) == num_resources // 5
+    assert arn_format.format(0) in untagged
+    return True
+
+
+if __name__ == '__main__':
+    test_run_scans_deadline()
+    test_failed_type_is_reported()
+    test_benchmark_50k_resources()
+    print('untagged_scanner tests passed.')